@@ -14,4 +14,4 @@
 # limitations under the License.
 __version__ = "0.21.1"
 __distribution_schema_version__ = "1.3"
-__observatory_schema_version__ = "1.1"
+__observatory_schema_version__ = "1.2"
@@ -9,11 +9,14 @@ from fink_mm.utils.fun_utils import (
     read_and_build_spark_submit,
     read_grb_admin_options,
     read_additional_spark_options,
+    read_output_format,
+    OutputFormat,
 )
 import fink_mm.utils.application as apps
 from fink_mm.init import get_config, init_logging, return_verbose_level
 from fink_mm.utils.fun_utils import build_spark_submit
 from fink_mm.distribution.apply_filters import apply_filters
+from fink_mm.utils.join_output import load_join_output
 
 from fink_utils.spark import schema_converter
 from pyspark.sql.types import StructType
@@ -128,7 +131,14 @@ def grb_distribution_stream(
 
 
 def grb_distribution(
-    grbdatapath, night, tinterval, exit_after, kafka_broker_server, username, password
+    grbdatapath,
+    night,
+    tinterval,
+    exit_after,
+    kafka_broker_server,
+    username,
+    password,
+    output_format=OutputFormat.WIDE,
 ):
     """
     Distribute the data return by the online mode over kafka.
@@ -150,6 +160,8 @@ def grb_distribution(
         username for writing into the kafka cluster
     password: string
         password for writing into the kafka cluster
+    output_format: OutputFormat
+        the layout of the join output, the normalised output is rebuilt with the wide schema.
 
     Return
     ------
@@ -191,23 +203,11 @@ def grb_distribution(
     grbdatapath += "/online"
 
     # force the mangrove columns to have the struct type
-    static_df = spark.read.parquet(
-        grbdatapath
-        + "/year={}/month={}/day={}".format(night[0:4], night[4:6], night[6:8])
-    )
+    static_df = load_join_output(spark, grbdatapath, night, output_format)
     # userschema = format_mangrove_col(userschema)
 
-    basepath = grbdatapath + "/year={}/month={}/day={}".format(
-        night[0:4], night[4:6], night[6:8]
-    )
-    path = basepath
-    df_grb_stream = (
-        spark.readStream.format("parquet")
-        .schema(static_df.schema)
-        .option("basePath", basepath)
-        .option("path", path)
-        .option("latestFirst", True)
-        .load()
+    df_grb_stream = load_join_output(
+        spark, grbdatapath, night, output_format, streaming=True
     )
 
     stream_distribute_list = grb_distribution_stream(
@@ -298,6 +298,8 @@ def launch_distribution(arguments):
         password_writer,
     ) = read_grb_admin_options(arguments, config, logger)
 
+    output_format = read_output_format(config, logger)
+
     application = apps.Application.DISTRIBUTION.build_application(
         logger,
         grb_datapath_prefix=grb_datapath_prefix,
@@ -307,6 +309,7 @@ def launch_distribution(arguments):
         kafka_broker=kafka_broker,
         username_writer=username_writer,
         password_writer=password_writer,
+        output_format=output_format,
     )
 
     spark_submit = build_spark_submit(
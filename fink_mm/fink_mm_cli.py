@@ -1,6 +1,6 @@
 """
 Usage:
-    fink_mm gcn_stream (start|monitor) [--restart] [options]
+    fink_mm gcn_stream (start|monitor|compact) [--restart] [options]
     fink_mm join_stream (offline|online) --night=<date> [--exit_after=<second>] [options]
     fink_mm distribute  --night=<date> [--exit_after=<second>] [options]
     fink_mm -h | --help
@@ -11,6 +11,8 @@ Options:
   start                            start to listening the gcn stream
   monitor                          print informations about the status of the gcn stream process
                                    and the collected data.
+  compact                          rewrite the closed day partitions of the gcn storage
+                                   into a few files sorted by trigger time.
   --restart                        restarts the gcn topics to the beginning.
   join_stream                      launch the script that join the ztf stream and the gcn stream
   offline                          launch the offline mode
@@ -42,6 +44,10 @@ def main():
             from fink_mm.utils.monitoring import gcn_stream_monitoring
 
             gcn_stream_monitoring(arguments)
+        elif arguments["compact"]:
+            from fink_mm.gcn_stream.gcn_compact import compact_gcn_stream
+
+            compact_gcn_stream(arguments)
 
     elif arguments["join_stream"]:
         if arguments["online"]:
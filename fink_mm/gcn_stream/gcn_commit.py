@@ -0,0 +1,178 @@
+import time
+import logging
+
+from confluent_kafka import TopicPartition
+from gcn_kafka import Consumer
+
+# default commit policy of the gcn stream
+DEFAULT_COMMIT_MAX_MESSAGES = 100
+DEFAULT_COMMIT_MAX_INTERVAL = 5  # seconds
+
+
+class GcnOffsetCommitter:
+    """
+    Commit the offsets of the gcn kafka stream by batch.
+    The committer only receives the messages whose notice has been durably written,
+    it commits asynchronously the highest of their offsets for each partition
+    when max_messages messages are waiting or max_interval seconds after the last commit.
+    """
+
+    def __init__(
+        self,
+        consumer: Consumer,
+        max_messages: int = DEFAULT_COMMIT_MAX_MESSAGES,
+        max_interval: float = DEFAULT_COMMIT_MAX_INTERVAL,
+    ):
+        """
+        Initialise the committer
+
+        Parameters
+        ----------
+        consumer : Consumer
+            the gcn kafka consumer
+        max_messages : int
+            the maximum number of durable messages waiting for a commit
+        max_interval : float
+            the maximum time in second between two commits
+
+        Example
+        -------
+        >>> committer = GcnOffsetCommitter(None, 3, 5)
+        >>> len(committer), committer.should_commit()
+        (0, False)
+        """
+        self.consumer = consumer
+        self.max_messages = max_messages
+        self.max_interval = max_interval
+        # (topic, partition) -> next offset to consume
+        self._offsets = {}
+        self._nb_messages = 0
+        self._last_commit = time.monotonic()
+
+    def __len__(self) -> int:
+        return self._nb_messages
+
+    def mark_offset(self, topic: str, partition: int, offset: int):
+        """
+        Mark a message as durably written
+
+        Parameters
+        ----------
+        topic : string
+            the topic of the message
+        partition : int
+            the partition of the message
+        offset : int
+            the offset of the message
+
+        Example
+        -------
+        >>> committer = GcnOffsetCommitter(None, 3, 5)
+        >>> committer.mark_offset("gcn.classic.voevent.FERMI_GBM_FIN_POS", 0, 10)
+        >>> committer.mark_offset("gcn.classic.voevent.FERMI_GBM_FIN_POS", 0, 11)
+        >>> len(committer), committer.should_commit()
+        (2, False)
+        >>> committer.mark_offset("igwn.gwalert", 0, 4)
+        >>> len(committer), committer.should_commit()
+        (3, True)
+        >>> committer.offsets()
+        [TopicPartition{topic=gcn.classic.voevent.FERMI_GBM_FIN_POS,partition=0,offset=12,leader_epoch=None,error=None}, TopicPartition{topic=igwn.gwalert,partition=0,offset=5,leader_epoch=None,error=None}]
+        """
+        key = (topic, partition)
+        # the committed offset is the offset of the next message to consume
+        self._offsets[key] = max(self._offsets.get(key, 0), offset + 1)
+        self._nb_messages += 1
+
+    def mark_durable(self, messages: list):
+        """
+        Mark kafka messages as durably written
+
+        Parameters
+        ----------
+        messages : list
+            the kafka messages whose notice has been written
+        """
+        for message in messages:
+            self.mark_offset(message.topic(), message.partition(), message.offset())
+
+    def offsets(self) -> list:
+        """
+        Return the offsets to commit
+
+        Returns
+        -------
+        list
+            the offsets to commit as TopicPartition, one by partition
+        """
+        return [
+            TopicPartition(topic, partition, offset)
+            for (topic, partition), offset in self._offsets.items()
+        ]
+
+    def should_commit(self, now: float = None) -> bool:
+        """
+        Return True if enough messages are waiting or if the last commit is too old
+
+        Parameters
+        ----------
+        now : float
+            the current time from time.monotonic, default to the current time
+
+        Returns
+        -------
+        boolean
+            True if the offsets must be committed
+
+        Example
+        -------
+        >>> committer = GcnOffsetCommitter(None, 3, 5)
+        >>> committer.mark_offset("igwn.gwalert", 0, 4)
+        >>> committer.should_commit(), committer.should_commit(time.monotonic() + 5)
+        (False, True)
+        """
+        if self._nb_messages == 0:
+            return False
+        if self._nb_messages >= self.max_messages:
+            return True
+        now = time.monotonic() if now is None else now
+        return (now - self._last_commit) >= self.max_interval
+
+    def commit(self, asynchronous: bool = True):
+        """
+        Commit the highest durable offset of each partition
+
+        Parameters
+        ----------
+        asynchronous : boolean
+            if False, wait for the broker acknowledgement, used before closing the consumer
+        """
+        if self._nb_messages != 0:
+            self.consumer.commit(offsets=self.offsets(), asynchronous=asynchronous)
+            self._offsets = {}
+            self._nb_messages = 0
+        self._last_commit = time.monotonic()
+
+    def maybe_commit(self):
+        """
+        Commit asynchronously if the commit policy is reached
+        """
+        if self.should_commit():
+            self.commit()
+
+
+def log_commit_error(logger: logging.Logger, err, partitions: list):
+    """
+    Commit callback of the gcn kafka consumer, log the failed asynchronous commits.
+    A failed commit only means that the messages will be consumed again after a restart.
+
+    Parameters
+    ----------
+    logger : logger object
+        logger object for logs.
+    err : KafkaError
+        the commit error, None if the commit succeed
+    partitions : list
+        the committed offsets
+    """
+    if err is not None:  # pragma: no cover
+        logger.error("commit of the gcn offsets {} failed: {}".format(partitions, err))
@@ -0,0 +1,564 @@
+import time
+import json
+import logging
+import posixpath
+import datetime as dt
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from pyarrow.fs import FileSystem, FileSelector, FileType, LocalFileSystem
+
+from fink_mm.init import get_config, init_logging, return_verbose_level
+from fink_mm.utils.fun_utils import get_hdfs_connector
+from fink_mm.gcn_stream.gcn_index import GCN_INDEX_SCHEMA, rewrite_gcn_index
+
+# a day partition is compacted compact_after days after its end
+DEFAULT_COMPACT_AFTER = 1
+# the number of gcn by row group in the compacted files
+DEFAULT_ROW_GROUP_SIZE = 10000
+# prefix of the compaction manifests written in the partitions,
+# the files starting with an underscore are ignored by the spark and pyarrow readers
+COMPACTION_MANIFEST_PREFIX = "_compaction_"
+
+
+def is_data_file(path: str) -> bool:
+    """
+    Return True if the path is a gcn file, the files starting with an underscore
+    or a dot are ignored as by the spark and pyarrow readers.
+
+    Parameters
+    ----------
+    path : string
+        the path of the file
+
+    Returns
+    -------
+    boolean
+        True if the file contains gcn
+
+    Example
+    -------
+    >>> is_data_file("gcn/year=2024/month=01/day=15/gcn_1705409374.5_0.parquet")
+    True
+    >>> is_data_file("gcn/year=2024/month=01/day=15/.compacted_1705409374.5.parquet")
+    False
+    """
+    name = posixpath.basename(path)
+    return name.endswith(".parquet") and not name.startswith(("_", "."))
+
+
+def list_data_files(partition_path: str, gcn_fs: FileSystem = None) -> list:
+    """
+    Return the gcn files of a day partition, see is_data_file
+
+    Parameters
+    ----------
+    partition_path : string
+        the path of the day partition
+    gcn_fs : FileSystem
+        the file system of the gcn storage
+
+    Returns
+    -------
+    list
+        the sorted paths of the gcn files
+
+    Example
+    -------
+    >>> from fink_mm.gcn_stream.gcn_writer import write_gcn_dataframe
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> gcn = pd.read_parquet(grb_data).assign(year="2024", month="01", day="15")
+    >>> for i in range(2):
+    ...     write_gcn_dataframe(gcn.iloc[[i]], tmp_dir_gcn.name, "gcn_{}".format(i))
+    >>> [os.path.basename(path) for path in list_data_files(tmp_dir_gcn.name + "/year=2024/month=01/day=15")]
+    ['gcn_0_0.parquet', 'gcn_1_0.parquet']
+    """
+    gcn_fs = gcn_fs or LocalFileSystem()
+    return sorted(
+        file_info.path
+        for file_info in gcn_fs.get_file_info(FileSelector(partition_path))
+        if file_info.type == FileType.File and is_data_file(file_info.path)
+    )
+
+
+def list_day_partitions(gcn_rawdatapath: str, gcn_fs: FileSystem = None) -> list:
+    """
+    Return the day partitions of the gcn storage
+
+    Parameters
+    ----------
+    gcn_rawdatapath : string
+        the root path of the gcn storage
+    gcn_fs : FileSystem
+        the file system of the gcn storage
+
+    Returns
+    -------
+    list
+        the (date, path) of each day partition sorted by date
+
+    Example
+    -------
+    >>> partitions = list_day_partitions("fink_mm/test/test_data/gcn_test/raw")
+    >>> [str(partition_date) for partition_date, _ in partitions]
+    ['2024-01-12', '2024-01-14', '2024-01-15', '2024-01-27', '2024-01-28']
+    >>> partitions[2][1]
+    'fink_mm/test/test_data/gcn_test/raw/year=2024/month=01/day=15'
+    """
+    gcn_fs = gcn_fs or LocalFileSystem()
+    partitions = []
+    for file_info in gcn_fs.get_file_info(
+        FileSelector(gcn_rawdatapath, recursive=True)
+    ):
+        if file_info.type != FileType.Directory:
+            continue
+        # keep only the year=YYYY/month=MM/day=DD directories
+        levels = posixpath.relpath(file_info.path, gcn_rawdatapath).split("/")
+        if len(levels) != 3 or not all("=" in level for level in levels):
+            continue
+        year, month, day = (int(level.split("=", 1)[1]) for level in levels)
+        partitions.append((dt.date(year, month, day), file_info.path))
+    return sorted(partitions)
+
+
+def list_compaction_manifests(partition_path: str, gcn_fs: FileSystem = None) -> list:
+    """
+    Return the compaction manifests of a day partition, a manifest is written by
+    compact_partition before the swap of the files and removed once the gcn index is updated,
+    see clear_compaction_manifests.
+
+    Parameters
+    ----------
+    partition_path : string
+        the path of the day partition
+    gcn_fs : FileSystem
+        the file system of the gcn storage
+
+    Returns
+    -------
+    list
+        the paths of the compaction manifests
+
+    Example
+    -------
+    >>> list_compaction_manifests("fink_mm/test/test_data/gcn_test/raw/year=2024/month=01/day=15")
+    []
+    """
+    gcn_fs = gcn_fs or LocalFileSystem()
+    return sorted(
+        file_info.path
+        for file_info in gcn_fs.get_file_info(FileSelector(partition_path))
+        if file_info.type == FileType.File
+        if posixpath.basename(file_info.path).startswith(COMPACTION_MANIFEST_PREFIX)
+    )
+
+
+def clear_compaction_manifests(partition_path: str, gcn_fs: FileSystem = None):
+    """
+    Remove the compaction manifests of a day partition once the gcn index
+    points to the compacted files.
+
+    Parameters
+    ----------
+    partition_path : string
+        the path of the day partition
+    gcn_fs : FileSystem
+        the file system of the gcn storage
+    """
+    gcn_fs = gcn_fs or LocalFileSystem()
+    for path in list_compaction_manifests(partition_path, gcn_fs):
+        gcn_fs.delete_file(path)
+
+
+def resolve_compactions(partition_path: str, gcn_fs: FileSystem = None) -> list:
+    """
+    Finish the compactions of a day partition interrupted by a crash.
+    If the compacted file of a manifest has been renamed, the files it replaces are removed,
+    the gcn would be read twice otherwise. If the crash occured before the rename,
+    the replaced files are intact and the hidden compacted file and the manifest are removed.
+
+    Parameters
+    ----------
+    partition_path : string
+        the path of the day partition
+    gcn_fs : FileSystem
+        the file system of the gcn storage
+
+    Returns
+    -------
+    list
+        the files replaced by the renamed compacted files, their gcn index entries are outdated.
+        The manifests of these compactions are kept until the next compaction of the partition.
+
+    Example
+    -------
+    >>> from fink_mm.gcn_stream.gcn_writer import write_gcn_dataframe
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> gcn = pd.read_parquet(grb_data).assign(year="2024", month="01", day="15")
+    >>> for i in range(3):
+    ...     write_gcn_dataframe(gcn.iloc[[i]], tmp_dir_gcn.name, "gcn_{}".format(i))
+    >>> partition = tmp_dir_gcn.name + "/year=2024/month=01/day=15"
+    >>> _ = compact_partition(partition)
+
+    a crash during the removal of the compacted files, the last gcn file has not been removed
+    >>> write_gcn_dataframe(gcn.iloc[[2]], tmp_dir_gcn.name, "gcn_2")
+    >>> len(pd.read_parquet(partition))
+    4
+    >>> [os.path.basename(path) for path in resolve_compactions(partition)]
+    ['gcn_0_0.parquet', 'gcn_1_0.parquet', 'gcn_2_0.parquet']
+    >>> len(pd.read_parquet(partition)), len(list_compaction_manifests(partition))
+    (3, 1)
+    """
+    gcn_fs = gcn_fs or LocalFileSystem()
+    replaced_files = []
+    for manifest_path in list_compaction_manifests(partition_path, gcn_fs):
+        with gcn_fs.open_input_stream(manifest_path) as f:
+            manifest = json.loads(f.read())
+
+        compacted_path = posixpath.join(partition_path, manifest["compacted"])
+        if gcn_fs.get_file_info(compacted_path).type == FileType.NotFound:
+            tmp_path = posixpath.join(partition_path, "." + manifest["compacted"])
+            if gcn_fs.get_file_info(tmp_path).type != FileType.NotFound:
+                gcn_fs.delete_file(tmp_path)
+            gcn_fs.delete_file(manifest_path)
+            continue
+
+        for name in manifest["replaced"]:
+            path = posixpath.join(partition_path, name)
+            if gcn_fs.get_file_info(path).type != FileType.NotFound:
+                gcn_fs.delete_file(path)
+            replaced_files.append(path)
+    return replaced_files
+
+
+def compact_partition(
+    partition_path: str,
+    gcn_fs: FileSystem = None,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+) -> tuple:
+    """
+    Rewrite the gcn files of a day partition into a single file sorted by triggerTimejd.
+    The schemas of the files are merged, the missing columns of the oldest files are filled with nulls.
+
+    The compacted file is first written with a hidden name and renamed once complete,
+    the compacted files are removed only after the rename so a reader of the partition
+    never miss a gcn, at worst it reads them twice during the swap.
+    The files written in the partition during the compaction are kept.
+
+    A manifest listing the compacted files is written before the swap and kept until the
+    gcn index is updated (see clear_compaction_manifests). A compaction interrupted by a crash
+    is finished at the next compaction of the partition, see resolve_compactions.
+
+    Parameters
+    ----------
+    partition_path : string
+        the path of the day partition
+    gcn_fs : FileSystem
+        the file system of the gcn storage
+    row_group_size : int
+        the number of gcn by row group in the compacted file
+
+    Returns
+    -------
+    tuple
+        the compacted files, the files replaced by an interrupted compaction (see resolve_compactions)
+        and the index of the compacted file as a pyarrow Table with the paths relative to the partition.
+        If the partition contains less than two files and no interrupted compaction,
+        the partition is not compacted and the index is None.
+
+    Example
+    -------
+    >>> from fink_mm.gcn_stream.gcn_writer import write_gcn_dataframe
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> gcn = pd.read_parquet(grb_data).assign(year="2024", month="01", day="15")
+    >>> for i in range(len(gcn)):
+    ...     write_gcn_dataframe(gcn.iloc[[i]], tmp_dir_gcn.name, "gcn_{}".format(i))
+    >>> partition = tmp_dir_gcn.name + "/year=2024/month=01/day=15"
+    >>> gcn_files, replaced_files, index = compact_partition(partition, row_group_size=10)
+    >>> compacted_files = [name for name in os.listdir(partition) if is_data_file(name)]
+    >>> len(gcn_files), len(replaced_files), len(compacted_files), compacted_files[0].startswith("compacted_")
+    (23, 0, 1, True)
+    >>> index.num_rows, pq.ParquetFile(partition + "/" + compacted_files[0]).num_row_groups
+    (23, 3)
+    >>> compacted_gcn = pd.read_parquet(partition)
+    >>> compacted_gcn["triggerTimejd"].is_monotonic_increasing
+    True
+    >>> sorted_gcn = pd.read_parquet(grb_data).sort_values("triggerTimejd", kind="stable")
+    >>> assert_frame_equal(compacted_gcn, sorted_gcn.reset_index(drop=True))
+
+    >>> clear_compaction_manifests(partition)
+    >>> gcn_files, replaced_files, index = compact_partition(partition)
+    >>> len(gcn_files), replaced_files, index
+    (1, [], None)
+    """
+    gcn_fs = gcn_fs or LocalFileSystem()
+    replaced_files = resolve_compactions(partition_path, gcn_fs)
+    gcn_files = list_data_files(partition_path, gcn_fs)
+    # the partition of an interrupted compaction is compacted again to rebuild its index
+    if len(gcn_files) < 2 and len(replaced_files) == 0:
+        return gcn_files, replaced_files, None
+
+    # the schema of the gcn has grown with the versions of the gcn stream,
+    # the pandas metadata and index of the files describe their own rows and are dropped
+    schema = pa.unify_schemas(
+        [pq.read_schema(gcn_fs.open_input_file(path)) for path in gcn_files]
+    ).remove_metadata()
+    schema = pa.schema(
+        [field for field in schema if not field.name.startswith("__index_level_")]
+    )
+    gcn_table = ds.dataset(
+        gcn_files, schema=schema, format="parquet", filesystem=gcn_fs
+    ).to_table()
+    gcn_table = gcn_table.take(
+        pc.sort_indices(gcn_table, sort_keys=[("triggerTimejd", "ascending")])
+    )
+
+    compacted_name = "compacted_{}.parquet".format(time.time())
+    tmp_path = posixpath.join(partition_path, "." + compacted_name)
+    pq.write_table(
+        gcn_table, tmp_path, row_group_size=row_group_size, filesystem=gcn_fs
+    )
+
+    # the manifests of the previous interrupted compactions are replaced by the new manifest
+    previous_manifests = list_compaction_manifests(partition_path, gcn_fs)
+    manifest = {
+        "compacted": compacted_name,
+        "replaced": [posixpath.basename(path) for path in gcn_files + replaced_files],
+    }
+    manifest_path = posixpath.join(
+        partition_path, COMPACTION_MANIFEST_PREFIX + compacted_name + ".json"
+    )
+    with gcn_fs.open_output_stream(manifest_path) as f:
+        f.write(json.dumps(manifest).encode("utf-8"))
+
+    gcn_fs.move(tmp_path, posixpath.join(partition_path, compacted_name))
+    for path in previous_manifests:
+        gcn_fs.delete_file(path)
+    for path in gcn_files:
+        gcn_fs.delete_file(path)
+
+    # the row groups are written in order, gcn i is in the row group i // row_group_size
+    index = pa.table(
+        {
+            "triggerId": gcn_table.column("triggerId").cast(pa.string()),
+            "gcn_status": gcn_table.column("gcn_status").cast(pa.string()),
+            "path": pa.array([compacted_name] * gcn_table.num_rows, pa.string()),
+            "row_group": pa.array(
+                [i // row_group_size for i in range(gcn_table.num_rows)], pa.int32()
+            ),
+        },
+        schema=GCN_INDEX_SCHEMA,
+    )
+    return gcn_files, replaced_files, index
+
+
+def compact_gcn_storage(
+    gcn_rawdatapath: str,
+    gcn_fs: FileSystem = None,
+    compact_after: int = DEFAULT_COMPACT_AFTER,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    today: dt.date = None,
+    logger: logging.Logger = None,
+    logs: bool = False,
+) -> dict:
+    """
+    Compact the closed day partitions of the gcn storage, see compact_partition.
+    A day partition is closed compact_after days after its end, the gcn stream
+    rarely writes gcn in a closed partition and these gcn are compacted by the next run.
+    The gcn index is updated with the location of the compacted gcn,
+    then the compaction manifests of the compacted partitions are removed.
+
+    Parameters
+    ----------
+    gcn_rawdatapath : string
+        the root path of the gcn storage
+    gcn_fs : FileSystem
+        the file system of the gcn storage
+    compact_after : int
+        the number of days after the end of a day partition before its compaction
+    row_group_size : int
+        the number of gcn by row group in the compacted files
+    today : datetime.date
+        the current date, default to the current UTC date
+    logger : logger object
+        logger object for logs.
+    logs: boolean
+        if true, print logs
+
+    Returns
+    -------
+    dict
+        for each closed partition, the number of gcn files before and after the compaction
+        and the number of these files left by an interrupted compaction (removed without being read)
+
+    Example
+    -------
+    >>> from fink_mm.gcn_stream.gcn_writer import write_gcn_dataframe
+    >>> from fink_mm.gcn_stream.gcn_index import read_gcn
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> gcn = pd.read_parquet(grb_data)
+    >>> for i in range(len(gcn)):
+    ...     day = "15" if i < 20 else "16"
+    ...     write_gcn_dataframe(
+    ...         gcn.iloc[[i]].assign(year="2024", month="01", day=day),
+    ...         tmp_dir_gcn.name,
+    ...         "gcn_{}".format(i),
+    ...         gcn_index=True,
+    ...     )
+    >>> compact_gcn_storage(tmp_dir_gcn.name, today=dt.date(2024, 1, 17))
+    {'year=2024/month=01/day=15': (20, 1, 0)}
+    >>> compact_gcn_storage(tmp_dir_gcn.name, today=dt.date(2024, 1, 18))
+    {'year=2024/month=01/day=15': (1, 1, 0), 'year=2024/month=01/day=16': (3, 1, 0)}
+    >>> len(pd.read_parquet(tmp_dir_gcn.name)), os.listdir(tmp_dir_gcn.name + "/_gcn_index")[0].startswith("index_")
+    (23, True)
+
+    a compaction interrupted before the removal of the compacted files, one of them is left
+    >>> partition = tmp_dir_gcn.name + "/year=2024/month=01/day=17"
+    >>> for i in range(2):
+    ...     write_gcn_dataframe(gcn.iloc[[i]].assign(year="2024", month="01", day="17"), tmp_dir_gcn.name, "gcn_{}".format(i))
+    >>> _ = compact_partition(partition)
+    >>> write_gcn_dataframe(gcn.iloc[[1]].assign(year="2024", month="01", day="17"), tmp_dir_gcn.name, "gcn_1")
+    >>> compact_gcn_storage(tmp_dir_gcn.name, today=dt.date(2024, 1, 19))["year=2024/month=01/day=17"]
+    (2, 1, 1)
+    >>> len(pd.read_parquet(partition))
+    2
+    >>> read_gcn(tmp_dir_gcn.name, "S240115ak", "update_0", columns=["triggerId", "gcn_status"])
+       triggerId gcn_status
+    0  S240115ak   update_0
+    """
+    gcn_fs = gcn_fs or LocalFileSystem()
+    today = dt.datetime.utcnow().date() if today is None else today
+
+    report = {}
+    removed_paths = []
+    new_index = []
+    compacted_partitions = []
+    for partition_date, partition_path in list_day_partitions(gcn_rawdatapath, gcn_fs):
+        if (today - partition_date).days <= compact_after:
+            continue
+
+        partition = posixpath.relpath(partition_path, gcn_rawdatapath)
+        try:
+            nb_before = len(list_data_files(partition_path, gcn_fs))
+            gcn_files, replaced_files, index = compact_partition(
+                partition_path, gcn_fs, row_group_size
+            )
+        except Exception:
+            if logger is not None:
+                logger.error(
+                    "compaction of the partition {} failed".format(partition),
+                    exc_info=1,
+                )
+            continue
+
+        # the files left by an interrupted compaction are removed by resolve_compactions
+        nb_leftover = nb_before - len(gcn_files)
+        if index is None:
+            report[partition] = (nb_before, len(gcn_files), nb_leftover)
+            continue
+
+        report[partition] = (nb_before, 1, nb_leftover)
+        compacted_partitions.append(partition_path)
+        removed_paths += [
+            posixpath.relpath(path, gcn_rawdatapath)
+            for path in gcn_files + replaced_files
+        ]
+        new_index.append(
+            index.set_column(
+                2,
+                "path",
+                pa.array(
+                    [
+                        posixpath.join(partition, path)
+                        for path in index.column("path").to_pylist()
+                    ],
+                    pa.string(),
+                ),
+            )
+        )
+        if logs:  # pragma: no cover
+            logger.info(
+                "partition {} compacted: {} files -> 1 file".format(
+                    partition, nb_before
+                )
+            )
+
+    if len(new_index) != 0:
+        rewrite_gcn_index(
+            gcn_rawdatapath, removed_paths, pa.concat_tables(new_index), gcn_fs
+        )
+    for partition_path in compacted_partitions:
+        clear_compaction_manifests(partition_path, gcn_fs)
+    return report
+
+
+def compact_gcn_stream(arguments):  # pragma: no cover
+    """
+    Compact the closed day partitions of the gcn stream storage and print
+    the number of gcn files before and after the compaction.
+    Can run while the gcn stream is running.
+
+    Parameters
+    ----------
+    arguments : dictionnary
+        arguments parse by docopt from the command line
+
+    Returns
+    -------
+    None
+    """
+    config = get_config(arguments)
+    logger = init_logging()
+    logs, _ = return_verbose_level(arguments, config, logger)
+
+    try:
+        gcn_rawdatapath = config["PATH"]["online_gcn_data_prefix"]
+    except Exception as e:
+        logger.error("Config entry not found \n\t {}".format(e))
+        exit(1)
+
+    try:
+        fs_host = config["HDFS"]["host"]
+        fs_port = int(config["HDFS"]["port"])
+        fs_user = config["HDFS"]["user"]
+        gcn_fs = get_hdfs_connector(fs_host, fs_port, fs_user)
+    except Exception as e:
+        if logs:
+            logger.info("config entry not found for hdfs filesystem: \n\t{}".format(e))
+        gcn_fs = None
+
+    try:
+        compact_after = config.getint(
+            "GCN_STREAM", "compact_after", fallback=DEFAULT_COMPACT_AFTER
+        )
+        row_group_size = config.getint(
+            "GCN_STREAM", "compact_row_group_size", fallback=DEFAULT_ROW_GROUP_SIZE
+        )
+    except ValueError as e:
+        logger.error("Bad config entry for the gcn compaction \n\t {}".format(e))
+        exit(1)
+
+    report = compact_gcn_storage(
+        gcn_rawdatapath,
+        gcn_fs,
+        compact_after,
+        row_group_size,
+        logger=logger,
+        logs=logs,
+    )
+
+    nb_before = sum(before for before, _, _ in report.values())
+    nb_after = sum(after for _, after, _ in report.values())
+    for partition, (before, after, leftover) in report.items():
+        print("{}: {} -> {} files".format(partition, before, after))
+        if leftover != 0:
+            print(
+                "\t{} files left by an interrupted compaction removed".format(leftover)
+            )
+    print(
+        "{} closed partitions compacted: {} -> {} files".format(
+            len(report), nb_before, nb_after
+        )
+    )
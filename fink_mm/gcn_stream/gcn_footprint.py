@@ -0,0 +1,168 @@
+import logging
+import numpy as np
+import pandas as pd
+
+import fink_mm.gcn_stream.gcn_reader as gr
+from fink_mm.utils.fun_utils import (
+    get_observatory,
+    is_circular_footprint,
+    has_plausible_error,
+    footprint_hpix_column,
+    FOOTPRINT_MOC,
+    FOOTPRINT_ADAPTIVE,
+    FOOTPRINT_AREA,
+)
+from fink_mm.utils.moc import (
+    discs_to_pixels,
+    discs_to_ranges,
+    degrade_ranges,
+    area_to_order,
+)
+
+
+def add_footprint_columns(df: pd.DataFrame, nsides: list) -> pd.DataFrame:
+    """
+    Compute the footprint of the decoded gcn and add it as new columns,
+    see FOOTPRINT_MOC, FOOTPRINT_ADAPTIVE, FOOTPRINT_AREA and footprint_hpix_column.
+    The join reads these columns instead of computing the footprints at each micro-batch.
+    The circular footprints are computed from the ra, dec and err_arcmin columns,
+    the raw event is decoded once for the gcn with a skymap or without a plausible err_arcmin.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the decoded gcn
+    nsides : list
+        the healpix map resolutions of the precomputed pixel lists
+
+    Returns
+    -------
+    pd.DataFrame
+        the decoded gcn with the footprint columns
+
+    Examples
+    --------
+    >>> gcn = pd.read_parquet(grb_data)
+    >>> gcn = add_footprint_columns(gcn, [4, 8])
+    >>> sorted(c for c in gcn.columns if c.startswith("footprint_"))
+    ['footprint_adaptive', 'footprint_area', 'footprint_hpix_4', 'footprint_hpix_8', 'footprint_moc']
+
+    the precomputed columns are the footprints computed by the join
+    >>> all(
+    ...     list(row.footprint_hpix_8) == list(get_observatory(row.observatory, row.raw_event).get_pixels(8))
+    ...     and list(row.footprint_moc) == get_observatory(row.observatory, row.raw_event).get_moc_ranges().ravel().tolist()
+    ...     for row in gcn.itertuples()
+    ... )
+    True
+    >>> gcn.sort_values("triggerId")[["triggerId", "footprint_area"]].drop_duplicates("triggerId").round(4).head(3)
+       triggerId  footprint_area
+    0      10472          0.0089
+    1  727009399         61.9321
+    4  727029942         69.3978
+    """
+    is_circle = is_circular_footprint(df["observatory"]) & has_plausible_error(
+        df["observatory"], df["err_arcmin"]
+    )
+    nb_gcn = len(df)
+    moc = [None] * nb_gcn
+    adaptive = [None] * nb_gcn
+    hpix = {nside: [None] * nb_gcn for nside in nsides}
+    area = np.zeros(nb_gcn)
+
+    # the circular footprints are computed from the stored columns for all the gcn at once
+    circle_rows = np.flatnonzero(is_circle)
+    ra = df["ra"].values[circle_rows]
+    dec = df["dec"].values[circle_rows]
+    err_deg = df["err_arcmin"].values[circle_rows] / 60
+
+    # the ranges cover the association radius (1.5 times the error box)
+    radius = 1.5 * err_deg
+    for i, ranges, disc_radius in zip(
+        circle_rows, discs_to_ranges(ra, dec, radius), radius
+    ):
+        moc[i] = ranges.ravel()
+        adaptive[i] = degrade_ranges(
+            ranges, area_to_order(np.pi * disc_radius**2)
+        ).ravel()
+    for nside in nsides:
+        for i, ipix in zip(circle_rows, discs_to_pixels(ra, dec, err_deg, nside)):
+            hpix[nside][i] = ipix
+    area[circle_rows] = np.pi * err_deg**2
+
+    for i in np.flatnonzero(~is_circle):
+        observatory = get_observatory(
+            df["observatory"].iloc[i], df["raw_event"].iloc[i]
+        )
+        ranges = observatory.get_moc_ranges()
+        moc[i] = ranges.ravel()
+        adaptive[i] = degrade_ranges(ranges, observatory.get_join_order()).ravel()
+        for nside in nsides:
+            hpix[nside][i] = np.asarray(observatory.get_pixels(nside), dtype=np.int64)
+        area[i] = observatory.get_footprint_area()
+
+    df = df.copy()
+    df[FOOTPRINT_MOC] = moc
+    df[FOOTPRINT_ADAPTIVE] = adaptive
+    df[FOOTPRINT_AREA] = area
+    for nside in nsides:
+        df[footprint_hpix_column(nside)] = hpix[nside]
+    return df
+
+
+def parse_gcn_with_footprint(
+    gcn: bytes,
+    topic: str,
+    logger: logging.Logger,
+    logs: bool,
+    is_test: bool,
+    footprint_nsides: list = None,
+) -> pd.DataFrame:
+    """
+    Parse a gcn and add its precomputed footprint, see parse_gcn and add_footprint_columns.
+    If the footprint computation fails, the gcn is returned without the footprint columns
+    and the join computes its footprint.
+
+    Parameters
+    ----------
+    gcn : bytes
+        the notice coming from the stream
+    topic : str
+        the emitting topic
+    logger : logger object
+        logger object for logs.
+    logs: boolean
+        if true, print logs
+    is_test: boolean
+        if is_test is true, accept the test event
+    footprint_nsides : list
+        the healpix map resolutions of the precomputed pixel lists,
+        if None, the footprint is not precomputed
+
+    Returns
+    -------
+    pd.DataFrame or None
+        the gcn as a dataframe
+
+    Examples
+    --------
+    >>> f = open('fink_mm/test/test_data/voevent_number=9897.xml').read().encode("UTF-8")
+    >>> df = parse_gcn_with_footprint(f, "gcn.classic.voevent.FERMI_GBM_FIN_POS", logger, False, False, [4])
+    >>> list(df["footprint_hpix_4"].values[0])
+    [33, 34, 49, 50, 51, 64, 65, 66, 81, 82, 83, 97, 98, 114]
+    >>> "footprint_moc" in parse_gcn_with_footprint(f, "gcn.classic.voevent.FERMI_GBM_FIN_POS", logger, False, False)
+    False
+    """
+    df = gr.parse_gcn(gcn, topic, logger, logs, is_test)
+    if df is None or footprint_nsides is None:
+        return df
+
+    try:
+        return add_footprint_columns(df, footprint_nsides)
+    except Exception:
+        logger.error(
+            "error while computing the footprint of the gcn {}, the footprint will be computed by the join".format(
+                df["triggerId"].values[0]
+            ),
+            exc_info=1,
+        )
+        return df
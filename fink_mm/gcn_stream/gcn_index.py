@@ -0,0 +1,369 @@
+import time
+import posixpath
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pyarrow.compute as pc
+
+from pyarrow.fs import FileSystem, FileSelector, FileType, LocalFileSystem
+
+# name of the gcn index in the gcn storage,
+# the directories starting with an underscore are ignored by the spark and pyarrow readers
+GCN_INDEX_DIR = "_gcn_index"
+
+# schema of the gcn index, one row by written gcn
+#   path: the gcn file relative to the root of the gcn storage
+#   row_group: the row group containing the gcn in this file
+GCN_INDEX_SCHEMA = pa.schema(
+    [
+        ("triggerId", pa.string()),
+        ("gcn_status", pa.string()),
+        ("path", pa.string()),
+        ("row_group", pa.int32()),
+    ]
+)
+
+
+def gcn_index_path(gcn_rawdatapath: str) -> str:
+    """
+    Return the location of the index of a gcn storage
+
+    Parameters
+    ----------
+    gcn_rawdatapath : string
+        the root path of the gcn storage
+
+    Returns
+    -------
+    string
+        the root path of the gcn index
+
+    Example
+    -------
+    >>> gcn_index_path("gcn_storage/raw")
+    'gcn_storage/raw/_gcn_index'
+    """
+    return posixpath.join(gcn_rawdatapath, GCN_INDEX_DIR)
+
+
+def build_gcn_index(
+    df: pd.DataFrame,
+    written_files: list,
+    gcn_rawdatapath: str,
+    gcn_fs: FileSystem = None,
+) -> pa.Table:
+    """
+    Build the index of the gcn written by write_gcn_dataframe.
+    The gcn of a partition are written in a single file, if this file contains a single
+    row group all the gcn of the partition are in this row group, otherwise the keys
+    of the gcn are read back from each row group.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the written gcn with their gcn_status
+    written_files : list
+        the files written by pyarrow, see the file_visitor argument of pyarrow.dataset.write_dataset
+    gcn_rawdatapath : string
+        the root path of the gcn storage
+    gcn_fs : FileSystem
+        the file system of the gcn storage
+
+    Returns
+    -------
+    pa.Table
+        the index of the written gcn
+
+    Example
+    -------
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> gcn = pd.read_parquet(grb_data).assign(year="2024", month="01", day="15")
+    >>> written_files = []
+    >>> ds.write_dataset(
+    ...     pa.Table.from_pandas(gcn),
+    ...     tmp_dir_gcn.name,
+    ...     format="parquet",
+    ...     partitioning=["year", "month", "day"],
+    ...     partitioning_flavor="hive",
+    ...     file_visitor=written_files.append,
+    ...     min_rows_per_group=10,
+    ...     max_rows_per_group=10,
+    ... )
+    >>> index = build_gcn_index(gcn, written_files, tmp_dir_gcn.name).to_pandas()
+    >>> index.groupby("row_group").size().to_dict()
+    {0: 10, 1: 10, 2: 3}
+    >>> index[index["triggerId"] == "S240115x"][["gcn_status", "path", "row_group"]].values
+    array([['initial', 'year=2024/month=01/day=15/part-0.parquet', 2],
+           ['update_0', 'year=2024/month=01/day=15/part-0.parquet', 2]], dtype=object)
+    """
+    index_parts = []
+    for written_file in written_files:
+        path = posixpath.relpath(written_file.path, gcn_rawdatapath)
+
+        if written_file.metadata.num_row_groups == 1:
+            # the partition of the file, 'year=2024/month=01/day=15/...'
+            partition = dict(
+                key_value.split("=", 1)
+                for key_value in path.split("/")[:-1]
+                if "=" in key_value
+            )
+            mask = pd.Series(True, index=df.index)
+            for col_name, value in partition.items():
+                mask &= df[col_name].astype(str) == value
+            keys = df.loc[mask, ["triggerId", "gcn_status"]].assign(row_group=0)
+        else:
+            parquet_file = pq.ParquetFile(
+                (gcn_fs or LocalFileSystem()).open_input_file(written_file.path)
+            )
+            keys = pd.concat(
+                [
+                    parquet_file.read_row_group(
+                        row_group, columns=["triggerId", "gcn_status"]
+                    )
+                    .to_pandas()
+                    .assign(row_group=row_group)
+                    for row_group in range(parquet_file.num_row_groups)
+                ]
+            )
+
+        index_parts.append(
+            pd.DataFrame(
+                {
+                    "triggerId": keys["triggerId"].astype(str).values,
+                    "gcn_status": keys["gcn_status"].astype(str).values,
+                    "path": path,
+                    "row_group": keys["row_group"].values,
+                }
+            )
+        )
+
+    index = pd.concat(index_parts, ignore_index=True).sort_values(
+        ["triggerId", "gcn_status"]
+    )
+    return pa.Table.from_pandas(index, schema=GCN_INDEX_SCHEMA, preserve_index=False)
+
+
+def write_gcn_index(
+    index: pa.Table, gcn_rawdatapath: str, basename: str, gcn_fs: FileSystem = None
+):
+    """
+    Write an index file in the gcn index, one index file is written for each write of gcn.
+
+    Parameters
+    ----------
+    index : pa.Table
+        the index of the written gcn, see build_gcn_index
+    gcn_rawdatapath : string
+        the root path of the gcn storage
+    basename : string
+        the name of the index file, the basename of the written gcn files
+    gcn_fs : FileSystem
+        the file system of the gcn storage
+    """
+    gcn_fs = gcn_fs or LocalFileSystem()
+    index_path = gcn_index_path(gcn_rawdatapath)
+    gcn_fs.create_dir(index_path, recursive=True)
+    pq.write_table(
+        index,
+        posixpath.join(index_path, "{}.parquet".format(basename)),
+        filesystem=gcn_fs,
+    )
+
+
+def lookup_gcn_index(
+    gcn_rawdatapath: str, triggerId: str, gcn_status: str, gcn_fs: FileSystem = None
+) -> list:
+    """
+    Return the locations of a gcn in the gcn storage.
+    The key is pushed down to the index files so only the matching rows are read.
+
+    Parameters
+    ----------
+    gcn_rawdatapath : string
+        the root path of the gcn storage
+    triggerId : string
+        the trigger identifier of the gcn
+    gcn_status : string
+        used to distinguish gcn with the same triggerId (account the gcn update)
+    gcn_fs : FileSystem
+        the file system of the gcn storage
+
+    Returns
+    -------
+    list
+        the (path, row_group) of the gcn, the path is relative to the gcn storage,
+        empty if the gcn is not indexed
+
+    Example
+    -------
+    >>> from fink_mm.gcn_stream.gcn_writer import write_gcn_dataframe
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> gcn = pd.read_parquet(grb_data).assign(year="2024", month="01", day="15")
+    >>> write_gcn_dataframe(gcn, tmp_dir_gcn.name, "test", gcn_index=True)
+    >>> os.listdir(tmp_dir_gcn.name + "/_gcn_index")
+    ['test.parquet']
+    >>> lookup_gcn_index(tmp_dir_gcn.name, "S240115ak", "initial")
+    [('year=2024/month=01/day=15/test_0.parquet', 0)]
+    >>> lookup_gcn_index(tmp_dir_gcn.name, "S240115ak", "update_5")
+    []
+    >>> lookup_gcn_index("gcn_storage/raw", "S240115ak", "initial")
+    []
+    """
+    gcn_fs = gcn_fs or LocalFileSystem()
+    index_path = gcn_index_path(gcn_rawdatapath)
+    if gcn_fs.get_file_info(index_path).type == pa.fs.FileType.NotFound:
+        return []
+
+    key_filter = (ds.field("triggerId") == triggerId) & (
+        ds.field("gcn_status") == gcn_status
+    )
+    index = ds.dataset(
+        index_path, format="parquet", schema=GCN_INDEX_SCHEMA, filesystem=gcn_fs
+    ).to_table(columns=["path", "row_group"], filter=key_filter)
+    return list(
+        zip(index.column("path").to_pylist(), index.column("row_group").to_pylist())
+    )
+
+
+def read_gcn(
+    gcn_rawdatapath: str,
+    triggerId: str,
+    gcn_status: str,
+    gcn_fs: FileSystem = None,
+    columns: list = None,
+) -> pd.DataFrame:
+    """
+    Read a gcn from the gcn storage with the gcn index.
+    Only the indexed row groups are read and the key is pushed down to the gcn files.
+
+    Parameters
+    ----------
+    gcn_rawdatapath : string
+        the root path of the gcn storage
+    triggerId : string
+        the trigger identifier of the gcn
+    gcn_status : string
+        used to distinguish gcn with the same triggerId (account the gcn update)
+    gcn_fs : FileSystem
+        the file system of the gcn storage
+    columns : list
+        the columns to read, all the columns if None
+
+    Returns
+    -------
+    pd.DataFrame or None
+        the rows of the gcn, None if the gcn is not indexed
+
+    Example
+    -------
+    >>> from fink_mm.gcn_stream.gcn_writer import write_gcn_dataframe
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> gcn = pd.read_parquet(grb_data).assign(year="2024", month="01", day="15")
+    >>> write_gcn_dataframe(gcn, tmp_dir_gcn.name, "test", gcn_index=True)
+    >>> read_gcn(tmp_dir_gcn.name, "727009399", "update_0", columns=["triggerId", "gcn_status", "err_arcmin"])
+       triggerId gcn_status  err_arcmin
+    0  727009399   update_0       663.0
+    >>> read_gcn(tmp_dir_gcn.name, "727009399", "update_5") is None
+    True
+    """
+    locations = lookup_gcn_index(gcn_rawdatapath, triggerId, gcn_status, gcn_fs)
+    if len(locations) == 0:
+        return None
+
+    key_filter = (ds.field("triggerId") == triggerId) & (
+        ds.field("gcn_status") == gcn_status
+    )
+    tables = []
+    for path, row_group in locations:
+        try:
+            gcn_file = ds.dataset(
+                posixpath.join(gcn_rawdatapath, path),
+                format="parquet",
+                filesystem=gcn_fs,
+            )
+        except FileNotFoundError:
+            # the file has been removed by a compaction since the lookup
+            continue
+        for fragment in gcn_file.get_fragments():
+            tables.append(
+                fragment.subset(row_group_ids=[row_group]).to_table(
+                    columns=columns, filter=key_filter
+                )
+            )
+    if len(tables) == 0:
+        return None
+    return pa.concat_tables(tables).to_pandas()
+
+
+def rewrite_gcn_index(
+    gcn_rawdatapath: str,
+    removed_paths: list,
+    new_index: pa.Table,
+    gcn_fs: FileSystem = None,
+):
+    """
+    Rewrite the gcn index in a single file after a compaction of the gcn storage.
+    The entries of the removed gcn files are dropped and the new entries are added.
+    The new index file is written with a hidden name and renamed once complete,
+    then the previous index files are removed. The index files written by the gcn stream
+    during the rewrite are kept.
+
+    Parameters
+    ----------
+    gcn_rawdatapath : string
+        the root path of the gcn storage
+    removed_paths : list
+        the removed gcn files, relative to the gcn storage
+    new_index : pa.Table
+        the index of the new gcn files
+    gcn_fs : FileSystem
+        the file system of the gcn storage
+
+    Example
+    -------
+    >>> from fink_mm.gcn_stream.gcn_writer import write_gcn_dataframe
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> gcn = pd.read_parquet(grb_data).assign(year="2024", month="01", day="15")
+    >>> write_gcn_dataframe(gcn.iloc[:10], tmp_dir_gcn.name, "gcn_0", gcn_index=True)
+    >>> write_gcn_dataframe(gcn.iloc[10:], tmp_dir_gcn.name, "gcn_1", gcn_index=True)
+    >>> new_index = pa.table(
+    ...     {"triggerId": ["10472"], "gcn_status": ["initial"], "path": ["new.parquet"], "row_group": [2]},
+    ...     schema=GCN_INDEX_SCHEMA
+    ... )
+    >>> rewrite_gcn_index(
+    ...     tmp_dir_gcn.name, ["year=2024/month=01/day=15/gcn_0_0.parquet"], new_index
+    ... )
+    >>> len(os.listdir(tmp_dir_gcn.name + "/_gcn_index"))
+    1
+    >>> lookup_gcn_index(tmp_dir_gcn.name, "10472", "initial")
+    [('new.parquet', 2)]
+    >>> lookup_gcn_index(tmp_dir_gcn.name, "S240115ao", "initial")
+    [('year=2024/month=01/day=15/gcn_1_0.parquet', 0)]
+    """
+    gcn_fs = gcn_fs or LocalFileSystem()
+    index_path = gcn_index_path(gcn_rawdatapath)
+    gcn_fs.create_dir(index_path, recursive=True)
+    index_files = [
+        file_info.path
+        for file_info in gcn_fs.get_file_info(FileSelector(index_path))
+        if file_info.type == FileType.File
+        if not file_info.base_name.startswith((".", "_"))
+    ]
+
+    index = ds.dataset(
+        index_files, format="parquet", schema=GCN_INDEX_SCHEMA, filesystem=gcn_fs
+    ).to_table(filter=~ds.field("path").isin(removed_paths))
+    index = pa.concat_tables([index, new_index.cast(GCN_INDEX_SCHEMA)])
+    index = index.take(
+        pc.sort_indices(
+            index, sort_keys=[("triggerId", "ascending"), ("gcn_status", "ascending")]
+        )
+    )
+
+    index_name = "index_{}.parquet".format(time.time())
+    tmp_path = posixpath.join(index_path, "." + index_name)
+    pq.write_table(index, tmp_path, filesystem=gcn_fs)
+    gcn_fs.move(tmp_path, posixpath.join(index_path, index_name))
+    for path in index_files:
+        gcn_fs.delete_file(path)
@@ -0,0 +1,386 @@
+import time
+import queue
+import logging
+from threading import Event, Thread
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+from gcn_kafka import Consumer
+
+import fink_mm.gcn_stream.gcn_footprint as gp
+from fink_mm.gcn_stream.gcn_writer import GcnWriteBuffer
+from fink_mm.gcn_stream.gcn_skymap import store_skymaps
+from fink_mm.gcn_stream.gcn_tracker import GcnTracker
+from fink_mm.gcn_stream.gcn_commit import GcnOffsetCommitter
+
+# default size of the gcn pipeline
+DEFAULT_PARSE_WORKERS = 2
+DEFAULT_MAX_PENDING = 100
+
+# the stages of the gcn pipeline with a measured latency
+#   parse: from the consumption of the notice to the end of its parsing
+#   write: duration of a write of the gcn buffer
+#   notice_to_disk: from the consumption of the notice to the end of its write
+PIPELINE_STAGES = ["parse", "write", "notice_to_disk"]
+
+
+class GcnPipeline:
+    """
+    Parse and write the gcn notices on separate workers.
+    The notices are parsed by a bounded pool of processes, the parsed notices are
+    tagged with their gcn_status and written by a single writer thread in the order
+    of their consumption. The messages are returned to the consumer thread
+    by pop_durable only after the write of their notice.
+    """
+
+    def __init__(
+        self,
+        gcn_buffer: GcnWriteBuffer,
+        gcn_tracker: GcnTracker,
+        logger: logging.Logger,
+        logs: bool,
+        is_test: bool,
+        parse_workers: int = DEFAULT_PARSE_WORKERS,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        footprint_nsides: list = None,
+        skymap_store: str = None,
+    ):
+        """
+        Initialise the pipeline, the writer thread is started by the start method.
+        The messages are committed by the caller, see run_gcn_pipeline.
+
+        Parameters
+        ----------
+        gcn_buffer : GcnWriteBuffer
+            the buffer of the decoded gcn, only used by the writer thread
+        gcn_tracker : GcnTracker
+            keep track of the gcn updates, only used by the writer thread
+        logger : logger object
+            logger object for logs.
+        logs: boolean
+            if true, print logs
+        is_test: boolean
+            run the pipeline in test mode
+        parse_workers : int
+            the number of parse processes
+        max_pending : int
+            the maximum number of notices consumed but not yet written,
+            submit blocks when the pipeline is full.
+        footprint_nsides : list
+            if given, the footprints of the notices are precomputed by the parse processes,
+            see add_footprint_columns
+        skymap_store : string
+            if given, the skymaps of the LVK notices are moved to this skymap store
+            by the writer thread, see store_skymaps
+
+        Example
+        -------
+        >>> f = open('fink_mm/test/test_data/voevent_number=9897.xml').read().encode("UTF-8")
+        >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+        >>> pipeline = GcnPipeline(
+        ...     GcnWriteBuffer(tmp_dir_gcn.name, 2, 2), GcnTracker(36500), logger, False, False
+        ... )
+        >>> pipeline.start()
+        >>> for offset in range(3):
+        ...     pipeline.submit(f, "gcn.classic.voevent.FERMI_GBM_FIN_POS", offset)
+        >>> pipeline.close()
+        >>> pipeline.pop_durable()
+        [0, 1, 2]
+        >>> list(pd.read_parquet(tmp_dir_gcn.name + "/year=2022/month=08/day=30/")["gcn_status"])
+        ['initial', 'update_0', 'update_1']
+        >>> metrics = pipeline.metrics()
+        >>> metrics["queue_depth"], metrics["latency"]["notice_to_disk"]["count"]
+        ({'parse': 0, 'buffer': 0, 'commit': 0}, 3)
+
+        the notices are refused once the writer thread is stopped
+        >>> try:
+        ...     pipeline.submit(f, "gcn.classic.voevent.FERMI_GBM_FIN_POS", 3)
+        ... except RuntimeError:
+        ...     print("writer stopped")
+        writer stopped
+        """
+        self.gcn_buffer = gcn_buffer
+        self.gcn_tracker = gcn_tracker
+        self.logger = logger
+        self.logs = logs
+        self.is_test = is_test
+        self.max_pending = max_pending
+        self.footprint_nsides = footprint_nsides
+        self.skymap_store = skymap_store
+
+        # the workers are spawned to not fork the kafka client and its threads
+        self._executor = ProcessPoolExecutor(
+            parse_workers, mp_context=get_context("spawn")
+        )
+        # (message, parse future, consume time) in the order of consumption
+        self._parse_queue = queue.Queue(maxsize=max_pending)
+        # messages of the written notices, waiting for their commit
+        self._commit_queue = queue.Queue()
+        self._writer = Thread(target=self._write_loop, name="gcn_writer", daemon=True)
+
+        # stage -> [count, total latency, max latency]
+        self._latencies = {stage: [0, 0.0, 0.0] for stage in PIPELINE_STAGES}
+
+    def start(self):
+        """
+        Start the writer thread
+        """
+        self._writer.start()
+
+    def is_alive(self) -> bool:
+        """
+        Return True if the writer thread is running
+
+        Returns
+        -------
+        boolean
+            False if the pipeline is not started or if the writer thread has stopped
+        """
+        return self._writer.is_alive()
+
+    def _check_writer(self):
+        if not self.is_alive():
+            raise RuntimeError(
+                "the gcn writer thread is not running, the consumed notices are no longer written"
+            )
+
+    def submit(self, gcn: bytes, topic: str, message):
+        """
+        Send a consumed notice to the parse pool.
+        Block if max_pending notices are already waiting for their write.
+        Raise a RuntimeError if the writer thread is not running.
+
+        Parameters
+        ----------
+        gcn : bytes
+            the notice coming from the stream
+        topic : str
+            the emitting topic
+        message : object
+            the kafka message of the notice, returned by pop_durable after the write
+        """
+        self._check_writer()
+        consume_time = time.monotonic()
+        future = self._executor.submit(
+            gp.parse_gcn_with_footprint,
+            gcn,
+            topic,
+            self.logger,
+            self.logs,
+            self.is_test,
+            self.footprint_nsides,
+        )
+        # the queue is full, wait for the writer while it is running
+        while True:
+            try:
+                self._parse_queue.put(
+                    (message, future, consume_time),
+                    timeout=self.gcn_buffer.max_latency,
+                )
+                return
+            except queue.Full:
+                self._check_writer()
+
+    def pop_durable(self) -> list:
+        """
+        Return the messages whose notice has been written since the last call,
+        in the order of consumption.
+
+        Returns
+        -------
+        list
+            the kafka messages ready to be committed
+        """
+        messages = []
+        while True:
+            try:
+                messages.append(self._commit_queue.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def close(self):
+        """
+        Wait for the write of all the submitted notices and stop the workers.
+        """
+        if self._writer.is_alive():
+            self._parse_queue.put(None)
+            self._writer.join()
+        self._executor.shutdown()
+
+    def metrics(self) -> dict:
+        """
+        Return the queue depths and the latencies in second of each pipeline stage
+
+        Returns
+        -------
+        dict
+            queue_depth: the number of notices waiting in each stage,
+            latency: the number of measures, the mean and the max latency by stage
+        """
+        return {
+            "queue_depth": {
+                "parse": self._parse_queue.qsize(),
+                "buffer": len(self.gcn_buffer),
+                "commit": self._commit_queue.qsize(),
+            },
+            "latency": {
+                stage: {
+                    "count": count,
+                    "mean": total / count if count != 0 else 0.0,
+                    "max": max_latency,
+                }
+                for stage, (count, total, max_latency) in self._latencies.items()
+            },
+        }
+
+    def _record_latency(self, stage: str, latency: float):
+        stage_latency = self._latencies[stage]
+        stage_latency[0] += 1
+        stage_latency[1] += latency
+        stage_latency[2] = max(stage_latency[2], latency)
+
+    def _flush(self, uncommitted: list) -> list:
+        # write the buffer and release the written messages, keep them if the write fails
+        start_write = time.monotonic()
+        try:
+            self.gcn_buffer.flush(self.logger, self.logs)
+        except Exception:
+            self.logger.error(
+                "writing of {} voevent failed, retry at the next flush".format(
+                    len(self.gcn_buffer)
+                ),
+                exc_info=1,
+            )
+            return uncommitted
+
+        end_write = time.monotonic()
+
+        # the tracker is saved before the messages are released for the commit,
+        # so a committed message is never missing from the tracker after a restart
+        if len(uncommitted) != 0 or self.gcn_tracker.should_save():
+            try:
+                self.gcn_tracker.save()
+            except Exception:  # pragma: no cover
+                self.logger.error(
+                    "snapshot of the gcn tracker failed, the written messages are committed after the next snapshot",
+                    exc_info=1,
+                )
+                return uncommitted
+
+        if len(uncommitted) != 0:
+            self._record_latency("write", end_write - start_write)
+        for message, consume_time in uncommitted:
+            self._record_latency("notice_to_disk", end_write - consume_time)
+            self._commit_queue.put(message)
+        return []
+
+    def _write_loop(self):
+        # messages of the buffered notices with their consume time
+        uncommitted = []
+        while True:
+            try:
+                item = self._parse_queue.get(timeout=self.gcn_buffer.max_latency)
+            except queue.Empty:
+                if self.gcn_buffer.should_flush():
+                    uncommitted = self._flush(uncommitted)
+                continue
+
+            if item is None:
+                break
+
+            message, future, consume_time = item
+            try:
+                df = future.result()
+            except Exception:
+                self.logger.error("error while parsing the gcn", exc_info=1)
+                df = None
+            self._record_latency("parse", time.monotonic() - consume_time)
+
+            if df is not None:
+                try:
+                    df["gcn_status"] = self.gcn_tracker.update(
+                        df["triggerId"].values[0], float(df["triggerTimejd"].values[0])
+                    )
+                    self.gcn_tracker.prune()
+                    if self.skymap_store is not None:
+                        df = store_skymaps(df, self.skymap_store, self.logger)
+                    self.gcn_buffer.append(df)
+                except Exception:
+                    self.logger.error(
+                        "writing of the new voevent {} failed".format(
+                            df["triggerId"].values[0]
+                        ),
+                        exc_info=1,
+                    )
+            uncommitted.append((message, consume_time))
+
+            if self.gcn_buffer.should_flush() or len(self.gcn_buffer) == 0:
+                uncommitted = self._flush(uncommitted)
+
+        uncommitted = self._flush(uncommitted)
+        if len(uncommitted) != 0:  # pragma: no cover
+            self.logger.error(
+                "{} gcn have not been written, they will be consumed again at the next start".format(
+                    len(uncommitted)
+                )
+            )
+
+
+def run_gcn_pipeline(
+    consumer: Consumer,
+    pipeline: GcnPipeline,
+    committer: GcnOffsetCommitter,
+    stop_event: Event,
+    consume_timeout: float,
+    logger: logging.Logger,
+    logs: bool,
+):
+    """
+    Consume the gcn stream with a pipeline until the stop event is set.
+    The consumer thread only consumes the notices and commits the messages
+    whose notice has been written by the pipeline.
+
+    Parameters
+    ----------
+    consumer : Consumer
+        the gcn kafka consumer
+    pipeline : GcnPipeline
+        the parse and write stages
+    committer : GcnOffsetCommitter
+        commit the offsets of the written messages
+    stop_event : Event
+        stop the consumption when set
+    consume_timeout : float
+        the maximum time in second to wait for new messages
+    logger : logger object
+        logger object for logs.
+    logs: boolean
+        if true, print logs
+
+    Returns
+    -------
+    None
+
+    """
+    pipeline.start()
+    try:
+        while not stop_event.is_set():
+            if not pipeline.is_alive():
+                raise RuntimeError(
+                    "the gcn writer thread has stopped, the gcn stream is interrupted"
+                )
+            message = consumer.consume(timeout=consume_timeout)
+            for gcn in message:
+                if logs:  # pragma: no cover
+                    logger.info("A new voevent is coming")
+                pipeline.submit(gcn.value(), gcn.topic(), gcn)
+
+            committer.mark_durable(pipeline.pop_durable())
+            committer.maybe_commit()
+    finally:
+        pipeline.close()
+        committer.mark_durable(pipeline.pop_durable())
+        committer.commit(asynchronous=False)
+
+    if logs:  # pragma: no cover
+        logger.info("gcn pipeline metrics: {}".format(pipeline.metrics()))
@@ -1,10 +1,25 @@
 import pandas as pd
 import voeventparse as vp
 import io
+from lxml import etree
 from lxml.objectify import ObjectifiedElement
 import json
 from logging import Logger
-from fink_mm.observatory import voevent_to_class, json_to_class
+from fink_mm.observatory import (
+    voevent_to_class,
+    json_to_class,
+    ivorn_to_class,
+    TOPICS_FORMAT,
+)
+
+# parser of the fast path, the voevent are never allowed to load external resources
+VOEVENT_PARSER = etree.XMLParser(
+    resolve_entities=False, no_network=True, remove_blank_text=True
+)
+
+
+class UnknownVoeventLayout(Exception):
+    pass
 
 
 def load_voevent_from_path(
@@ -85,9 +100,123 @@ def load_voevent_from_file(
         raise e
 
 
-def parse_xml_alert(gcn: bytes, logger: Logger, logs: bool) -> pd.DataFrame:
+def extract_voevent_fields(gcn: bytes) -> dict:
+    """
+    Extract from a voevent the fields used to build the gcn dataframe in one parse of the bytes,
+    without the objectify layer of voeventparse.
+    Raise UnknownVoeventLayout if the voevent does not have the expected layout
+    or if a toplevel param is duplicated, the voevent is then read by voeventparse
+    so the fast path never picks a different param.
+
+    Parameters
+    ----------
+    gcn: bytes
+        the incoming gcn
+
+    Returns
+    -------
+    dict
+        ivorn, role: the attributes of the voevent
+        params: the toplevel params of the What section (name -> value)
+        ra, dec, err: the event position and its error radius in degree
+        isotime: the event time in UTC, iso format
+
+    Examples
+    --------
+    >>> fields = extract_voevent_fields(open(fermi_gbm_voevent_path, "rb").read())
+    >>> fields["ivorn"], fields["role"]
+    ('ivo://nasa.gsfc.gcn/Fermi#GBM_Fin_Pos2022-07-29T10:17:31.51_680782656_0-655', 'observation')
+    >>> fields["params"]["Packet_Type"], fields["params"]["TrigID"]
+    ('115', '680782656')
+    >>> fields["ra"], fields["dec"], fields["err"], fields["isotime"]
+    (316.69, -4.1699, 11.34, '2022-07-29T10:17:31.51')
+
+    the voevents with a duplicated param are left to voeventparse
+    >>> gcn = open(fermi_gbm_voevent_path, "rb").read().replace(
+    ...     b"<What>", b'<What><Param name="TrigID" value="0"/>', 1
+    ... )
+    >>> try:
+    ...     extract_voevent_fields(gcn)
+    ... except UnknownVoeventLayout as e:
+    ...     print(e)
+    duplicated param TrigID
+    """
+    root = etree.fromstring(gcn, VOEVENT_PARSER)
+
+    what = root.find("What")
+    location = root.find("WhereWhen/ObsDataLocation/ObservationLocation")
+    if what is None or location is None:
+        raise UnknownVoeventLayout("no What or ObservationLocation section")
+
+    params = {}
+    for param in what.iterfind("Param"):
+        name = param.get("name")
+        if name in params:
+            raise UnknownVoeventLayout("duplicated param {}".format(name))
+        params[name] = param.get("value")
+
+    coords = location.find("AstroCoords")
+    position = coords.find("Position2D")
+    # same restrictions as the voeventparse functions plus degree unit only
+    is_utc = coords.get("coord_system_id", "").split("-")[0] == "UTC"
+    is_degree = position.get("unit") == "deg"
+    is_ra = position.findtext("Name1", "RA") == "RA"
+    is_dec = position.findtext("Name2", "Dec") == "Dec"
+    if not (is_utc and is_degree and is_ra and is_dec):
+        raise UnknownVoeventLayout("unsupported coordinate or time system")
+
+    return {
+        "ivorn": root.get("ivorn"),
+        "role": root.get("role"),
+        "params": params,
+        "ra": float(position.findtext("Value2/C1")),
+        "dec": float(position.findtext("Value2/C2")),
+        "err": float(position.findtext("Error2Radius")),
+        "isotime": coords.findtext("Time/TimeInstant/ISOTime").strip(),
+    }
+
+
+def fast_parse_xml_alert(gcn: bytes) -> pd.DataFrame:
+    """
+    Parse the gcn as an xml with extract_voevent_fields and return a dataframe,
+    the raw_event column contains the original gcn.
+    Raise an exception if the voevent cannot be handled by the fast path.
+
+    Parameters
+    ----------
+    gcn: bytes
+        the incoming gcn
+
+    Returns
+    -------
+    voevent_df: pd.DataFrame
+        a dataframe containing the voevent data,
+        None if the voevent is not an observation listened by fink_mm
+
+    Examples
+    --------
+    >>> f = open('fink_mm/test/test_data/voevent_number=9897.xml', 'rb').read()
+    >>> df = fast_parse_xml_alert(f)
+    >>> cols = [c for c in df.columns if c not in ["ackTime", "raw_event"]]
+    >>> assert_frame_equal(df[cols], full_parse_xml_alert(f, logger, False)[cols])
+    >>> df["raw_event"].values[0] == f.decode("UTF-8")
+    True
     """
-    parse the gcn as an xml and return a dataframe
+    fields = extract_voevent_fields(gcn)
+    observatory = ivorn_to_class(fields["ivorn"])
+
+    if fields["role"] != "observation" or (
+        int(fields["params"]["Packet_Type"]) not in observatory.packet_type
+    ):
+        return None
+
+    return observatory.voevent_fields_to_df(fields, gcn.decode("UTF-8"))
+
+
+def full_parse_xml_alert(gcn: bytes, logger: Logger, logs: bool) -> pd.DataFrame:
+    """
+    parse the gcn as an xml with voeventparse and return a dataframe,
+    the raw_event column contains the voevent printed by voeventparse.
 
     Parameters
     ----------
@@ -106,7 +235,7 @@ def parse_xml_alert(gcn: bytes, logger: Logger, logs: bool) -> pd.DataFrame:
     Examples
     --------
     >>> f = open('fink_mm/test/test_data/voevent_number=9897.xml').read().encode("UTF-8")
-    >>> parse_xml_alert(f, logger, False)
+    >>> full_parse_xml_alert(f, logger, False)
       observatory instrument event  ...  year month  day
     0       Fermi        GBM        ...  2022    08   30
     <BLANKLINE>
@@ -122,6 +251,51 @@ def parse_xml_alert(gcn: bytes, logger: Logger, logs: bool) -> pd.DataFrame:
         return observatory.voevent_to_df()
 
 
+def parse_xml_alert(gcn: bytes, logger: Logger, logs: bool) -> pd.DataFrame:
+    """
+    parse the gcn as an xml and return a dataframe.
+    The gcn is first parsed by the fast path (fast_parse_xml_alert),
+    the voevent falls back to voeventparse (full_parse_xml_alert) if its layout is not handled.
+
+    Parameters
+    ----------
+    gcn: bytes
+        the incoming gcn
+    logger: Logger
+        logger object for logs.
+    logs: bool
+        if true, print logs
+
+    Returns
+    -------
+    voevent_df: pd.DataFrame
+        a dataframe containing the voevent data
+
+    Examples
+    --------
+    >>> f = open('fink_mm/test/test_data/voevent_number=9897.xml').read().encode("UTF-8")
+    >>> parse_xml_alert(f, logger, False)
+      observatory instrument event  ...  year month  day
+    0       Fermi        GBM        ...  2022    08   30
+    <BLANKLINE>
+    [1 rows x 15 columns]
+    """
+    try:
+        df = fast_parse_xml_alert(gcn)
+        if logs and df is not None:  # pragma: no cover
+            logger.info("the voevent is a new obervation.")
+        return df
+    except Exception as e:
+        if logs:  # pragma: no cover
+            logger.info(
+                "the voevent is not handled by the fast path, use voeventparse\n\tcause: {}".format(
+                    e
+                )
+            )
+
+    return full_parse_xml_alert(gcn, logger, logs)
+
+
 def load_json_from_path(file_path: str, logger: Logger, logs: bool = False) -> dict:
     """
     Load the json from a path.
@@ -234,3 +408,69 @@ def parse_json_alert(
         if logs:  # pragma: no cover
             logger.info("the voevent is a new obervation.")
         return obs_class.voevent_to_df()
+
+
+def parse_gcn(
+    gcn: bytes, topic: str, logger: Logger, logs: bool, is_test: bool
+) -> pd.DataFrame:
+    """
+    Parse a gcn coming from the gcn kafka stream according to the format of its topic.
+    Return None if the gcn cannot be read or is not a real observation.
+    This function is called in the parse worker processes of the gcn pipeline.
+
+    Parameters
+    ----------
+    gcn: bytes
+        the incoming gcn
+    topic: str
+        the emitting topic
+    logger: Logger
+        the logger object
+    logs: boolean
+        if true, print logs
+    is_test: boolean
+        if is_test is true, accept the test event
+
+    Returns
+    -------
+    pd.DataFrame or None
+        the gcn as a dataframe
+
+    Examples
+    --------
+    >>> f = open('fink_mm/test/test_data/voevent_number=9897.xml').read().encode("UTF-8")
+    >>> parse_gcn(f, "gcn.classic.voevent.FERMI_GBM_FIN_POS", logger, False, False)["triggerId"].values
+    array(['683571622'], dtype=object)
+    >>> parse_gcn(b"<bad>", "gcn.classic.voevent.FERMI_GBM_FIN_POS", logger, False, False) is None
+    True
+    """
+    if topic in TOPICS_FORMAT["xml"]:
+        try:
+            df = parse_xml_alert(gcn, logger, logs)
+        except Exception as e:  # pragma: no cover
+            logger.error(
+                "Error while reading the xml gcn notice: \n\t {}\n\n\tcause: {}".format(
+                    gcn, e
+                )
+            )
+            return None
+
+    elif topic in TOPICS_FORMAT["json"]:
+        try:
+            df = parse_json_alert(gcn, logger, logs, is_test)
+        except Exception:
+            logger.error(
+                "error while reading the json notice\n\n\tgcn: {}".format(gcn),
+                exc_info=1,
+            )
+            return None
+
+    else:
+        logger.error(
+            "error while parsing the gcn file:\n\ttopic: {}\n\tgcn: {}".format(
+                topic, gcn
+            )
+        )
+        raise Exception("bad gcn file format")
+
+    return df
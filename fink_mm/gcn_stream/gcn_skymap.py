@@ -0,0 +1,258 @@
+import json
+import logging
+import numpy as np
+import pandas as pd
+from base64 import b64decode, b64encode
+
+from pyspark.sql.functions import pandas_udf
+from pyspark.sql.types import StringType
+
+from fink_mm.utils.fun_utils import (
+    get_observatory,
+    FOOTPRINT_MOC,
+    FOOTPRINT_ADAPTIVE,
+    FOOTPRINT_AREA,
+)
+from fink_mm.observatory.skymap_store import write_skymap, read_skymap_bytes
+
+
+def has_footprint(df: pd.DataFrame) -> np.ndarray:
+    """
+    Test if the footprint of the gcn has been precomputed,
+    the gcn must carry every footprint column (see add_footprint_columns).
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the decoded gcn
+
+    Returns
+    -------
+    np.ndarray
+        a boolean by gcn, True if all the footprint columns of the gcn are set
+
+    Examples
+    --------
+    >>> from fink_mm.gcn_stream.gcn_footprint import add_footprint_columns
+    >>> gcn = pd.read_parquet(gw_data)
+    >>> has_footprint(gcn).tolist()
+    [False]
+    >>> has_footprint(add_footprint_columns(gcn, [4])).tolist()
+    [True]
+    >>> has_footprint(add_footprint_columns(gcn, [4]).assign(footprint_hpix_4=None)).tolist()
+    [False]
+    """
+    hpix_columns = [c for c in df.columns if c.startswith("footprint_hpix_")]
+    footprint_columns = [FOOTPRINT_MOC, FOOTPRINT_ADAPTIVE, FOOTPRINT_AREA]
+    if len(hpix_columns) == 0 or not set(footprint_columns).issubset(df.columns):
+        return np.zeros(len(df), dtype=bool)
+    return df[footprint_columns + hpix_columns].notna().all(axis=1).values
+
+
+def store_skymaps(
+    df: pd.DataFrame, store_path: str, logger: logging.Logger
+) -> pd.DataFrame:
+    """
+    Move the skymaps of the LVK gcn from the raw_event to the skymap store.
+    The skymaps are written with the (triggerId, gcn_status) of their gcn, so this function
+    must be called after the gcn_status tagging and before the write of the gcn.
+    The join computes the footprint of a gcn without its precomputed footprint columns
+    from the raw_event, so the skymap of these gcn stays in the raw_event.
+    If the write of a skymap fails, the skymap stays in the raw_event.
+    The original skymap is kept in the store, see rehydrate_skymaps.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the decoded gcn with their gcn_status
+    store_path : string
+        the root path of the skymap store, see skymap_store_path
+    logger : logger object
+        logger object for logs.
+
+    Returns
+    -------
+    pd.DataFrame
+        the decoded gcn, the raw_event of the LVK gcn no longer contain the skymap
+
+    Examples
+    --------
+    >>> from fink_mm.gcn_stream.gcn_footprint import add_footprint_columns
+    >>> tmp_dir = tempfile.TemporaryDirectory()
+    >>> pdf = pd.read_parquet(gw_data).assign(gcn_status="initial")
+    >>> len(pdf["raw_event"].iloc[0])
+    914550
+
+    the gcn without the footprint columns keep their skymap
+    >>> assert_frame_equal(store_skymaps(pdf, tmp_dir.name, logger), pdf)
+    >>> os.listdir(tmp_dir.name)
+    []
+
+    >>> pdf = add_footprint_columns(pdf, [4])
+    >>> stored_pdf = store_skymaps(pdf, tmp_dir.name, logger)
+    >>> len(stored_pdf["raw_event"].iloc[0]), os.listdir(tmp_dir.name)
+    (616, ['S230518h'])
+    >>> "skymap" in json.loads(stored_pdf["raw_event"].iloc[0])["event"]
+    False
+
+    the gcn without skymap are unchanged
+    >>> gcn = pd.read_parquet(grb_data)
+    >>> gcn = gcn[gcn["observatory"] != "LVK"]
+    >>> assert_frame_equal(store_skymaps(gcn, tmp_dir.name, logger), gcn)
+    """
+    lvk_rows = np.flatnonzero((df["observatory"].values == "LVK") & has_footprint(df))
+    if len(lvk_rows) == 0:
+        return df
+
+    df = df.copy()
+    raw_event_col = df.columns.get_loc("raw_event")
+    for i in lvk_rows:
+        event = json.loads(df["raw_event"].iloc[i])
+        if "skymap" not in (event.get("event") or {}):
+            continue
+
+        triggerId = df["triggerId"].iloc[i]
+        gcn_status = df["gcn_status"].iloc[i]
+        try:
+            skymap_index = get_observatory(
+                "LVK", df["raw_event"].iloc[i]
+            ).get_skymap_index()
+            write_skymap(
+                store_path,
+                triggerId,
+                gcn_status,
+                skymap_index,
+                b64decode(event["event"]["skymap"]),
+            )
+        except Exception:
+            logger.error(
+                "writing of the skymap of {} {} failed, the skymap is kept in the raw_event".format(
+                    triggerId, gcn_status
+                ),
+                exc_info=1,
+            )
+            continue
+
+        del event["event"]["skymap"]
+        df.iat[i, raw_event_col] = json.dumps(event)
+    return df
+
+
+def rehydrate_skymaps(
+    df: pd.DataFrame, store_path: str, logger: logging.Logger
+) -> pd.DataFrame:
+    """
+    Put back the skymaps of the LVK gcn from the skymap store into the raw_event,
+    the inverse of store_skymaps. Used to export the gcn or to read them without the skymap store.
+    The gcn whose skymap is not in the store are unchanged.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the gcn with their gcn_status
+    store_path : string
+        the root path of the skymap store, see skymap_store_path
+    logger : logger object
+        logger object for logs.
+
+    Returns
+    -------
+    pd.DataFrame
+        the gcn, the raw_event of the LVK gcn contain their skymap
+
+    Examples
+    --------
+    >>> from fink_mm.gcn_stream.gcn_footprint import add_footprint_columns
+    >>> tmp_dir = tempfile.TemporaryDirectory()
+    >>> pdf = add_footprint_columns(pd.read_parquet(gw_data).assign(gcn_status="initial"), [4])
+    >>> stored_pdf = store_skymaps(pdf, tmp_dir.name, logger)
+    >>> rehydrated_pdf = rehydrate_skymaps(stored_pdf, tmp_dir.name, logger)
+    >>> rehydrated_event = json.loads(rehydrated_pdf["raw_event"].iloc[0])["event"]
+    >>> rehydrated_event["skymap"] == json.loads(pdf["raw_event"].iloc[0])["event"]["skymap"]
+    True
+    >>> get_observatory("LVK", rehydrated_pdf["raw_event"].iloc[0]).decode_skymap().colnames
+    ['UNIQ', 'PROBDENSITY', 'DISTMU', 'DISTSIGMA', 'DISTNORM']
+
+    the skymaps not in the store are not rehydrated
+    >>> assert_frame_equal(rehydrate_skymaps(stored_pdf, "not_a_store", logger), stored_pdf)
+    """
+    lvk_rows = np.flatnonzero(df["observatory"].values == "LVK")
+    if len(lvk_rows) == 0:
+        return df
+
+    df = df.copy()
+    raw_event_col = df.columns.get_loc("raw_event")
+    for i in lvk_rows:
+        event = json.loads(df["raw_event"].iloc[i])
+        if event.get("event") is None or "skymap" in event["event"]:
+            continue
+
+        triggerId = df["triggerId"].iloc[i]
+        gcn_status = df["gcn_status"].iloc[i]
+        try:
+            skymap_bytes = read_skymap_bytes(store_path, triggerId, gcn_status)
+        except FileNotFoundError:
+            logger.warning(
+                "the skymap of {} {} is not in the skymap store, the raw_event is unchanged".format(
+                    triggerId, gcn_status
+                )
+            )
+            continue
+
+        event["event"]["skymap"] = b64encode(skymap_bytes).decode("ascii")
+        df.iat[i, raw_event_col] = json.dumps(event)
+    return df
+
+
+def rehydrate_raw_event(store_path: str):
+    """
+    Return the udf putting back the skymaps of the skymap store in the raw_event
+    of the LVK gcn, see rehydrate_skymaps. Applied by the join writer so the join outputs
+    carry the original skymaps and can be read without the skymap store.
+
+    Parameters
+    ----------
+    store_path : string
+        the root path of the skymap store, see skymap_store_path.
+        Must be readable by the spark executors.
+
+    Returns
+    -------
+    pandas_udf
+        the udf, the arguments are observatory, triggerId, gcn_status, raw_event
+
+    Examples
+    --------
+    >>> from fink_mm.gcn_stream.gcn_footprint import add_footprint_columns
+    >>> tmp_dir = tempfile.TemporaryDirectory()
+    >>> pdf = add_footprint_columns(pd.read_parquet(gw_data).assign(gcn_status="initial"), [4])
+    >>> stored_pdf = store_skymaps(pdf, tmp_dir.name, logger)
+    >>> cols = ["observatory", "triggerId", "gcn_status", "raw_event"]
+    >>> df = spark.createDataFrame(stored_pdf[cols])
+    >>> df = df.withColumn("raw_event", rehydrate_raw_event(tmp_dir.name)(*cols))
+    >>> df.select("raw_event").collect()[0][0] == rehydrate_skymaps(stored_pdf, tmp_dir.name, logger)["raw_event"].iloc[0]
+    True
+    >>> len(df.select("raw_event").collect()[0][0]) == len(pdf["raw_event"].iloc[0])
+    True
+    """
+
+    @pandas_udf(StringType())
+    def rehydrate(
+        obsname: pd.Series,
+        triggerId: pd.Series,
+        gcn_status: pd.Series,
+        raw_event: pd.Series,
+    ) -> pd.Series:
+        gcn = pd.DataFrame(
+            {
+                "observatory": obsname,
+                "triggerId": triggerId,
+                "gcn_status": gcn_status,
+                "raw_event": raw_event,
+            }
+        )
+        return rehydrate_skymaps(gcn, store_path, logging.getLogger(__name__))[
+            "raw_event"
+        ]
+
+    return rehydrate
@@ -1,20 +1,39 @@
 import signal
-import pyarrow as pa
-import pyarrow.parquet as pq
 import os
 import time
-import pandas as pd
+from functools import partial
+from threading import Event
 
 from gcn_kafka import Consumer
 import logging
 
 from pyarrow.fs import FileSystem
 
-import fink_mm.gcn_stream.gcn_reader as gr
+import fink_mm.gcn_stream.gcn_footprint as gp
+from fink_mm.gcn_stream.gcn_skymap import store_skymaps
+from fink_mm.gcn_stream.gcn_writer import (
+    GcnWriteBuffer,
+    write_gcn_dataframe,
+    DEFAULT_MAX_RECORDS,
+    DEFAULT_MAX_LATENCY,
+)
+from fink_mm.gcn_stream.gcn_tracker import GcnTracker, DEFAULT_SNAPSHOT_INTERVAL
+from fink_mm.gcn_stream.gcn_commit import (
+    GcnOffsetCommitter,
+    log_commit_error,
+    DEFAULT_COMMIT_MAX_MESSAGES,
+    DEFAULT_COMMIT_MAX_INTERVAL,
+)
+from fink_mm.gcn_stream.gcn_pipeline import (
+    GcnPipeline,
+    run_gcn_pipeline,
+    DEFAULT_PARSE_WORKERS,
+    DEFAULT_MAX_PENDING,
+)
 from fink_mm.init import get_config, init_logging, return_verbose_level
 from fink_mm.utils.fun_utils import get_hdfs_connector
-from fink_mm.observatory import TOPICS, TOPICS_FORMAT
-from astropy.time import Time
+from fink_mm.observatory import TOPICS
+from fink_mm.observatory.skymap_store import skymap_store_path
 
 
 def my_assign(consumer, partitions):
@@ -33,7 +52,7 @@ def my_assign(consumer, partitions):
     consumer.assign(partitions)
 
 
-def signal_handler(signal, frame):  # pragma: no cover
+def signal_handler(signal, frame, stop_event: Event = None):  # pragma: no cover
     """
     The signal handler function for the gcn stream.
     Quit the gcn stream by using keyboard command (like Ctrl+C).
@@ -44,24 +63,31 @@ def signal_handler(signal, frame):  # pragma: no cover
         the signal number
     frame :
         the current stack frame
+    stop_event : Event
+        if given, the event is set and the gcn stream stops after flushing the buffered gcn,
+        otherwise exit immediately.
     Returns
     -------
     None
     """
     logging.warn("exit the gcn streaming !")
-    exit(0)
+    if stop_event is None:
+        exit(0)
+    stop_event.set()
 
 
 def load_and_parse_gcn(
     gcn: bytes,
     topic: str,
     gcn_rawdatapath: str,
-    gcn_tracking: pd.DataFrame,
-    gcn_time_window: int,
+    gcn_tracker: GcnTracker,
     logger: logging.Logger,
     logs: bool,
     is_test: bool,
     gcn_fs: FileSystem = None,
+    gcn_buffer: GcnWriteBuffer = None,
+    footprint_nsides: list = None,
+    skymap_store: str = None,
 ):
     """
     Load and parse a gcn coming from the gcn kafka stream.
@@ -74,10 +100,8 @@ def load_and_parse_gcn(
         the emitting topic
     gcn_rawdatapath : string
         the path destination where to store the decoded gcn
-    gcn_tracking : pd.DataFrame
-        keep track of the gcn updated
-    gcn_time_window : int
-        the time in day the gcn are kept in the gcn_tracking dataframe
+    gcn_tracker : GcnTracker
+        keep track of the gcn updates
     logger : logger object
         logger object for logs.
     logs: boolean
@@ -86,6 +110,13 @@ def load_and_parse_gcn(
         run the function in test mode
     gcn_fs: FileSystem
         the file system used to write the gcn
+    gcn_buffer: GcnWriteBuffer
+        if given, the gcn is added to the buffer instead of being written immediately
+    footprint_nsides: list
+        if given, the footprint of the gcn is precomputed and stored with the gcn,
+        the pixel lists are computed for each NSIDE, see add_footprint_columns
+    skymap_store: string
+        if given, the skymaps of the LVK gcn are moved to this skymap store, see store_skymaps
 
     Returns
     -------
@@ -100,8 +131,7 @@ def load_and_parse_gcn(
     ...    f,
     ...    "gcn.classic.voevent.FERMI_GBM_FIN_POS",
     ...    tmp_dir_gcn.name,
-    ...    pd.DataFrame(columns=["triggerId", "triggerTimejd", "nb_received"]),
-    ...    7,
+    ...    GcnTracker(7),
     ...    logger,
     ...    False,
     ...    False
@@ -110,6 +140,8 @@ def load_and_parse_gcn(
     >>> base_gcn = base_gcn.drop(columns="ackTime")
     >>> test_gcn = pd.read_parquet("fink_mm/test/test_data/683571622_0_test")
     >>> test_gcn["gcn_status"] = "initial"
+    >>> # the original voevent is stored verbatim
+    >>> test_gcn["raw_event"] = f.decode("UTF-8")
     >>> assert_frame_equal(base_gcn, test_gcn)
 
     >>> json_str = open(lvk_initial_path, 'r').read()
@@ -118,8 +150,7 @@ def load_and_parse_gcn(
     ...     json_str,
     ...     "igwn.gwalert",
     ...     tmp_dir_gcn.name,
-    ...     pd.DataFrame(columns=["triggerId", "triggerTimejd", "nb_received"]),
-    ...     7,
+    ...     GcnTracker(7),
     ...     logger,
     ...     False,
     ...     False
@@ -129,88 +160,186 @@ def load_and_parse_gcn(
     >>> test_gcn = pd.read_parquet("fink_mm/test/test_data/S230518h_0_test")
     >>> test_gcn["gcn_status"] = "initial"
     >>> assert_frame_equal(base_gcn, test_gcn)
-    """
 
-    if topic in TOPICS_FORMAT["xml"]:
-        try:
-            df = gr.parse_xml_alert(gcn, logger, logs)
-        except Exception as e:  # pragma: no cover
-            logger.error(
-                "Error while reading the xml gcn notice: \n\t {}\n\n\tcause: {}".format(
-                    gcn, e
-                )
-            )
-            return gcn_tracking
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> gcn_buffer = GcnWriteBuffer(tmp_dir_gcn.name, 50, 2)
+    >>> gcn_tracker = GcnTracker(36500)
+    >>> for _ in range(3):
+    ...     load_and_parse_gcn(
+    ...         f,
+    ...         "gcn.classic.voevent.FERMI_GBM_FIN_POS",
+    ...         tmp_dir_gcn.name,
+    ...         gcn_tracker,
+    ...         logger,
+    ...         False,
+    ...         False,
+    ...         gcn_buffer=gcn_buffer
+    ...     )
+    >>> len(gcn_buffer), os.listdir(tmp_dir_gcn.name)
+    (3, [])
+    >>> gcn_buffer.flush()
+    3
+    >>> os.listdir(tmp_dir_gcn.name + "/year=2022/month=08/day=30/")[0].startswith("gcn_")
+    True
+    >>> list(pd.read_parquet(tmp_dir_gcn.name + "/year=2022/month=08/day=30/")["gcn_status"])
+    ['initial', 'update_0', 'update_1']
 
-    elif topic in TOPICS_FORMAT["json"]:
-        try:
-            df = gr.parse_json_alert(gcn, logger, logs, is_test)
-        except Exception:
-            logger.error(
-                "error while reading the json notice\n\n\tgcn: {}".format(gcn),
-                exc_info=1,
-            )
-            return gcn_tracking
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> _ = load_and_parse_gcn(
+    ...     json_str,
+    ...     "igwn.gwalert",
+    ...     tmp_dir_gcn.name,
+    ...     GcnTracker(7),
+    ...     logger,
+    ...     False,
+    ...     False,
+    ...     footprint_nsides=[4]
+    ... )
+    >>> base_gcn = pd.read_parquet(tmp_dir_gcn.name + "/year=2023/month=05/day=18/")
+    >>> len(base_gcn["footprint_moc"].values[0]), len(base_gcn["footprint_hpix_4"].values[0])
+    (780, 18)
 
-    else:
-        logger.error(
-            "error while parsing the gcn file:\n\ttopic: {}\n\tgcn: {}".format(
-                topic, gcn
-            )
-        )
-        raise Exception("bad gcn file format")
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> _ = load_and_parse_gcn(
+    ...     json_str,
+    ...     "igwn.gwalert",
+    ...     tmp_dir_gcn.name,
+    ...     GcnTracker(7),
+    ...     logger,
+    ...     False,
+    ...     False,
+    ...     footprint_nsides=[4],
+    ...     skymap_store=skymap_store_path(tmp_dir_gcn.name),
+    ... )
+    >>> os.listdir(tmp_dir_gcn.name + "/_skymaps/S230518h")
+    ['initial']
+    >>> pd.read_parquet(tmp_dir_gcn.name)["raw_event"].str.len().values
+    array([616])
+    """
+
+    df = gp.parse_gcn_with_footprint(
+        gcn, topic, logger, logs, is_test, footprint_nsides
+    )
 
     try:
         if df is None:
             if logs:  # pragma: no cover
                 logger.info("The gcn is not a real observation")
-            return gcn_tracking
-
-        triggerId = df["triggerId"].values[0]
-        timejd = df["triggerTimejd"].values[0]
-        current_id_mask = gcn_tracking["triggerId"] == triggerId
-        if current_id_mask.any():
-            current_track = gcn_tracking.loc[current_id_mask]
-            updated_tag = f"update_{current_track['nb_received'].values[0]}"
-            df["gcn_status"] = updated_tag
-            gcn_tracking.loc[current_id_mask, "nb_received"] += 1
-        else:
-            gcn_tracking.loc[len(gcn_tracking)] = [triggerId, timejd, 0]
-            updated_tag = "initial"
-            df["gcn_status"] = updated_tag
-
-        table = pa.Table.from_pandas(df)
-
-        pq.write_to_dataset(
-            table,
-            root_path=gcn_rawdatapath,
-            partition_cols=["year", "month", "day"],
-            basename_template="{}_{}_{}.parquet".format(
-                str(df["triggerId"].values[0]), time.time(), "{i}"
-            ),
-            existing_data_behavior="overwrite_or_ignore",
-            filesystem=gcn_fs,
+            return
+
+        df["gcn_status"] = gcn_tracker.update(
+            df["triggerId"].values[0], float(df["triggerTimejd"].values[0])
         )
 
-        if logs:  # pragma: no cover
-            logger.info(
-                "writing of the new voevent successfull at the location {}".format(
-                    gcn_rawdatapath
-                )
+        if skymap_store is not None:
+            df = store_skymaps(df, skymap_store, logger)
+
+        if gcn_buffer is not None:
+            gcn_buffer.append(df)
+        else:
+            write_gcn_dataframe(
+                df,
+                gcn_rawdatapath,
+                "{}_{}".format(str(df["triggerId"].values[0]), time.time()),
+                gcn_fs,
             )
 
-        # gcn tracking window
-        now_jd = Time.now().jd
-        gcn_tracking = gcn_tracking[
-            (now_jd - gcn_tracking["triggerTimejd"]) < gcn_time_window
-        ]
+            if logs:  # pragma: no cover
+                logger.info(
+                    "writing of the new voevent successfull at the location {}".format(
+                        gcn_rawdatapath
+                    )
+                )
 
-        return gcn_tracking
+        # gcn tracking window
+        gcn_tracker.prune()
     except Exception:
         logger.error(
             "writing of the new voevent failed\n\n\t{}".format(gcn), exc_info=1
         )
-        return gcn_tracking
+
+
+def flush_and_commit(
+    committer: GcnOffsetCommitter,
+    gcn_buffer: GcnWriteBuffer,
+    gcn_tracker: GcnTracker,
+    pending_messages: list,
+    logger: logging.Logger,
+    logs: bool,
+) -> list:
+    """
+    Flush the gcn buffer and give the messages written by the flush to the committer,
+    the offsets are committed according to the commit policy.
+    The gcn tracker is saved before the messages are given to the committer, so a committed
+    message is never missing from the tracker after a restart.
+    If the flush or the save fails, nothing is committed and the gcn stay in the buffer.
+
+    Parameters
+    ----------
+    committer : GcnOffsetCommitter
+        commit the offsets of the written messages
+    gcn_buffer : GcnWriteBuffer
+        the buffer of the decoded gcn
+    gcn_tracker : GcnTracker
+        keep track of the gcn updates, contains the gcn_status of the written gcn
+    pending_messages : list
+        the consumed messages not yet committed
+    logger : logger object
+        logger object for logs.
+    logs: boolean
+        if true, print logs
+
+    Returns
+    -------
+    list
+        the messages still waiting for a commit
+    """
+    try:
+        gcn_buffer.flush(logger, logs)
+    except Exception:
+        logger.error(
+            "writing of {} voevent failed, retry at the next flush".format(
+                len(gcn_buffer)
+            ),
+            exc_info=1,
+        )
+        return pending_messages
+
+    if len(pending_messages) != 0 and not save_gcn_tracker(gcn_tracker, logger):
+        return pending_messages
+
+    committer.mark_durable(pending_messages)
+    committer.maybe_commit()
+    return []
+
+
+def save_gcn_tracker(gcn_tracker: GcnTracker, logger: logging.Logger) -> bool:
+    """
+    Save the gcn tracker, a failed save is logged and retried at the next snapshot.
+
+    Parameters
+    ----------
+    gcn_tracker : GcnTracker
+        keep track of the gcn updates
+    logger : logger object
+        logger object for logs.
+
+    Returns
+    -------
+    boolean
+        True if the tracker has been saved
+    """
+    try:
+        gcn_tracker.save()
+    except Exception:  # pragma: no cover
+        logger.error(
+            "snapshot of the gcn tracker failed at the location {}".format(
+                gcn_tracker.snapshot_path
+            ),
+            exc_info=1,
+        )
+        return False
+    return True
 
 
 def start_gcn_stream(arguments):
@@ -232,8 +361,16 @@ def start_gcn_stream(arguments):
 
     logs = return_verbose_level(arguments, config, logger)
 
-    # keep track of the gcn update
-    gcn_tracking = pd.DataFrame(columns=["triggerId", "triggerTimejd", "nb_received"])
+    # keep track of the gcn update, restored from the last snapshot
+    gcn_tracker = GcnTracker.load(
+        int(config["OFFLINE"]["time_window"]),
+        config.get("GCN_STREAM", "tracker_snapshot_path", fallback=None),
+        config.getfloat(
+            "GCN_STREAM",
+            "tracker_snapshot_interval",
+            fallback=DEFAULT_SNAPSHOT_INTERVAL,
+        ),
+    )
 
     try:
         consumer_config = {
@@ -243,6 +380,8 @@ def start_gcn_stream(arguments):
         }
         if arguments["--test"]:
             consumer_config = {"group.id": "", "auto.offset.reset": "earliest"}
+        # the offsets are committed asynchronously, see GcnOffsetCommitter
+        consumer_config["on_commit"] = partial(log_commit_error, logger)
 
         consumer = Consumer(
             config=consumer_config,
@@ -278,7 +417,9 @@ def start_gcn_stream(arguments):
     else:
         consumer.subscribe(TOPICS)
 
-    signal.signal(signal.SIGINT, signal_handler)
+    # stop the gcn stream after flushing the buffered gcn
+    stop_event = Event()
+    signal.signal(signal.SIGINT, partial(signal_handler, stop_event=stop_event))
 
     try:
         gcn_datapath_prefix = config["PATH"]["online_gcn_data_prefix"]
@@ -287,6 +428,63 @@ def start_gcn_stream(arguments):
         logger.error("Config entry not found \n\t {}".format(e))
         exit(1)
 
+    try:
+        max_records = config.getint(
+            "GCN_STREAM", "buffer_max_records", fallback=DEFAULT_MAX_RECORDS
+        )
+        max_latency = config.getfloat(
+            "GCN_STREAM", "buffer_max_latency", fallback=DEFAULT_MAX_LATENCY
+        )
+        pipelined = config.getboolean("GCN_STREAM", "pipeline", fallback=False)
+        parse_workers = config.getint(
+            "GCN_STREAM", "parse_workers", fallback=DEFAULT_PARSE_WORKERS
+        )
+        max_pending = config.getint(
+            "GCN_STREAM", "max_pending", fallback=DEFAULT_MAX_PENDING
+        )
+        commit_max_messages = config.getint(
+            "GCN_STREAM", "commit_max_messages", fallback=DEFAULT_COMMIT_MAX_MESSAGES
+        )
+        commit_max_interval = config.getfloat(
+            "GCN_STREAM", "commit_max_interval", fallback=DEFAULT_COMMIT_MAX_INTERVAL
+        )
+        store_skymap = config.getboolean("GCN_STREAM", "skymap_store", fallback=False)
+        gcn_index = config.getboolean("GCN_STREAM", "gcn_index", fallback=False)
+        footprint_nsides = config.get("GCN_STREAM", "footprint_nsides", fallback=None)
+        if footprint_nsides is not None:
+            footprint_nsides = [
+                int(nside) for nside in footprint_nsides.split(",") if nside.strip()
+            ]
+    except ValueError as e:
+        logger.error("Bad config entry for the gcn stream \n\t {}".format(e))
+        exit(1)
+
+    # the join computes the footprint of a gcn without the precomputed footprint columns
+    # from its skymap, the skymaps are moved in the skymap store only with the footprints
+    if store_skymap and not footprint_nsides:
+        logger.error(
+            "Bad config entry for the gcn stream \n\t skymap_store requires footprint_nsides"
+        )
+        exit(1)
+
+    gcn_buffer = GcnWriteBuffer(
+        gcn_rawdatapath, max_records, max_latency, gcn_fs, gcn_index
+    )
+    committer = GcnOffsetCommitter(consumer, commit_max_messages, commit_max_interval)
+
+    # the skymaps are memory-mapped by the join, the skymap store must be on a local filesystem
+    skymap_store = None
+    if store_skymap:
+        if gcn_fs is None:
+            skymap_store = skymap_store_path(gcn_rawdatapath)
+        else:
+            logger.warning(
+                "skymap store disabled, the gcn are not written on a local filesystem"
+            )
+
+    # messages consumed but not yet durably written, committed after the next flush
+    pending_messages = []
+
     if gcn_fs is None:
         if not os.path.exists(gcn_rawdatapath):
             logger.error(
@@ -301,8 +499,32 @@ def start_gcn_stream(arguments):
             "GCN stream initialisation successfull.\nThe deamon is running and wait for gcn arrivals."
         )
 
-    while True:
-        message = consumer.consume(timeout=2)
+    if pipelined:
+        pipeline = GcnPipeline(
+            gcn_buffer,
+            gcn_tracker,
+            logger,
+            logs,
+            arguments["--test"],
+            parse_workers,
+            max_pending,
+            footprint_nsides,
+            skymap_store,
+        )
+        run_gcn_pipeline(
+            consumer,
+            pipeline,
+            committer,
+            stop_event,
+            min(2, max_latency),
+            logger,
+            logs,
+        )
+        consumer.close()
+        return
+
+    while not stop_event.is_set():
+        message = consumer.consume(timeout=min(2, max_latency))
 
         if len(message) != 0:
             for gcn in message:
@@ -311,15 +533,41 @@ def start_gcn_stream(arguments):
                 value = gcn.value()
                 topic = gcn.topic()
 
-                gcn_tracking = load_and_parse_gcn(
+                load_and_parse_gcn(
                     value,
                     topic,
                     gcn_rawdatapath,
-                    gcn_tracking,
-                    int(config["OFFLINE"]["time_window"]),
+                    gcn_tracker,
                     logger,
                     logs,
                     is_test=arguments["--test"],
                     gcn_fs=gcn_fs,
+                    gcn_buffer=gcn_buffer,
+                    footprint_nsides=footprint_nsides,
+                    skymap_store=skymap_store,
                 )
-                consumer.commit(gcn)
+                pending_messages.append(gcn)
+
+        if gcn_buffer.should_flush() or len(gcn_buffer) == 0:
+            pending_messages = flush_and_commit(
+                committer, gcn_buffer, gcn_tracker, pending_messages, logger, logs
+            )
+
+        # the tracker is saved only when all the tracked gcn have been written
+        if len(gcn_buffer) == 0 and gcn_tracker.should_save():
+            save_gcn_tracker(gcn_tracker, logger)
+
+    # shutdown: write the buffered gcn before leaving
+    pending_messages = flush_and_commit(
+        committer, gcn_buffer, gcn_tracker, pending_messages, logger, logs
+    )
+    if len(pending_messages) != 0:  # pragma: no cover
+        logger.error(
+            "{} gcn have not been written, they will be consumed again at the next start".format(
+                len(pending_messages)
+            )
+        )
+    else:
+        save_gcn_tracker(gcn_tracker, logger)
+    committer.commit(asynchronous=False)
+    consumer.close()
@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import heapq
+
+from astropy.time import Time
+
+# default time in second between two snapshots of the gcn tracker
+DEFAULT_SNAPSHOT_INTERVAL = 60
+
+
+class GcnTracker:
+    """
+    Keep track of the gcn updates to tag the incoming notices with their gcn_status.
+    The tracked events are stored in a dict keyed by triggerId and the events
+    older than the time window are removed by popping a min-heap ordered by trigger time.
+    The tracker can be saved in a local file and reloaded at the start of the gcn stream
+    to keep the right gcn_status after a restart.
+    """
+
+    def __init__(
+        self,
+        time_window: float,
+        snapshot_path: str = None,
+        snapshot_interval: float = DEFAULT_SNAPSHOT_INTERVAL,
+    ):
+        """
+        Initialise an empty tracker
+
+        Parameters
+        ----------
+        time_window : float
+            the time in day the gcn events are tracked after their trigger time
+        snapshot_path : string
+            the local file where the tracker is saved, if None the tracker is never saved
+        snapshot_interval : float
+            the minimum time in second between two snapshots
+
+        Example
+        -------
+        >>> gcn_tracker = GcnTracker(7)
+        >>> len(gcn_tracker), "683571622" in gcn_tracker
+        (0, False)
+        """
+        self.time_window = time_window
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        # triggerId -> [triggerTimejd, nb_received]
+        self._tracks = {}
+        # (triggerTimejd, triggerId) ordered by trigger time
+        self._heap = []
+        self._last_snapshot = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def __contains__(self, triggerId: str) -> bool:
+        return triggerId in self._tracks
+
+    def update(self, triggerId: str, triggerTimejd: float) -> str:
+        """
+        Record a new notice and return its gcn_status.
+        The first notice of an event is tagged 'initial',
+        the next ones 'update_0', 'update_1', ...
+
+        Parameters
+        ----------
+        triggerId : string
+            the trigger identifier of the notice
+        triggerTimejd : float
+            the trigger time of the notice in julian date
+
+        Returns
+        -------
+        string
+            the gcn_status of the notice
+
+        Example
+        -------
+        >>> gcn_tracker = GcnTracker(7)
+        >>> [gcn_tracker.update("683571622", 2459821.5) for _ in range(3)]
+        ['initial', 'update_0', 'update_1']
+        >>> gcn_tracker.update("S230518h", 2460083.0)
+        'initial'
+        >>> len(gcn_tracker)
+        2
+        """
+        track = self._tracks.get(triggerId)
+        if track is not None:
+            gcn_status = "update_{}".format(track[1])
+            track[1] += 1
+            return gcn_status
+
+        self._tracks[triggerId] = [triggerTimejd, 0]
+        heapq.heappush(self._heap, (triggerTimejd, triggerId))
+        return "initial"
+
+    def prune(self, now_jd: float = None) -> int:
+        """
+        Stop tracking the events older than the time window
+
+        Parameters
+        ----------
+        now_jd : float
+            the current time in julian date, default to now
+
+        Returns
+        -------
+        int
+            the number of removed events
+
+        Example
+        -------
+        >>> gcn_tracker = GcnTracker(7)
+        >>> _ = gcn_tracker.update("683571622", 2459821.5)
+        >>> _ = gcn_tracker.update("S230518h", 2460083.0)
+        >>> gcn_tracker.prune(2460085.0)
+        1
+        >>> "683571622" in gcn_tracker, "S230518h" in gcn_tracker
+        (False, True)
+        >>> gcn_tracker.update("683571622", 2459821.5)
+        'initial'
+        """
+        now_jd = Time.now().jd if now_jd is None else now_jd
+        nb_removed = 0
+        while len(self._heap) != 0 and now_jd - self._heap[0][0] >= self.time_window:
+            _, triggerId = heapq.heappop(self._heap)
+            del self._tracks[triggerId]
+            nb_removed += 1
+        return nb_removed
+
+    def should_save(self, now: float = None) -> bool:
+        """
+        Return True if the last snapshot is older than the snapshot interval
+
+        Parameters
+        ----------
+        now : float
+            the current time from time.monotonic, default to the current time
+
+        Returns
+        -------
+        boolean
+            True if the tracker must be saved
+
+        Example
+        -------
+        >>> GcnTracker(7).should_save()
+        False
+        >>> GcnTracker(7, "gcn_tracker.json", 60).should_save(time.monotonic() + 60)
+        True
+        """
+        if self.snapshot_path is None:
+            return False
+        now = time.monotonic() if now is None else now
+        return (now - self._last_snapshot) >= self.snapshot_interval
+
+    def save(self):
+        """
+        Save the tracker in the snapshot file.
+        The snapshot is first written in a temporary file and then renamed
+        so an interrupted save never corrupts the previous snapshot.
+
+        Example
+        -------
+        >>> tmp_dir = tempfile.TemporaryDirectory()
+        >>> gcn_tracker = GcnTracker(7, tmp_dir.name + "/gcn_tracker.json")
+        >>> _ = gcn_tracker.update("683571622", 2459821.5)
+        >>> gcn_tracker.save()
+        >>> os.listdir(tmp_dir.name)
+        ['gcn_tracker.json']
+        """
+        if self.snapshot_path is None:
+            return
+
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"tracks": self._tracks}, f)
+        os.replace(tmp_path, self.snapshot_path)
+        self._last_snapshot = time.monotonic()
+
+    @classmethod
+    def load(
+        cls,
+        time_window: float,
+        snapshot_path: str = None,
+        snapshot_interval: float = DEFAULT_SNAPSHOT_INTERVAL,
+    ):  # -> GcnTracker
+        """
+        Create a tracker from the snapshot file, return an empty tracker
+        if the snapshot file does not exists.
+
+        Parameters
+        ----------
+        time_window : float
+            the time in day the gcn events are tracked after their trigger time
+        snapshot_path : string
+            the local file where the tracker is saved
+        snapshot_interval : float
+            the minimum time in second between two snapshots
+
+        Returns
+        -------
+        GcnTracker
+            the tracker restored from the snapshot
+
+        Example
+        -------
+        >>> tmp_dir = tempfile.TemporaryDirectory()
+        >>> snapshot_path = tmp_dir.name + "/gcn_tracker.json"
+        >>> len(GcnTracker.load(7, snapshot_path))
+        0
+        >>> gcn_tracker = GcnTracker(7, snapshot_path)
+        >>> [gcn_tracker.update("683571622", 2459821.5) for _ in range(2)]
+        ['initial', 'update_0']
+        >>> gcn_tracker.save()
+        >>> restored_tracker = GcnTracker.load(7, snapshot_path)
+        >>> restored_tracker.update("683571622", 2459821.5)
+        'update_1'
+        >>> restored_tracker.prune(2459830.0)
+        1
+        """
+        gcn_tracker = cls(time_window, snapshot_path, snapshot_interval)
+        if snapshot_path is None or not os.path.exists(snapshot_path):
+            return gcn_tracker
+
+        with open(snapshot_path, "r") as f:
+            snapshot = json.load(f)
+
+        gcn_tracker._tracks = {
+            triggerId: [float(timejd), int(nb_received)]
+            for triggerId, (timejd, nb_received) in snapshot["tracks"].items()
+        }
+        gcn_tracker._heap = [
+            (timejd, triggerId)
+            for triggerId, (timejd, _) in gcn_tracker._tracks.items()
+        ]
+        heapq.heapify(gcn_tracker._heap)
+        return gcn_tracker
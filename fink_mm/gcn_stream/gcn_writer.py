@@ -0,0 +1,273 @@
+import time
+import logging
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from pyarrow.fs import FileSystem
+
+from fink_mm.gcn_stream.gcn_index import build_gcn_index, write_gcn_index
+
+# default flush policy of the gcn write buffer
+DEFAULT_MAX_RECORDS = 50
+DEFAULT_MAX_LATENCY = 2  # seconds
+
+
+def write_gcn_dataframe(
+    df: pd.DataFrame,
+    gcn_rawdatapath: str,
+    basename: str,
+    gcn_fs: FileSystem = None,
+    gcn_index: bool = False,
+):
+    """
+    Write decoded gcn into the gcn storage partitioned by year, month and day,
+    one file is written by partition.
+    If gcn_index is True, the location of the written gcn is added to the gcn index
+    after the write of the gcn files, see read_gcn.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the decoded gcn
+    gcn_rawdatapath : string
+        the root path of the gcn storage
+    basename : string
+        the prefix of the written file names, must be unique to not overwrite previous files,
+        a write of the same gcn with the same basename replaces the previous files
+    gcn_fs : FileSystem
+        the file system used to write the gcn
+    gcn_index : boolean
+        if True, index the written gcn by (triggerId, gcn_status)
+
+    Examples
+    --------
+    >>> gcn = pd.read_parquet(grb_data).assign(year="2024", month="01", day="15")
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> write_gcn_dataframe(gcn, tmp_dir_gcn.name, "test")
+    >>> os.listdir(tmp_dir_gcn.name + "/year=2024/month=01/day=15")
+    ['test_0.parquet']
+    >>> len(pd.read_parquet(tmp_dir_gcn.name))
+    23
+    """
+    written_files = []
+    pq.write_to_dataset(
+        pa.Table.from_pandas(df),
+        root_path=gcn_rawdatapath,
+        partition_cols=["year", "month", "day"],
+        basename_template="{}_{}.parquet".format(basename, "{i}"),
+        existing_data_behavior="overwrite_or_ignore",
+        filesystem=gcn_fs,
+        file_visitor=written_files.append,
+        # the file names only depend on the data, a retry with the same basename
+        # replaces the files of a partial write
+        use_threads=False,
+    )
+
+    if gcn_index:
+        write_gcn_index(
+            build_gcn_index(df, written_files, gcn_rawdatapath, gcn_fs),
+            gcn_rawdatapath,
+            basename,
+            gcn_fs,
+        )
+
+
+class GcnWriteBuffer:
+    """
+    Buffer the decoded gcn before writing them in the gcn storage.
+    The buffer is flushed when it contains max_records gcn or when the oldest gcn
+    has been waiting for max_latency seconds, each flush writes one file by partition.
+    """
+
+    def __init__(
+        self,
+        gcn_rawdatapath: str,
+        max_records: int = DEFAULT_MAX_RECORDS,
+        max_latency: float = DEFAULT_MAX_LATENCY,
+        gcn_fs: FileSystem = None,
+        gcn_index: bool = False,
+    ):
+        """
+        Initialise an empty buffer
+
+        Parameters
+        ----------
+        gcn_rawdatapath : string
+            the root path of the gcn storage
+        max_records : int
+            the maximum number of gcn in the buffer
+        max_latency : float
+            the maximum time in second a gcn stays in the buffer
+        gcn_fs : FileSystem
+            the file system used to write the gcn
+        gcn_index : boolean
+            if True, each flush adds the written gcn to the gcn index
+
+        Example
+        -------
+        >>> gcn_buffer = GcnWriteBuffer("gcn_storage", 50, 2)
+        >>> len(gcn_buffer), gcn_buffer.should_flush()
+        (0, False)
+        """
+        self.gcn_rawdatapath = gcn_rawdatapath
+        self.max_records = max_records
+        self.max_latency = max_latency
+        self.gcn_fs = gcn_fs
+        self.gcn_index = gcn_index
+        self._pending = []
+        self._oldest_time = None
+        # the number of gcn of the batch being written and the basename of its files,
+        # fixed at the first write attempt and reused by the retries
+        self._batch_size = 0
+        self._basename = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def append(self, df: pd.DataFrame):
+        """
+        Add decoded gcn to the buffer
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            the decoded gcn
+
+        Example
+        -------
+        >>> gcn = pd.read_parquet(grb_data)
+        >>> gcn_buffer = GcnWriteBuffer("gcn_storage", 2, 2)
+        >>> gcn_buffer.append(gcn.iloc[[0]])
+        >>> len(gcn_buffer), gcn_buffer.should_flush()
+        (1, False)
+        >>> gcn_buffer.append(gcn.iloc[[1]])
+        >>> len(gcn_buffer), gcn_buffer.should_flush()
+        (2, True)
+        """
+        if self._oldest_time is None:
+            self._oldest_time = time.monotonic()
+        self._pending.append(df)
+
+    def should_flush(self, now: float = None) -> bool:
+        """
+        Return True if the buffer is full or if the oldest gcn has waited for too long
+
+        Parameters
+        ----------
+        now : float
+            the current time from time.monotonic, default to the current time
+
+        Returns
+        -------
+        boolean
+            True if the buffer must be flushed
+
+        Example
+        -------
+        >>> gcn = pd.read_parquet(grb_data)
+        >>> gcn_buffer = GcnWriteBuffer("gcn_storage", 50, 2)
+        >>> gcn_buffer.append(gcn.iloc[[0]])
+        >>> gcn_buffer.should_flush()
+        False
+        >>> gcn_buffer.should_flush(time.monotonic() + 2)
+        True
+        """
+        if len(self._pending) == 0:
+            return False
+        if len(self._pending) >= self.max_records:
+            return True
+        now = time.monotonic() if now is None else now
+        return (now - self._oldest_time) >= self.max_latency
+
+    def flush(self, logger: logging.Logger = None, logs: bool = False) -> int:
+        """
+        Write the buffered gcn in the gcn storage, one file by partition.
+        The buffer is emptied only if the write succeed, otherwise the exception is raised
+        and the gcn stay in the buffer for the next flush.
+        The gcn of a failed write are retried as the same batch with the same file names,
+        so the retry replaces the files of a partial write instead of duplicating the gcn.
+        The gcn appended after a failed write are written in a new batch.
+
+        Parameters
+        ----------
+        logger : logger object
+            logger object for logs.
+        logs: boolean
+            if true, print logs
+
+        Returns
+        -------
+        int
+            the number of written gcn
+
+        Example
+        -------
+        >>> gcn = pd.read_parquet(grb_data).assign(year="2024", month="01", day="15")
+        >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+        >>> gcn_buffer = GcnWriteBuffer(tmp_dir_gcn.name, 50, 2)
+        >>> for i in range(len(gcn)):
+        ...     gcn_buffer.append(gcn.iloc[[i]])
+        >>> gcn_buffer.flush()
+        23
+        >>> len(gcn_buffer), gcn_buffer.flush()
+        (0, 0)
+        >>> len(os.listdir(tmp_dir_gcn.name + "/year=2024/month=01/day=15"))
+        1
+        >>> partition = tmp_dir_gcn.name + "/year=2024/month=01/day=15"
+        >>> assert_frame_equal(pd.read_parquet(partition), pd.read_parquet(grb_data))
+
+        a failed write is retried with the same file names
+        >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+        >>> not_a_dir = tmp_dir_gcn.name + "/not_a_dir"
+        >>> open(not_a_dir, "w").close()
+        >>> gcn_buffer = GcnWriteBuffer(not_a_dir, 50, 2)
+        >>> for i in range(len(gcn)):
+        ...     gcn_buffer.append(gcn.iloc[[i]])
+        >>> try:
+        ...     gcn_buffer.flush()
+        ... except OSError:
+        ...     print("write failed")
+        write failed
+        >>> gcn_buffer.append(gcn.iloc[[0]])
+        >>> basename = gcn_buffer._basename
+        >>> gcn_buffer.gcn_rawdatapath = tmp_dir_gcn.name
+        >>> write_gcn_dataframe(gcn.iloc[:5], tmp_dir_gcn.name, basename)
+        >>> gcn_buffer.flush()
+        24
+        >>> files = sorted(os.listdir(tmp_dir_gcn.name + "/year=2024/month=01/day=15"))
+        >>> len(files), files[0] == basename + "_0.parquet"
+        (2, True)
+        >>> len(pd.read_parquet(tmp_dir_gcn.name + "/year=2024"))
+        24
+        """
+        nb_written = 0
+        while len(self._pending) != 0:
+            if self._basename is None:
+                self._batch_size = len(self._pending)
+                self._basename = "gcn_{}".format(time.time())
+
+            batch_size = self._batch_size
+            df = pd.concat(self._pending[:batch_size], ignore_index=True)
+            write_gcn_dataframe(
+                df,
+                self.gcn_rawdatapath,
+                self._basename,
+                self.gcn_fs,
+                self.gcn_index,
+            )
+
+            self._pending = self._pending[batch_size:]
+            self._batch_size = 0
+            self._basename = None
+            nb_written += len(df)
+
+        self._oldest_time = None
+
+        if logs and nb_written != 0:  # pragma: no cover
+            logger.info(
+                "writing of {} new voevent successfull at the location {}".format(
+                    nb_written, self.gcn_rawdatapath
+                )
+            )
+        return nb_written
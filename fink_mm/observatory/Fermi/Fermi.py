@@ -57,7 +57,20 @@ class Fermi(Observatory):
         """
         instrument = self.detect_instruments()
         coords = vp.get_event_position(self.voevent)
-        err = 1 / 60 if coords.err == 0.0 else coords.err
+        return self.error_to_arcminute(instrument, coords.err)
+
+    def error_to_arcminute(self, instrument: str, err: float) -> float:
+        """
+        Convert the error radius of a Fermi voevent into arcminute.
+
+        Example
+        -------
+        >>> fermi_gbm.error_to_arcminute("GBM", 11.34)
+        680.4
+        >>> print(round(fermi_lat.error_to_arcminute("LAT", 0.0), 4))
+        0.0167
+        """
+        err = 1 / 60 if err == 0.0 else err
 
         if instrument == "GBM":
             return err * 60
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import datetime as dt
 from astropy.time import Time
@@ -12,6 +13,7 @@ from fink_mm.observatory import OBSERVATORY_PATH
 from fink_mm.observatory.observatory import (
     Observatory,
     voevent_df_schema,
+    build_voevent_df,
 )
 
 
@@ -73,7 +75,18 @@ class IceCube(Observatory):
         39.576
         """
         coords = vp.get_event_position(self.voevent)
-        return coords.err * 60
+        return self.error_to_arcminute(self.detect_instruments(), coords.err)
+
+    def error_to_arcminute(self, instrument: str, err: float) -> float:
+        """
+        Convert the error radius of an IceCube voevent into arcminute.
+
+        Example
+        -------
+        >>> icecube_gold.error_to_arcminute("GOLD", 0.6596)
+        39.576
+        """
+        return err * 60
 
     @check_output(voevent_df_schema)
     def voevent_to_df(self):
@@ -154,6 +167,53 @@ class IceCube(Observatory):
 
         return df
 
+    def voevent_fields_to_df(self, fields: dict, raw_event: str) -> pd.DataFrame:
+        """
+        Convert the fields extracted by the fast path of the gcn reader into a dataframe.
+        The dataframe is the same as the one returned by voevent_to_df
+        except the raw_event column which contains the original voevent.
+
+        Parameters
+        ----------
+        fields : dict
+            the voevent fields, see fink_mm.gcn_stream.gcn_reader.extract_voevent_fields
+        raw_event : string
+            the original voevent
+
+        Returns
+        -------
+        df : dataframe
+            see voevent_to_df
+
+        Examples
+        --------
+        >>> from fink_mm.gcn_stream.gcn_reader import extract_voevent_fields
+        >>> gcn = open(icecube_cascade_voevent_path, "rb").read()
+        >>> df = icecube_cascade.voevent_fields_to_df(extract_voevent_fields(gcn), gcn.decode("UTF-8"))
+        >>> cols = [c for c in df.columns if c not in ["ackTime", "raw_event"]]
+        >>> assert_frame_equal(df[cols], icecube_cascade.voevent_to_df()[cols])
+        """
+        ivorn = fields["ivorn"]
+        event = ivorn.split("#")[1].split("_")[1]
+
+        voevent_error = self.error_to_arcminute(event, fields["err"])
+        if voevent_error == 0:
+            voevent_error = 1 / 60
+
+        return build_voevent_df(
+            self.observatory,
+            "",
+            event,
+            ivorn,
+            fields["params"]["AMON_ID"],
+            fields["ra"],
+            fields["dec"],
+            voevent_error,
+            Time(fields["isotime"], format="isot", scale="utc").jd,
+            fields["isotime"],
+            raw_event,
+        )
+
     def association_proba(
         self, ztf_ra: float, ztf_dec: float, jdstarthist: float, **kwargs
     ) -> float:
@@ -194,6 +254,45 @@ class IceCube(Observatory):
         >>> icecube_bronze.association_proba(132.3328, -42.7168, tr_time)
         0.5
         """
+        return self.association_proba_batch(
+            np.array([ztf_ra]), np.array([ztf_dec]), np.array([jdstarthist]), **kwargs
+        )[0]
+
+    def association_proba_batch(
+        self, ztf_ra: np.ndarray, ztf_dec: np.ndarray, jdstarthist: np.ndarray, **kwargs
+    ) -> np.ndarray:
+        """
+        Compute the association probability between the IceCube event and an array of ztf alerts
+
+        Return -1.0 for the alerts outside of the error box of the event and 0.5 otherwise.
+
+        Parameters
+        ----------
+        ztf_ra : numpy array
+            right ascension coordinates of the ztf alerts
+        ztf_dec : numpy array
+            declination coordinates of the ztf alerts
+        jdstarthist : numpy array
+            Earliest Julian date of epoch corresponding to ndethist [days]
+
+        Return
+        ------
+        association_proba: numpy array
+            association probability for each ztf alerts
+
+        Examples
+        --------
+        >>> tr_time = Time("2022-08-08T07:59:57.26").jd
+        >>> icecube_bronze.association_proba_batch(
+        ...     np.array([0, 132.3328, 132.3328]),
+        ...     np.array([0, -42.7168, -42.7168]),
+        ...     np.array([tr_time, tr_time, tr_time - 1])
+        ... ).tolist()
+        [-1.0, 0.5, -1.0]
+        """
+        ztf_ra = np.asarray(ztf_ra, dtype=np.float64)
+        ztf_dec = np.asarray(ztf_dec, dtype=np.float64)
+        jdstarthist = np.asarray(jdstarthist, dtype=np.float64)
 
         # array of error box
         event_error = self.err_to_arcminute()
@@ -214,7 +313,4 @@ class IceCube(Observatory):
             ztf_coords.separation(event_coord).arcminute <= 1.5 * event_error
         )
 
-        if time_condition and spatial_condition:
-            return 0.5
-        else:
-            return -1.0
+        return np.where(time_condition & spatial_condition, 0.5, -1.0)
@@ -61,8 +61,18 @@ class Integral(Observatory):
         """
         instrument = self.detect_instruments()
         coords = vp.get_event_position(self.voevent)
+        return self.error_to_arcminute(instrument, coords.err)
 
+    def error_to_arcminute(self, instrument: str, err: float) -> float:
+        """
+        Convert the error radius of an Integral voevent into arcminute.
+
+        Example
+        -------
+        >>> integral_wakeup.error_to_arcminute("Wakeup", 0.0489)
+        2.934
+        """
         if instrument == "Weak" or instrument == "Wakeup" or instrument == "Refined":
-            return coords.err * 60
+            return err * 60
         else:
             raise BadInstrument("{} is not a Integral events".format(instrument))
@@ -1,6 +1,5 @@
 import os.path as path
 import io
-from hdfs import InsecureClient
 import numpy as np
 import pandas as pd
 import os
@@ -9,43 +8,94 @@ from astropy.time import Time
 from astropy.table import QTable
 import astropy_healpix as ah
 from base64 import b64decode
+import pyarrow.dataset as ds
+from pyarrow.fs import FileSystem
 from pandera import check_output
 import datetime as dt
 import json
+import hashlib
 import healpy as hp
 from healpy.pixelfunc import pix2ang, ang2pix
 
 from fink_mm.observatory import OBSERVATORY_PATH
 from fink_mm.observatory.observatory import Observatory
+from fink_mm.observatory.skymap_cache import SKYMAP_CACHE, SkymapIndex
+from fink_mm.observatory.skymap_store import skymap_store_path, read_skymap
+from fink_mm.gcn_stream.gcn_index import read_gcn
+from fink_mm.utils.moc import pixels_to_ranges, area_to_order
 from fink_mm.test.hypothesis.observatory_schema import voevent_df_schema
 from datetime import datetime
 
 
 def gcn_from_hdfs(
-    client: InsecureClient,
+    gcn_fs: FileSystem,
     root_path: str,
     triggerId: str,
     triggerTime: datetime,
     gcn_status: str,
 ) -> pd.DataFrame:
+    """
+    Return a gcn from the gcn storage.
+    The gcn is read from its file and row group found in the gcn index,
+    if the gcn is not indexed, the day partition of its trigger time is scanned
+    with the key pushed down to the gcn files.
+
+    Parameters
+    ----------
+    gcn_fs : FileSystem
+        the file system of the gcn storage, the local file system if None
+    root_path : string
+        the root path of the gcn storage
+    triggerId : string
+        the trigger identifier of the gcn
+    triggerTime : datetime
+        the trigger time of the gcn
+    gcn_status : string
+        used to distinguish gcn with the same triggerId (account the gcn update)
+
+    Returns
+    -------
+    pd.DataFrame
+        the rows of the gcn
+
+    Examples
+    --------
+    >>> from fink_mm.gcn_stream.gcn_writer import write_gcn_dataframe
+    >>> gcn = pd.read_parquet(grb_data).assign(year="2024", month="01", day="15")
+    >>> trigger_time = datetime(2024, 1, 15)
+
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> write_gcn_dataframe(gcn, tmp_dir_gcn.name, "test", gcn_index=True)
+    >>> gcn_from_hdfs(None, tmp_dir_gcn.name, "S240115ak", trigger_time, "update_0")[["triggerId", "gcn_status"]]
+       triggerId gcn_status
+    0  S240115ak   update_0
+
+    the gcn written without index are found by scanning their day partition
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> write_gcn_dataframe(gcn, tmp_dir_gcn.name, "test")
+    >>> gcn_from_hdfs(None, tmp_dir_gcn.name, "S240115ak", trigger_time, "update_0")[["triggerId", "gcn_status"]]
+       triggerId gcn_status
+    0  S240115ak   update_0
+    >>> try:
+    ...     gcn_from_hdfs(None, tmp_dir_gcn.name, "S240115ak", trigger_time, "update_5")
+    ... except FileNotFoundError:
+    ...     print("not found")
+    not found
+    """
+    pdf = read_gcn(root_path, triggerId, gcn_status, gcn_fs)
+    if pdf is not None:
+        return pdf
+
     path_date = os.path.join(
         root_path,
         f"year={triggerTime.year:04d}/month={triggerTime.month:02d}/day={triggerTime.day:02d}",
     )
-    for p, _, files in client.walk(path_date):
-        for f in np.sort(files):
-            path_to_load = os.path.join(p, f)
-            with client.read(path_to_load) as reader:
-                content = reader.read()
-                pdf = pd.read_parquet(io.BytesIO(content))
-                if (
-                    triggerId in pdf["triggerId"].values
-                    and gcn_status in pdf["gcn_status"].values
-                ):
-                    return pdf[
-                        (pdf["triggerId"] == triggerId)
-                        & (pdf["gcn_status"] == gcn_status)
-                    ]
+    gcn_table = ds.dataset(path_date, format="parquet", filesystem=gcn_fs).to_table(
+        filter=(ds.field("triggerId") == triggerId)
+        & (ds.field("gcn_status") == gcn_status)
+    )
+    if gcn_table.num_rows != 0:
+        return gcn_table.to_pandas()
 
     raise FileNotFoundError(
         "File not found at these locations {} with triggerId = {} and gcn_status = {}".format(
@@ -76,10 +126,130 @@ class LVK(Observatory):
         <class 'LVK.LVK'>
         """
         super().__init__(path.join(OBSERVATORY_PATH, "LVK", "lvk.json"), notice)
+        self._skymap_index = None
+
+    def get_skymap_index(self, **kwargs) -> SkymapIndex:
+        """
+        Return the decoded skymap with its search arrays.
+        The skymap is decoded once for this object and shared with the other objects
+        of the process through the skymap cache, see skymap_cache_key.
+        If the skymap has been removed from the notice by the gcn stream,
+        it is memory-mapped from the skymap store of the gcn storage.
+
+        Parameters
+        ----------
+        kwargs: dict
+            - gcn_status: used to distinguish gcn with the same triggerId (account the gcn update)
+            - root_path: the root path of the gcn storage, required if the skymap is not in the notice
+
+        Returns
+        -------
+        skymap_index: SkymapIndex
+            the decoded skymap and the arrays used to search it
+
+        Examples
+        --------
+        >>> from fink_mm.observatory.skymap_cache import SKYMAP_CACHE
+        >>> SKYMAP_CACHE.clear()
+        >>> lvk_obs = json_to_class(load_json_from_path(lvk_initial_path, logger))
+        >>> skymap_index = lvk_obs.get_skymap_index(gcn_status="initial")
+        >>> lvk_obs.skymap_cache_key() in SKYMAP_CACHE
+        True
+        >>> lvk_obs = json_to_class(load_json_from_path(lvk_initial_path, logger))
+        >>> lvk_obs.get_skymap_index(gcn_status="initial") is skymap_index
+        True
+
+        the footprint methods called without the gcn_status use the cache too
+        >>> lvk_obs = json_to_class(load_json_from_path(lvk_initial_path, logger))
+        >>> lvk_obs.get_skymap_index() is skymap_index
+        True
+        >>> hits = SKYMAP_CACHE.hits
+        >>> _ = json_to_class(load_json_from_path(lvk_initial_path, logger)).get_pixels(4)
+        >>> len(SKYMAP_CACHE), SKYMAP_CACHE.hits - hits
+        (1, 1)
+
+        >>> from fink_mm.gcn_stream.gcn_skymap import store_skymaps
+        >>> tmp_dir = tempfile.TemporaryDirectory()
+        >>> from fink_mm.gcn_stream.gcn_footprint import add_footprint_columns
+        >>> pdf = pd.read_parquet(gw_data).assign(gcn_status="initial")
+        >>> pdf = add_footprint_columns(pdf, [4])
+        >>> pdf = store_skymaps(pdf, skymap_store_path(tmp_dir.name), logger)
+        >>> lvk_obs = json_to_class(json.loads(pdf["raw_event"].iloc[0]))
+        >>> "skymap" in lvk_obs.voevent["event"]
+        False
+        >>> SKYMAP_CACHE.clear()
+        >>> stored_index = lvk_obs.get_skymap_index(
+        ...     gcn_status=pdf["gcn_status"].iloc[0], root_path=tmp_dir.name
+        ... )
+        >>> len(stored_index.skymap), isinstance(stored_index.cumprob, np.memmap)
+        (16896, True)
+        """
+        if self._skymap_index is not None:
+            return self._skymap_index
+
+        gcn_status = kwargs.get("gcn_status")
+        key = self.skymap_cache_key(gcn_status)
+        skymap_index = SKYMAP_CACHE.get(key) if key is not None else None
+        if skymap_index is None:
+            if "skymap" in self.voevent["event"]:
+                skymap_index = SkymapIndex(self.decode_skymap(**kwargs))
+            elif "root_path" in kwargs and gcn_status:
+                skymap_index = read_skymap(
+                    skymap_store_path(kwargs["root_path"]),
+                    self.get_trigger_id(),
+                    gcn_status,
+                )
+            else:
+                raise FileNotFoundError(
+                    "the skymap of {} is not in the notice, the gcn_status and the root_path of the gcn storage are required to load it from the skymap store".format(
+                        self.get_trigger_id()
+                    )
+                )
+            if key is not None:
+                SKYMAP_CACHE.put(key, skymap_index)
+
+        self._skymap_index = skymap_index
+        return skymap_index
+
+    def skymap_cache_key(self, gcn_status: str = None) -> tuple:
+        """
+        Return the key of the skymap in the skymap cache.
+        A skymap contained in the notice is identified by its content so the objects
+        built from the same notice share it without the gcn_status, a skymap moved to
+        the skymap store is identified by the gcn_status.
+
+        Parameters
+        ----------
+        gcn_status: string
+            used to distinguish gcn with the same triggerId (account the gcn update)
+
+        Returns
+        -------
+        tuple
+            (superevent_id, digest of the skymap) or (superevent_id, gcn_status),
+            None if the skymap is not in the notice and the gcn_status is not given
+
+        Examples
+        --------
+        >>> key = lvk_initial.skymap_cache_key()
+        >>> key[0], len(key[1])
+        ('S230518h', 32)
+        >>> lvk_initial.skymap_cache_key("initial") == key
+        True
+        """
+        if "skymap" in self.voevent["event"]:
+            digest = hashlib.blake2b(
+                self.voevent["event"]["skymap"].encode("ascii"), digest_size=16
+            ).hexdigest()
+            return (self.get_trigger_id(), digest)
+        if gcn_status:
+            return (self.get_trigger_id(), gcn_status)
+        return None
 
     def get_skymap(self, **kwargs) -> QTable:
         """
-        Decode and return the skymap
+        Return the decoded skymap.
+        The returned table is shared through the skymap cache and must not be modified in place.
 
         Returns
         -------
@@ -91,22 +261,24 @@ class LVK(Observatory):
         >>> np.array(lvk_initial.get_skymap()["UNIQ"])
         array([  1285,   1287,   1296, ..., 162369, 162370, 162371])
         """
+        return self.get_skymap_index(**kwargs).skymap
 
-        skymap_str = self.voevent["event"]["skymap"]
+    def decode_skymap(self, **kwargs) -> QTable:
+        """
+        Decode and return the skymap
+
+        Returns
+        -------
+        skymap: astropy.Table
+            the sky localization error of the gw event as a skymap
 
-        # if "skymap" in self.voevent["event"]:
-        #     skymap_str = self.voevent["event"]["skymap"]
-        # else:
-        #     hdfs_adress = kwargs["hdfs_adress"]
-        #     hdfs_client = InsecureClient(f"http://{hdfs_adress}:50070")
-        #     triggerId = self.get_trigger_id()
-        #     gcn_status = kwargs["gcn_status"]
-        #     root_path = kwargs["root_path"]
-        #     t_obs = Time(self.get_trigger_time()[1], format="jd").to_datetime()
-        #     gcn_pdf = gcn_from_hdfs(
-        #         hdfs_client, root_path, triggerId, t_obs, gcn_status
-        #     )
-        #     skymap_str = json.loads(gcn_pdf["raw_event"].iloc[0])["event"]["skymap"]
+        Examples
+        --------
+        >>> np.array(lvk_initial.decode_skymap()["UNIQ"])
+        array([  1285,   1287,   1296, ..., 162369, 162370, 162371])
+        """
+
+        skymap_str = self.voevent["event"]["skymap"]
 
         # Decode and parse skymap
         skymap_bytes = b64decode(skymap_str)
@@ -239,17 +411,7 @@ class LVK(Observatory):
         >>> lvk_initial.err_to_arcminute()
         2396770.8626295296
         """
-        skymap = self.get_skymap()
-        skymap.sort("PROBDENSITY", reverse=True)
-        level, _ = ah.uniq_to_level_ipix(skymap["UNIQ"])
-        pixel_area = ah.nside_to_pixel_area(ah.level_to_nside(level))
-
-        prob = pixel_area * skymap["PROBDENSITY"]
-        cumprob = np.cumsum(prob)
-
-        i = cumprob.searchsorted(0.90)
-
-        area = pixel_area[:i].sum()
+        area = self.get_skymap_index().area(0.90)
         return area.to_value(u.arcmin**2)
 
     def get_most_probable_position(self):
@@ -369,14 +531,7 @@ class LVK(Observatory):
         >>> len(map_90["UNIQ"])
         9704
         """
-        skymap = self.get_skymap()
-        skymap.sort("PROBDENSITY", reverse=True)
-        level, _ = ah.uniq_to_level_ipix(skymap["UNIQ"])
-        pixel_area = ah.nside_to_pixel_area(ah.level_to_nside(level))
-        prob_area = pixel_area * skymap["PROBDENSITY"]
-        cumprob = np.cumsum(prob_area)
-        i = cumprob.searchsorted(prob)
-        return skymap[:i]
+        return self.get_skymap_index().probability_region(prob)
 
     def get_pixels(self, NSIDE: int) -> list:
         """
@@ -407,6 +562,54 @@ class LVK(Observatory):
         theta, phi = pix2ang(nside, ipix)
         return np.unique(ang2pix(NSIDE, theta, phi)).tolist()
 
+    def get_moc_ranges(self) -> np.ndarray:
+        """
+        Compute the 90% probability region of the skymap as sorted ranges of nested healpix pixels.
+        The ranges keep the native multi-order resolution of the skymap.
+
+        Return
+        ------
+        ranges: numpy array
+            a (n, 2) array, each row is a [start, end) range of nested pixels at the order MOC_MAX_ORDER
+
+        Examples
+        --------
+        >>> ranges = lvk_initial.get_moc_ranges()
+        >>> len(ranges)
+        390
+        """
+        skymap_90 = self.find_probability_region(0.9)
+        level, ipix = ah.uniq_to_level_ipix(skymap_90["UNIQ"])
+        return pixels_to_ranges(level, ipix)
+
+    def get_join_order(self) -> int:
+        """
+        Return the healpix order used to join this gw event with the ztf alerts,
+        the order is chosen to cover the 90% probability region with about ADAPTIVE_NPIX pixels.
+
+        Return
+        ------
+        order: integer
+            the healpix order of the footprint
+
+        Example
+        -------
+        >>> lvk_initial.get_join_order()
+        3
+        """
+        return area_to_order(self.err_to_arcminute() / 3600)
+
+    def get_footprint_area(self) -> float:
+        """
+        Return the area of the 90% probability region of the skymap in square degree
+
+        Example
+        -------
+        >>> float(round(lvk_initial.get_footprint_area(), 2))
+        665.77
+        """
+        return self.err_to_arcminute() / 3600
+
     def association_proba(
         self, ztf_ra: float, ztf_dec: float, jdstarthist: float, **kwargs
     ) -> float:
@@ -446,21 +649,42 @@ class LVK(Observatory):
         0.0054008620296433045
         """
 
-        skymap = self.get_skymap()
+        return self.association_proba_batch(
+            np.array([ztf_ra]), np.array([ztf_dec]), np.array([jdstarthist]), **kwargs
+        )[0]
+
+    def association_proba_batch(
+        self, ztf_ra: np.ndarray, ztf_dec: np.ndarray, jdstarthist: np.ndarray, **kwargs
+    ) -> np.ndarray:
+        """
+        return the probability density at an array of known sky positions for this gw event.
+
+        Parameters
+        ---------
+        ztf_ra: numpy array
+            ztf right ascension
+        ztf_dec: numpy array
+            ztf declination
+        jdstarthist: numpy array
+            first time the alert varied
+        kwargs: dict
+            see association_proba
 
-        # if "hdfs_adress" in kwargs and "gcn_status" in kwargs and "root_path" in kwargs:
-        #     skymap = self.get_skymap(**kwargs)
-        # else:
-        #     skymap = self.get_skymap()
+        Returns
+        -------
+        numpy array:
+            the probability density at each position
 
-        max_level = 29
-        max_nside = ah.level_to_nside(max_level)
-        level, ipix = ah.uniq_to_level_ipix(skymap["UNIQ"])
-        index = ipix * (2 ** (max_level - level)) ** 2
+        Examples
+        --------
+        >>> lvk_initial.association_proba_batch(
+        ...     np.array([0, 95.712890625]),
+        ...     np.array([0, -10.958863307027668]),
+        ...     np.array([0, 0])
+        ... )
+        array([  4.35454875e-13,   5.40086203e-03])
+        """
 
-        sorter = np.argsort(index)
-        match_ipix = ah.lonlat_to_healpix(
-            ztf_ra * u.deg, ztf_dec * u.deg, max_nside, order="nested"
-        )
-        i = sorter[np.searchsorted(index, match_ipix, side="right", sorter=sorter) - 1]
-        return skymap[i]["PROBDENSITY"].to_value(u.deg**-2)
+        # the skymap is decoded once per process, see skymap_cache_key
+        skymap_index = self.get_skymap_index(**kwargs)
+        return skymap_index.probdensity(ztf_ra, ztf_dec)
@@ -59,8 +59,20 @@ class Swift(Observatory):
         """
         instrument = self.detect_instruments()
         coords = vp.get_event_position(self.voevent)
+        return self.error_to_arcminute(instrument, coords.err)
 
-        err = 1 / 60 if coords.err == 0.0 else coords.err * 60
+    def error_to_arcminute(self, instrument: str, err: float) -> float:
+        """
+        Convert the error radius of a Swift voevent into arcminute.
+
+        Example
+        -------
+        >>> swift_bat.error_to_arcminute("BAT", 0.05)
+        3.0
+        >>> swift_bat.error_to_arcminute("FOM", 0.0) == 1 / 60
+        True
+        """
+        err = 1 / 60 if err == 0.0 else err * 60
 
         if instrument in ["XRT", "UVOT", "BAT", "FOM"]:
             return err
@@ -5,7 +5,13 @@ import sys
 import os.path as path
 from glob import glob
 import json
-from typing import Union
+from threading import Lock
+from typing import Union, TYPE_CHECKING
+from functools import lru_cache
+from lxml.objectify import ObjectifiedElement
+
+if TYPE_CHECKING:  # pragma: no cover
+    from fink_mm.observatory.observatory import Observatory
 
 
 def __import_module(module_path):
@@ -23,29 +29,94 @@ def __import_module(module_path):
     return getattr(sys.modules[module_name], module_name)
 
 
-def __get_observatory_class():
+def build_observatory_manifest() -> dict:
     """
-    get all the observatory class into a dictionnary with the observatory name as key
+    Build the observatory manifest from the observatory json descriptions.
+    The manifest contains, for each observatory, the paths of its class module and of its
+    json description relative to the observatory directory, its gcn file format,
+    its kafka topics, the shape of its footprint and its maximum delay. It is stored in observatory_manifest.json to not read
+    all the observatory descriptions at each import, see write_observatory_manifest.
+
+    Returns
+    -------
+    dict
+        the observatory manifest, a key value map (observatory name => observatory entry)
+
+    Examples
+    --------
+    >>> manifest = build_observatory_manifest()
+    >>> sorted(manifest)
+    ['fermi', 'icecube', 'integral', 'lvk', 'swift']
+    >>> manifest["lvk"]["module"], manifest["lvk"]["description"], manifest["lvk"]["gcn_file_format"]
+    ('LVK/LVK.py', 'LVK/lvk.json', 'json')
+    >>> manifest["lvk"]["max_delay_hours"], manifest["swift"]["max_delay_hours"]
+    (120, 48)
+
+    the manifest shipped with fink_mm must be up to date with the observatory descriptions
+    >>> build_observatory_manifest() == load_observatory_manifest()
+    True
     """
-    all_obs = glob(path.join(path.dirname(fink_mm.__file__), "observatory/*/*.py"))
+    obs_dir = path.join(path.dirname(fink_mm.__file__), OBSERVATORY_PATH)
+    manifest = {}
+    for p_json in sorted(glob(path.join(obs_dir, "*", "*.json"))):
+        with open(p_json, "r") as f:
+            instr_data = json.loads(f.read())
 
-    # remove the multiple __init__.py
-    all_obs = [p for p in all_obs if path.basename(p) != "__init__.py"]
+        # the observatory class module is the python file next to the description
+        all_module = [
+            p
+            for p in glob(path.join(path.dirname(p_json), "*.py"))
+            if path.basename(p) != "__init__.py"
+        ]
+        manifest[instr_data["name"].lower()] = {
+            "module": path.relpath(all_module[0], obs_dir),
+            "description": path.relpath(p_json, obs_dir),
+            "gcn_file_format": instr_data["gcn_file_format"].lower(),
+            "kafka_topics": instr_data["kafka_topics"],
+            "footprint": instr_data.get("footprint", "circle"),
+            "max_delay_hours": instr_data.get("max_delay_hours"),
+        }
+
+    return manifest
+
+
+def write_observatory_manifest():  # pragma: no cover
+    """
+    Write the observatory manifest in observatory_manifest.json,
+    must be called after each modification of an observatory json description
+    or after the addition of a new observatory.
+
+    python -c "from fink_mm.observatory import write_observatory_manifest; write_observatory_manifest()"
+    """
+    with open(OBSERVATORY_MANIFEST_PATH, "w") as f:
+        json.dump(build_observatory_manifest(), f, indent=4)
+        f.write("\n")
 
-    name_obs = [path.basename(el).split(".")[0].lower() for el in all_obs]
 
-    return {
-        n_instr: __import_module(path_instr)
-        for n_instr, path_instr in zip(name_obs, all_obs)
-    }
+def load_observatory_manifest() -> dict:
+    """
+    Load the observatory manifest shipped with fink_mm
+
+    Returns
+    -------
+    dict
+        the observatory manifest, see build_observatory_manifest
+    """
+    with open(OBSERVATORY_MANIFEST_PATH, "r") as f:
+        return json.loads(f.read())
 
 
-def __get_topics():
+def __get_topics(manifest: dict):
     """
-    Return the list of all topics from the observatory json description
+    Return the list of all topics from the observatory manifest
     and, for each topics, the file format received from kafka
     and, for each file format, the corresponding observatory sending in this format
 
+    Parameters
+    ----------
+    manifest: dict
+        the observatory manifest
+
     Returns
     -------
     res: string list
@@ -55,23 +126,16 @@ def __get_topics():
     instr_format: dict
         a key value map (observatory name => file format)
     """
-    p = files("fink_mm").__str__() + "/observatory/*/*.json"
     res = []
     topic_format = {}
     instr_format = {}
-    for p_json in glob(p):
-        with open(p_json, "r") as f:
-            instr_data = json.loads(f.read())
-
-            res += instr_data["kafka_topics"]
+    for obs_name, obs_entry in manifest.items():
+        res += obs_entry["kafka_topics"]
 
-            topic_list = topic_format.setdefault(instr_data["gcn_file_format"], [])
-            topic_list += instr_data["kafka_topics"]
-            topic_format[instr_data["gcn_file_format"]] = topic_list
+        topic_list = topic_format.setdefault(obs_entry["gcn_file_format"], [])
+        topic_list += obs_entry["kafka_topics"]
 
-            instr_format[instr_data["name"].lower()] = instr_data[
-                "gcn_file_format"
-            ].lower()
+        instr_format[obs_name] = obs_entry["gcn_file_format"]
 
     return res, topic_format, instr_format
 
@@ -81,8 +145,116 @@ OBSERVATORY_SCHEMA_VERSION = fink_mm.__observatory_schema_version__
 OBSERVATORY_JSON_SCHEMA_PATH = files("fink_mm").joinpath(
     "observatory/observatory_schema_version_{}.json".format(OBSERVATORY_SCHEMA_VERSION)
 )
-__OBS_CLASS = __get_observatory_class()
-TOPICS, TOPICS_FORMAT, INSTR_FORMAT = __get_topics()
+OBSERVATORY_MANIFEST_PATH = files("fink_mm").joinpath(
+    "observatory/observatory_manifest.json"
+)
+__OBS_MANIFEST = load_observatory_manifest()
+TOPICS, TOPICS_FORMAT, INSTR_FORMAT = __get_topics(__OBS_MANIFEST)
+
+# the footprint of each observatory (observatory name => 'circle' or 'skymap'),
+# the circular footprints are computed from the ra, dec and err_arcmin columns
+# without decoding the raw event.
+INSTR_FOOTPRINT = {
+    obs_name: obs_entry["footprint"] for obs_name, obs_entry in __OBS_MANIFEST.items()
+}
+
+# the maximum delay in hours between the trigger time of a gcn and the first detection
+# of the ztf alerts joined with this gcn (observatory name => hours or None if no upper bound)
+INSTR_MAX_DELAY = {
+    obs_name: obs_entry.get("max_delay_hours")
+    for obs_name, obs_entry in __OBS_MANIFEST.items()
+}
+
+# the observatory modules are imported at the first use of their class
+# (observatory name => observatory class)
+__IMPORT_LOCK = Lock()
+__OBSERVATORY_CLASSES = {}
+
+
+def __get_observatory_class(observatory_name: str):
+    """
+    Return the observatory class with the given name, the class module is imported
+    at the first call.
+
+    Parameters
+    ----------
+    observatory_name: string
+        the observatory name in lower case
+
+    Returns
+    -------
+    class
+        the observatory class
+
+    Examples
+    --------
+    >>> from concurrent.futures import ThreadPoolExecutor
+    >>> with ThreadPoolExecutor(8) as pool:
+    ...     obs_classes = list(pool.map(__get_observatory_class, ["swift"] * 8))
+    >>> len(set(obs_classes)), obs_classes[0].__name__
+    (1, 'Swift')
+    """
+    obs_class = __OBSERVATORY_CLASSES.get(observatory_name)
+    if obs_class is not None:
+        return obs_class
+
+    module_path = path.join(
+        path.dirname(fink_mm.__file__),
+        OBSERVATORY_PATH,
+        __OBS_MANIFEST[observatory_name]["module"],
+    )
+    # two threads must not import the same module, they would get two different classes:
+    # the first import is done under the lock and the other threads get its class
+    with __IMPORT_LOCK:
+        obs_class = __OBSERVATORY_CLASSES.get(observatory_name)
+        if obs_class is None:
+            obs_class = __import_module(module_path)
+            __OBSERVATORY_CLASSES[observatory_name] = obs_class
+        return obs_class
+
+
+@lru_cache(maxsize=None)
+def __get_observatory_schema() -> dict:
+    """
+    Return the json schema of the observatory descriptions, read once by process.
+    """
+    with open(OBSERVATORY_JSON_SCHEMA_PATH, "r") as f:
+        return json.loads(f.read())
+
+
+@lru_cache(maxsize=None)
+def get_observatory_description(instr_file: str) -> dict:
+    """
+    Return the json description of an observatory validated against the observatory schema.
+    The description is read and validated once by process, the next calls
+    return the same dictionnary so it must not be modified.
+
+    Parameters
+    ----------
+    instr_file: string
+        path of the .json describing an observatory, relative to the fink_mm package
+
+    Returns
+    -------
+    dict
+        the observatory description
+
+    Examples
+    --------
+    >>> fermi_description = get_observatory_description("observatory/Fermi/fermi.json")
+    >>> fermi_description["name"], fermi_description["gcn_file_format"]
+    ('Fermi', 'xml')
+    >>> fermi_description is get_observatory_description("observatory/Fermi/fermi.json")
+    True
+    """
+    with open(files("fink_mm").joinpath(instr_file), "r") as f:
+        instr_data = json.loads(f.read())
+
+    # imported here as jsonschema is only needed at the first instantiation of an observatory
+    from jsonschema import validate
+
+    validate(instance=instr_data, schema=__get_observatory_schema())
+    return instr_data
 
 
 def __get_detector(voevent):
@@ -118,7 +290,18 @@ def __get_detector(voevent):
     >>> __get_detector(integral_weak_voevent)
     'integral'
     """
-    ivorn = voevent.attrib["ivorn"]
+    return __ivorn_to_detector(voevent.attrib["ivorn"])
+
+
+def __ivorn_to_detector(ivorn: str) -> str:
+    """
+    Return the detector that emitted a voevent from its ivorn, see __get_detector.
+
+    Examples
+    --------
+    >>> __ivorn_to_detector("ivo://nasa.gsfc.gcn/AMON#ICECUBE_Gold_Event2022-12-23T07:43:00.52_24_137751_058301469_0")
+    'icecube'
+    """
     split_ivorn = ivorn.split("#")
     instr_name = path.basename(split_ivorn[0]).lower()
 
@@ -128,13 +311,7 @@ def __get_detector(voevent):
     return instr_name
 
 
-# The fink_mm.observatory import have to be after the OBSERVATORY_JSON_SCHEMA_PATH definiton
-# to avoid a circular import issue
-from fink_mm.observatory import observatory
-from lxml.objectify import ObjectifiedElement
-
-
-def voevent_to_class(voevent: ObjectifiedElement) -> observatory.Observatory:
+def voevent_to_class(voevent: ObjectifiedElement) -> "Observatory":
     """
     Return the observatory class corresponding to the voevent
 
@@ -167,10 +344,46 @@ def voevent_to_class(voevent: ObjectifiedElement) -> observatory.Observatory:
     <class 'Integral.Integral'>
     """
     observatory_name = __get_detector(voevent)
-    return __OBS_CLASS[observatory_name.lower()](voevent)
+    return __get_observatory_class(observatory_name.lower())(voevent)
+
+
+@lru_cache(maxsize=None)
+def __get_shared_observatory(observatory_name: str) -> "Observatory":
+    """
+    Return an observatory class without voevent, created once by observatory.
+    """
+    return __get_observatory_class(observatory_name)(None)
+
+
+def ivorn_to_class(ivorn: str) -> "Observatory":
+    """
+    Return the observatory class corresponding to the ivorn of a voevent.
+    The returned class contains no voevent and is shared between the calls,
+    it is used by the fast path of the gcn reader to get the observatory description
+    and to call voevent_fields_to_df.
+
+    Parameters
+    ----------
+    ivorn: string
+        the ivorn of a gcn voevent
+
+    Return
+    ------
+    observatory: Observatory
+        an observatory class without voevent
+
+    Examples
+    --------
+    >>> obs = ivorn_to_class("ivo://nasa.gsfc.gcn/Fermi#GBM_Fin_Pos2022-07-29T10:17:31.51_680782656_0-655")
+    >>> type(obs), obs.voevent
+    (<class 'Fermi.Fermi'>, None)
+    >>> obs is ivorn_to_class("ivo://nasa.gsfc.gcn/Fermi#GBM_Gnd_Pos2022-07-29T10:17:31.51_680782656_0-500")
+    True
+    """
+    return __get_shared_observatory(__ivorn_to_detector(ivorn).lower())
 
 
-def json_to_class(gcn: dict) -> observatory.Observatory:
+def json_to_class(gcn: dict) -> "Observatory":
     """
     Return an observatory class based on the given json.
     Raise an exception if not an allowed json.
@@ -182,18 +395,18 @@ def json_to_class(gcn: dict) -> observatory.Observatory:
 
     Returns
     -------
-    observatory.Observatory
+    Observatory
         an observatory class
     """
     if "superevent_id" in gcn:
-        return __OBS_CLASS["lvk"](gcn)
+        return __get_observatory_class("lvk")(gcn)
     else:
         raise Exception("unknown json format")
 
 
 def obsname_to_class(
     obsname: str, raw_event: Union[ObjectifiedElement, dict]
-) -> observatory.Observatory:
+) -> "Observatory":
     """
     Return the observatory class corresponding to the given obsname and raw_event
 
@@ -206,7 +419,7 @@ def obsname_to_class(
 
     Returns
     -------
-    observatory.Observatory
+    Observatory
         the observatory class
     """
-    return __OBS_CLASS[obsname.lower()](raw_event)
+    return __get_observatory_class(obsname.lower())(raw_event)
@@ -1,6 +1,3 @@
-import json
-from jsonschema import validate
-from importlib_resources import files
 import voeventparse as vp
 import datetime as dt
 from astropy.coordinates import SkyCoord
@@ -16,15 +13,99 @@ from astropy.time import Time
 
 from fink_utils.science.utils import ra2phi, dec2theta
 
-from fink_mm.observatory import OBSERVATORY_JSON_SCHEMA_PATH
+from fink_mm.observatory import get_observatory_description
+from fink_mm.gcn_stream.gcn_reader import UnknownVoeventLayout
 from fink_mm.test.hypothesis.observatory_schema import voevent_df_schema
 from fink_mm.utils.grb_prob import serendipitous_association_proba
+from fink_mm.utils.moc import disc_to_ranges, degrade_ranges, area_to_order
 
 
 class BadInstrument(Exception):
     pass
 
 
+def build_voevent_df(
+    observatory: str,
+    instrument: str,
+    event: str,
+    ivorn: str,
+    trigger_id: str,
+    ra: float,
+    dec: float,
+    err_arcmin: float,
+    time_jd: float,
+    time_utc: str,
+    raw_event: str,
+) -> pd.DataFrame:
+    """
+    Build the voevent dataframe from the extracted fields of a voevent.
+    The columns have the types of voevent_df_schema, the dataframe is not validated
+    to keep the fast path of the gcn reader fast, see Observatory.voevent_fields_to_df.
+
+    Parameters
+    ----------
+    observatory: string
+        the observatory name
+    instrument: string
+        the instrument that send the voevent
+    event: string
+        the event that trigger the gcn
+    ivorn: string
+        the ivorn of the voevent
+    trigger_id: string
+        the trigger id of the voevent
+    ra: float
+        right ascension
+    dec: float
+        declination
+    err_arcmin: float
+        error box of the event in arcminute
+    time_jd: float
+        trigger time of the voevent in julian date
+    time_utc: string
+        trigger time of the voevent in UTC, iso format
+    raw_event: string
+        the original voevent
+
+    Returns
+    -------
+    df : dataframe
+        see Observatory.voevent_to_df
+
+    Examples
+    --------
+    >>> build_voevent_df(
+    ...     "Fermi", "GBM", "", "ivorn", "680782656", 316.69, -4.1699, 680.4,
+    ...     2459789.9288369213, "2022-07-29 10:17:31.510", "<voevent/>"
+    ... )[["triggerId", "triggerTimeUTC", "year", "month", "day"]]
+       triggerId                   triggerTimeUTC  year month day
+    0  680782656 2022-07-29 10:17:31.510000+00:00  2022    07  29
+    """
+    trigger_time = pd.to_datetime([time_utc], utc=True)
+    df = pd.DataFrame(
+        {
+            "observatory": [observatory],
+            "instrument": [instrument],
+            "event": [event],
+            "ivorn": [ivorn],
+            "triggerId": [trigger_id],
+            "ra": [float(ra)],
+            "dec": [float(dec)],
+            "err_arcmin": [float(err_arcmin)],
+            "ackTime": [dt.datetime.now()],
+            "triggerTimejd": [float(time_jd)],
+            "triggerTimeUTC": trigger_time,
+            "raw_event": [raw_event],
+        }
+    )
+
+    df["year"] = trigger_time.strftime("%Y")
+    df["month"] = trigger_time.strftime("%m")
+    df["day"] = trigger_time.strftime("%d")
+
+    return df
+
+
 class Observatory(ABC):
     """
     Main class for the instrument.
@@ -49,15 +130,8 @@ class Observatory(ABC):
         <class 'Fermi.Fermi'>
         """
 
-        instr_path = files("fink_mm").joinpath(instr_file)
-
-        with open(instr_path, "r") as f:
-            instr_data = json.loads(f.read())
-
-        with open(OBSERVATORY_JSON_SCHEMA_PATH, "r") as f:
-            schema = json.loads(f.read())
-
-        validate(instance=instr_data, schema=schema)
+        # the description is read and validated only at the first instantiation
+        instr_data = get_observatory_description(instr_file)
 
         self.observatory = instr_data["name"]
         self.packet_type = instr_data["packet_type"]
@@ -153,6 +227,37 @@ class Observatory(ABC):
     def err_to_arcminute(self):
         pass
 
+    def error_to_arcminute(self, instrument: str, err: float) -> float:
+        """
+        Convert the error radius of a voevent position into arcminute,
+        implemented by the observatories sending voevent.
+        Raise UnknownVoeventLayout for the other observatories, the notice is then
+        parsed by voeventparse, see parse_xml_alert.
+
+        Parameters
+        ----------
+        instrument: string
+            the instrument that send the voevent
+        err: float
+            the Error2Radius field of the voevent position
+
+        Returns
+        -------
+        float
+            the error radius in arcminute
+
+        Example
+        -------
+        >>> try:
+        ...     lvk_initial.error_to_arcminute("LVK", 1.0)
+        ... except UnknownVoeventLayout:
+        ...     print("no voevent error radius")
+        no voevent error radius
+        """
+        raise UnknownVoeventLayout(
+            "{} does not send voevent with an error radius".format(self.observatory)
+        )
+
     def get_trigger_time(self):
         """
         Return the trigger time in UTC and julian date
@@ -261,6 +366,51 @@ class Observatory(ABC):
 
         return df
 
+    def voevent_fields_to_df(self, fields: dict, raw_event: str) -> pd.DataFrame:
+        """
+        Convert the fields extracted by the fast path of the gcn reader into a dataframe.
+        The dataframe is the same as the one returned by voevent_to_df
+        except the raw_event column which contains the original voevent.
+
+        Parameters
+        ----------
+        fields : dict
+            the voevent fields, see fink_mm.gcn_stream.gcn_reader.extract_voevent_fields
+        raw_event : string
+            the original voevent
+
+        Returns
+        -------
+        df : dataframe
+            see voevent_to_df
+
+        Examples
+        --------
+        >>> gcn = open(fermi_gbm_voevent_path, "rb").read()
+        >>> from fink_mm.gcn_stream.gcn_reader import extract_voevent_fields
+        >>> fields = extract_voevent_fields(gcn)
+        >>> df = fermi_gbm.voevent_fields_to_df(fields, gcn.decode("UTF-8"))
+        >>> cols = [c for c in df.columns if c not in ["ackTime", "raw_event"]]
+        >>> assert_frame_equal(df[cols], fermi_gbm.voevent_to_df()[cols])
+        """
+        ivorn = fields["ivorn"]
+        instrument = ivorn.split("#")[1].split("_")[0]
+        time = Time(fields["isotime"], format="isot", scale="utc")
+
+        return build_voevent_df(
+            self.observatory,
+            instrument,
+            "",
+            ivorn,
+            fields["params"]["TrigID"],
+            fields["ra"],
+            fields["dec"],
+            self.error_to_arcminute(instrument, fields["err"]),
+            time.jd,
+            time.iso,
+            raw_event,
+        )
+
     def get_pixels(self, NSIDE: int) -> list:
         """
         Compute the pixels within the error box of the voevent
@@ -294,6 +444,99 @@ class Observatory(ABC):
         )
         return ipix_disc
 
+    def get_moc_ranges(self) -> np.ndarray:
+        """
+        Compute the footprint of the voevent as sorted ranges of nested healpix pixels.
+        The footprint covers the association radius used by association_proba (1.5 times the error box).
+
+        Return
+        ------
+        ranges: numpy array
+            a (n, 2) array, each row is a [start, end) range of nested pixels at the order MOC_MAX_ORDER
+
+        Examples
+        --------
+        >>> ranges = fermi_gbm.get_moc_ranges()
+        >>> len(ranges)
+        15
+        >>> from fink_mm.utils.moc import ranges_contain
+        >>> ra, dec = fermi_gbm.get_most_probable_position()
+        >>> ranges_contain(ranges, hp.ang2pix(2**29, ra, dec, nest=True, lonlat=True))
+        True
+        """
+        coords = vp.get_event_position(self.voevent)
+        voevent_error = self.err_to_arcminute()
+        return disc_to_ranges(coords.ra, coords.dec, 1.5 * voevent_error / 60)
+
+    def get_join_order(self) -> int:
+        """
+        Return the healpix order used to join this voevent with the ztf alerts,
+        the order is chosen to cover the association area (1.5 times the error box)
+        with about ADAPTIVE_NPIX pixels.
+
+        Return
+        ------
+        order: integer
+            the healpix order of the footprint
+
+        Examples
+        --------
+        >>> fermi_gbm.get_join_order()
+        2
+        >>> swift_bat.get_join_order()
+        10
+        """
+        voevent_error = self.err_to_arcminute()
+        return area_to_order(np.pi * (1.5 * voevent_error / 60) ** 2)
+
+    def get_footprint_area(self) -> float:
+        """
+        Return the area of the error box of the voevent in square degree
+
+        Return
+        ------
+        area: float
+            the area of the error disc
+
+        Examples
+        --------
+        >>> round(swift_bat.get_footprint_area(), 6)
+        0.007854
+        """
+        return np.pi * (self.err_to_arcminute() / 60) ** 2
+
+    def get_adaptive_ranges(self, min_order: int = 0) -> np.ndarray:
+        """
+        Compute the footprint of the voevent as nested pixel ranges
+        aligned on the pixels at the join order of this voevent (see get_join_order).
+
+        Parameters
+        ----------
+        min_order: integer
+            the coarsest order of the returned ranges, the join order is raised to min_order if lower
+
+        Return
+        ------
+        ranges: numpy array
+            a (n, 2) array, each row is a [start, end) range of nested pixels at the order MOC_MAX_ORDER
+
+        Examples
+        --------
+        >>> ranges = swift_bat.get_adaptive_ranges()
+        >>> len(ranges)
+        7
+        >>> int(np.sum(ranges[:, 1] - ranges[:, 0]) // 4 ** (29 - swift_bat.get_join_order()))
+        13
+
+        >>> fermi_gbm.get_join_order()
+        2
+        >>> len(fermi_gbm.get_adaptive_ranges()), len(fermi_gbm.get_adaptive_ranges(4))
+        (5, 15)
+        """
+        return degrade_ranges(
+            self.get_moc_ranges(), max(self.get_join_order(), min_order)
+        )
+
     def association_proba(
         self, ztf_ra: float, ztf_dec: float, jdstarthist: float, **kwargs
     ) -> float:
@@ -301,7 +544,8 @@ class Observatory(ABC):
         Compute the association probability between a gcn event and a ztf alerts
 
         This default function for the observatory class are reliable for GRB event.
-        Overload this function to return a custom probability for other class of event.
+        Overload the association_proba_batch function to return a custom probability for other class of event.
+        This function is a scalar wrapper around association_proba_batch.
 
         Parameters
         ----------
@@ -343,6 +587,48 @@ class Observatory(ABC):
         >>> print(round(r, 12))
         0.999999994283
         """
+        return self.association_proba_batch(
+            np.array([ztf_ra]), np.array([ztf_dec]), np.array([jdstarthist]), **kwargs
+        )[0]
+
+    def association_proba_batch(
+        self, ztf_ra: np.ndarray, ztf_dec: np.ndarray, jdstarthist: np.ndarray, **kwargs
+    ) -> np.ndarray:
+        """
+        Compute the association probability between a gcn event and an array of ztf alerts
+
+        This default function for the observatory class are reliable for GRB event.
+        Overload this function to return a custom probability for other class of event.
+
+        Parameters
+        ----------
+        ztf_ra : numpy array
+            right ascension coordinates of the ztf alerts
+        ztf_dec : numpy array
+            declination coordinates of the ztf alerts
+        jdstarthist : numpy array
+            Earliest Julian date of epoch corresponding to ndethist [days]
+
+        Return
+        ------
+        association_proba: numpy array
+            association probability for each ztf alerts, -1.0 if the alert is not associated with the gcn
+            0 <= proba <= 1 where closer to 0 implies higher likelihood of being associated with the events
+
+        Examples
+        --------
+        >>> tr_time = Time("2022-07-30T15:48:54.89").jd
+        >>> r = swift_bat.association_proba_batch(
+        ...     np.array([0, 225.0206, 225.0206]),
+        ...     np.array([0, -69.4968, -69.4968]),
+        ...     np.array([0, tr_time+1, tr_time-1])
+        ... )
+        >>> np.around(r, 12).tolist()
+        [-1.0, 0.999999998715, -1.0]
+        """
+        ztf_ra = np.asarray(ztf_ra, dtype=np.float64)
+        ztf_dec = np.asarray(ztf_dec, dtype=np.float64)
+        jdstarthist = np.asarray(jdstarthist, dtype=np.float64)
 
         # grb detection rate (detection/year) for the self observatory
         grb_det_rate = self.detection_rate
@@ -366,19 +652,19 @@ class Observatory(ABC):
             ztf_coords.separation(grb_coord).arcminute <= 1.5 * grb_error
         )  # 63.5 * grb_error
 
-        if time_condition and spatial_condition:
-            # convert the delay in year
-            delay_year = delay / 365.25
+        is_associated = time_condition & spatial_condition
 
-            # compute serendipitous probability
-            return serendipitous_association_proba(
-                grb_det_rate,
-                delay_year,
-                grb_error / 60
-            )
+        association_proba = np.full(len(ztf_ra), -1.0)
+
+        # convert the delay in year
+        delay_year = delay[is_associated] / 365.25
+
+        # compute serendipitous probability
+        association_proba[is_associated] = serendipitous_association_proba(
+            grb_det_rate, delay_year, grb_error / 60
+        )
 
-        else:
-            return -1.0
+        return association_proba
 
 
 # command to call to run the doctest :
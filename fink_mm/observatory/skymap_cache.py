@@ -0,0 +1,344 @@
+import os
+import numpy as np
+import astropy.units as u
+import astropy_healpix as ah
+from astropy.table import QTable
+from collections import OrderedDict
+from threading import Lock
+
+# healpix level used to search the multi-order pixel containing a sky position
+MAX_LEVEL = 29
+
+# default memory bound of the per-process skymap cache (in bytes)
+DEFAULT_CACHE_SIZE = 256 * 1024**2
+
+# environment variable overriding the memory bound of the skymap cache (in megabytes),
+# set on the spark executors from the skymap_cache_size entry of the [ADMIN] section
+SKYMAP_CACHE_SIZE_ENV = "FINK_MM_SKYMAP_CACHE_SIZE"
+
+
+def read_cache_size() -> int:
+    """
+    Return the memory bound of the skymap cache, read from the FINK_MM_SKYMAP_CACHE_SIZE
+    environment variable (in megabytes) or DEFAULT_CACHE_SIZE if not set.
+
+    Return
+    ------
+    int
+        the memory bound of the cache (in bytes)
+
+    Example
+    -------
+    >>> read_cache_size() == DEFAULT_CACHE_SIZE
+    True
+    >>> os.environ[SKYMAP_CACHE_SIZE_ENV] = "64"
+    >>> read_cache_size()
+    67108864
+    >>> del os.environ[SKYMAP_CACHE_SIZE_ENV]
+    """
+    cache_size = os.environ.get(SKYMAP_CACHE_SIZE_ENV)
+    if cache_size is None:
+        return DEFAULT_CACHE_SIZE
+    return int(float(cache_size) * 1024**2)
+
+
+class SkymapIndex:
+    """
+    A decoded multi-order skymap with the arrays used to search it.
+    The skymap and the arrays are shared between all the users of the cache
+    and must not be modified in place.
+    """
+
+    def __init__(
+        self,
+        skymap: QTable,
+        sorter: np.ndarray = None,
+        prob_order: np.ndarray = None,
+        cumprob: np.ndarray = None,
+    ):
+        """
+        Precompute the search arrays of a multi-order skymap,
+        the sort and cumulative arrays already computed can be given (see skymap_store).
+
+        Parameters
+        ----------
+        skymap: astropy.QTable
+            a multi-order skymap with the UNIQ and PROBDENSITY columns
+        sorter: numpy array
+            the indices sorting the pixels by their nested index at the max level
+        prob_order: numpy array
+            the indices sorting the pixels by decreasing probability density
+        cumprob: numpy array
+            the cumulative probability of the pixels sorted by prob_order
+
+        Example
+        -------
+        >>> skymap_index = SkymapIndex(lvk_initial.get_skymap())
+        >>> len(skymap_index.index) == len(skymap_index.prob_order) == 16896
+        True
+        >>> skymap_index.nbytes
+        1351680
+        """
+        self.skymap = skymap
+
+        level, ipix = ah.uniq_to_level_ipix(skymap["UNIQ"])
+
+        # nested index of each pixel at the max level, sorted by the sorter
+        self.index = ipix * (2 ** (MAX_LEVEL - level)) ** 2
+        self.sorter = np.argsort(self.index) if sorter is None else sorter
+
+        # pixels sorted by decreasing probability density and the cumulative probability
+        self.pixel_area = ah.nside_to_pixel_area(ah.level_to_nside(level))
+        self.prob_order = (
+            skymap.argsort("PROBDENSITY", reverse=True)
+            if prob_order is None
+            else prob_order
+        )
+        if cumprob is None:
+            pixel_prob = self.pixel_area * skymap["PROBDENSITY"]
+            cumprob = np.cumsum(pixel_prob[self.prob_order]).to_value(
+                u.dimensionless_unscaled
+            )
+        self.cumprob = cumprob
+
+        self.nbytes = sum(
+            np.asarray(arr).nbytes
+            for arr in [
+                self.index,
+                self.sorter,
+                self.pixel_area,
+                self.prob_order,
+                self.cumprob,
+            ]
+        ) + sum(np.asarray(skymap[col]).nbytes for col in skymap.colnames)
+
+    def region_size(self, prob: float) -> int:
+        """
+        Return the number of pixels within the region of a given probability
+
+        Parameters
+        ----------
+        prob: float
+            the probability of the region
+
+        Return
+        ------
+        int
+            the number of the most probable pixels covering the probability region
+
+        Example
+        -------
+        >>> SkymapIndex(lvk_initial.get_skymap()).region_size(0.9)
+        9704
+        """
+        return self.cumprob.searchsorted(prob)
+
+    def probability_region(self, prob: float) -> QTable:
+        """
+        Return the pixels of the region of a given probability
+        sorted by decreasing probability density
+
+        Parameters
+        ----------
+        prob: float
+            the probability of the region
+
+        Return
+        ------
+        skymap_region_prob: Astropy Table
+            the skymap containing the pixel within the probability region
+
+        Example
+        -------
+        >>> map_90 = SkymapIndex(lvk_initial.get_skymap()).probability_region(0.9)
+        >>> len(map_90)
+        9704
+        """
+        return self.skymap[self.prob_order[: self.region_size(prob)]]
+
+    def area(self, prob: float) -> u.Quantity:
+        """
+        Return the area of the region of a given probability
+
+        Parameters
+        ----------
+        prob: float
+            the probability of the region
+
+        Return
+        ------
+        area: astropy Quantity
+            the area of the probability region
+
+        Example
+        -------
+        >>> SkymapIndex(lvk_initial.get_skymap()).area(0.9).to_value(u.arcmin**2)
+        2396770.8626295296
+        """
+        return self.pixel_area[self.prob_order[: self.region_size(prob)]].sum()
+
+    def probdensity(self, ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+        """
+        Return the probability density of the skymap at the given sky positions
+
+        Parameters
+        ----------
+        ra: numpy array
+            right ascension (in degree)
+        dec: numpy array
+            declination (in degree)
+
+        Return
+        ------
+        numpy array
+            the probability density at each position (in deg**-2)
+
+        Example
+        -------
+        >>> SkymapIndex(lvk_initial.get_skymap()).probdensity(
+        ...     np.array([0, 95.712890625]), np.array([0, -10.958863307027668])
+        ... )
+        array([  4.35454875e-13,   5.40086203e-03])
+        """
+        match_ipix = ah.lonlat_to_healpix(
+            np.asarray(ra) * u.deg,
+            np.asarray(dec) * u.deg,
+            ah.level_to_nside(MAX_LEVEL),
+            order="nested",
+        )
+        i = np.searchsorted(self.index, match_ipix, side="right", sorter=self.sorter)
+        i = self.sorter[i - 1]
+        return self.skymap["PROBDENSITY"][i].to_value(u.deg**-2)
+
+
+class SkymapCache:
+    """
+    Least recently used cache of the decoded skymaps, bounded by memory.
+    One cache lives in each process (see SKYMAP_CACHE) so a skymap is decoded
+    only once per executor and not once per row or per batch.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_SIZE):
+        """
+        Initialise an empty cache
+
+        Parameters
+        ----------
+        max_bytes: int
+            the memory bound of the cache (in bytes),
+            the least recently used skymaps are evicted above this bound.
+
+        Example
+        -------
+        >>> cache = SkymapCache(3 * 1024**2)
+        >>> len(cache), cache.nbytes
+        (0, 0)
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._entries
+
+    def get(self, key: tuple) -> SkymapIndex:
+        """
+        Return the cached skymap of a key or None if not in the cache
+
+        Parameters
+        ----------
+        key: tuple
+            the cache key, see LVK.skymap_cache_key for the LVK skymaps
+
+        Return
+        ------
+        SkymapIndex or None
+            the cached skymap
+
+        Example
+        -------
+        >>> cache = SkymapCache()
+        >>> cache.get(("S230518h", "initial")) is None
+        True
+        >>> cache.put(("S230518h", "initial"), SkymapIndex(lvk_initial.get_skymap()))
+        >>> len(cache.get(("S230518h", "initial")).skymap)
+        16896
+        >>> cache.hits, cache.misses
+        (1, 1)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, skymap_index: SkymapIndex):
+        """
+        Add a skymap to the cache and evict the least recently used skymaps
+        if the memory bound is exceeded.
+        A skymap larger than the memory bound is not cached.
+
+        Parameters
+        ----------
+        key: tuple
+            the cache key, see LVK.skymap_cache_key for the LVK skymaps
+        skymap_index: SkymapIndex
+            the skymap to cache
+
+        Example
+        -------
+        >>> skymap_index = SkymapIndex(lvk_initial.get_skymap())
+        >>> cache = SkymapCache(3 * 1024**2)
+        >>> cache.put(("S230518h", "initial"), skymap_index)
+        >>> cache.put(("S230518h", "update"), skymap_index)
+        >>> cache.get(("S230518h", "initial")) is skymap_index
+        True
+        >>> cache.put(("S230520ae", "initial"), skymap_index)
+        >>> ("S230518h", "update") in cache, len(cache), cache.nbytes
+        (False, 2, 2703360)
+
+        >>> cache = SkymapCache(1024)
+        >>> cache.put(("S230518h", "initial"), skymap_index)
+        >>> len(cache)
+        0
+        """
+        if skymap_index.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self.nbytes -= old_entry.nbytes
+            self._entries[key] = skymap_index
+            self.nbytes += skymap_index.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        """
+        Remove all the skymaps from the cache
+
+        Example
+        -------
+        >>> cache = SkymapCache()
+        >>> cache.put(("S230518h", "initial"), SkymapIndex(lvk_initial.get_skymap()))
+        >>> cache.clear()
+        >>> len(cache), cache.nbytes
+        (0, 0)
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+# the per-process skymap cache
+SKYMAP_CACHE = SkymapCache(read_cache_size())
@@ -0,0 +1,260 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import astropy.units as u
+from astropy.table import QTable
+
+from fink_mm.observatory.skymap_cache import SkymapIndex
+
+# name of the skymap store in the gcn storage,
+# the directories starting with an underscore are ignored by the spark and pyarrow readers
+SKYMAP_STORE_DIR = "_skymaps"
+
+# the arrays of a stored skymap, saved in one numpy file by array
+SKYMAP_ARRAYS = ["uniq", "probdensity", "sorter", "prob_order", "cumprob"]
+
+# the original fits file of a stored skymap (with the DIST* columns and the header),
+# used to put the skymap back in the raw_event
+SKYMAP_FITS = "skymap.fits"
+
+
+def skymap_store_path(gcn_rawdatapath: str) -> str:
+    """
+    Return the location of the skymap store of a gcn storage
+
+    Parameters
+    ----------
+    gcn_rawdatapath : string
+        the root path of the gcn storage
+
+    Returns
+    -------
+    string
+        the root path of the skymap store
+
+    Example
+    -------
+    >>> skymap_store_path("gcn_storage/raw")
+    'gcn_storage/raw/_skymaps'
+    """
+    return os.path.join(gcn_rawdatapath, SKYMAP_STORE_DIR)
+
+
+def skymap_path(store_path: str, superevent_id: str, gcn_status: str) -> str:
+    """
+    Return the location of a stored skymap
+
+    Parameters
+    ----------
+    store_path : string
+        the root path of the skymap store
+    superevent_id : string
+        the superevent identifier of the gw event
+    gcn_status : string
+        used to distinguish gcn with the same triggerId (account the gcn update)
+
+    Returns
+    -------
+    string
+        the directory containing the arrays of the skymap
+
+    Example
+    -------
+    >>> skymap_path("gcn_storage/raw/_skymaps", "S230518h", "initial")
+    'gcn_storage/raw/_skymaps/S230518h/initial'
+    """
+    return os.path.join(store_path, superevent_id, gcn_status)
+
+
+def write_skymap(
+    store_path: str,
+    superevent_id: str,
+    gcn_status: str,
+    skymap_index: SkymapIndex,
+    skymap_bytes: bytes = None,
+) -> bool:
+    """
+    Write the UNIQ and PROBDENSITY columns of a skymap with its sort and cumulative arrays
+    in the skymap store, and the original fits file of the skymap if given.
+    The files are written in a temporary directory renamed at the end
+    so a skymap is never read partially written. A skymap already stored is not rewritten.
+
+    Parameters
+    ----------
+    store_path : string
+        the root path of the skymap store, must be on a local or a mounted filesystem
+    superevent_id : string
+        the superevent identifier of the gw event
+    gcn_status : string
+        used to distinguish gcn with the same triggerId (account the gcn update)
+    skymap_index : SkymapIndex
+        the decoded skymap
+    skymap_bytes : bytes
+        the original fits file of the skymap, see read_skymap_bytes
+
+    Returns
+    -------
+    boolean
+        True if the skymap has been written, False if it was already stored
+
+    Example
+    -------
+    >>> tmp_dir = tempfile.TemporaryDirectory()
+    >>> skymap_index = SkymapIndex(lvk_initial.decode_skymap())
+    >>> write_skymap(tmp_dir.name, "S230518h", "initial", skymap_index)
+    True
+    >>> sorted(os.listdir(tmp_dir.name + "/S230518h/initial"))
+    ['cumprob.npy', 'prob_order.npy', 'probdensity.npy', 'sorter.npy', 'uniq.npy']
+    >>> write_skymap(tmp_dir.name, "S230518h", "initial", skymap_index)
+    False
+
+    >>> from base64 import b64decode
+    >>> skymap_bytes = b64decode(lvk_initial.voevent["event"]["skymap"])
+    >>> write_skymap(tmp_dir.name, "S230518h", "update_0", skymap_index, skymap_bytes)
+    True
+    >>> "skymap.fits" in os.listdir(tmp_dir.name + "/S230518h/update_0")
+    True
+    """
+    path = skymap_path(store_path, superevent_id, gcn_status)
+    if os.path.exists(path):
+        return False
+
+    arrays = {
+        "uniq": np.asarray(skymap_index.skymap["UNIQ"], dtype=np.int64),
+        "probdensity": skymap_index.skymap["PROBDENSITY"].to_value(u.sr**-1),
+        "sorter": skymap_index.sorter,
+        "prob_order": skymap_index.prob_order,
+        "cumprob": skymap_index.cumprob,
+    }
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = tempfile.mkdtemp(
+        prefix=".{}".format(gcn_status), dir=os.path.dirname(path)
+    )
+    try:
+        for name in SKYMAP_ARRAYS:
+            np.save(
+                os.path.join(tmp_path, name + ".npy"),
+                np.ascontiguousarray(
+                    arrays[name], dtype=arrays[name].dtype.newbyteorder("=")
+                ),
+            )
+        if skymap_bytes is not None:
+            with open(os.path.join(tmp_path, SKYMAP_FITS), "wb") as f:
+                f.write(skymap_bytes)
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        # the skymap has been stored by another writer
+        if os.path.exists(path):
+            return False
+        raise
+    return True
+
+
+def read_skymap(store_path: str, superevent_id: str, gcn_status: str) -> SkymapIndex:
+    """
+    Load a skymap from the skymap store. The arrays are memory-mapped, so the processes
+    of a host reading the same skymap share a single copy in the page cache.
+
+    Parameters
+    ----------
+    store_path : string
+        the root path of the skymap store
+    superevent_id : string
+        the superevent identifier of the gw event
+    gcn_status : string
+        used to distinguish gcn with the same triggerId (account the gcn update)
+
+    Returns
+    -------
+    SkymapIndex
+        the skymap with its search arrays, the arrays are read only
+
+    Example
+    -------
+    >>> tmp_dir = tempfile.TemporaryDirectory()
+    >>> skymap_index = SkymapIndex(lvk_initial.decode_skymap())
+    >>> _ = write_skymap(tmp_dir.name, "S230518h", "initial", skymap_index)
+    >>> stored_index = read_skymap(tmp_dir.name, "S230518h", "initial")
+    >>> ra, dec = np.array([0, 95.712890625]), np.array([0, -10.958863307027668])
+    >>> isinstance(stored_index.cumprob, np.memmap)
+    True
+    >>> stored_index.region_size(0.9), stored_index.nbytes
+    (9704, 946176)
+    >>> bool(np.all(stored_index.probdensity(ra, dec) == skymap_index.probdensity(ra, dec)))
+    True
+
+    >>> try:
+    ...     read_skymap(tmp_dir.name, "S230518h", "update_0")
+    ... except FileNotFoundError:
+    ...     print("not stored")
+    not stored
+    """
+    path = skymap_path(store_path, superevent_id, gcn_status)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            "skymap not found in the skymap store at the location {}".format(path)
+        )
+
+    arrays = {
+        name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+        for name in SKYMAP_ARRAYS
+    }
+    skymap = QTable(
+        {
+            "UNIQ": arrays["uniq"],
+            "PROBDENSITY": u.Quantity(arrays["probdensity"], u.sr**-1, copy=False),
+        },
+        copy=False,
+    )
+    return SkymapIndex(
+        skymap, arrays["sorter"], arrays["prob_order"], arrays["cumprob"]
+    )
+
+
+def read_skymap_bytes(store_path: str, superevent_id: str, gcn_status: str) -> bytes:
+    """
+    Return the original fits file of a stored skymap
+
+    Parameters
+    ----------
+    store_path : string
+        the root path of the skymap store
+    superevent_id : string
+        the superevent identifier of the gw event
+    gcn_status : string
+        used to distinguish gcn with the same triggerId (account the gcn update)
+
+    Returns
+    -------
+    bytes
+        the fits file of the skymap as sent in the notice
+
+    Example
+    -------
+    >>> tmp_dir = tempfile.TemporaryDirectory()
+    >>> from base64 import b64decode
+    >>> skymap_bytes = b64decode(lvk_initial.voevent["event"]["skymap"])
+    >>> skymap_index = SkymapIndex(lvk_initial.decode_skymap())
+    >>> _ = write_skymap(tmp_dir.name, "S230518h", "initial", skymap_index, skymap_bytes)
+    >>> read_skymap_bytes(tmp_dir.name, "S230518h", "initial") == skymap_bytes
+    True
+
+    >>> _ = write_skymap(tmp_dir.name, "S230518h", "update_0", skymap_index)
+    >>> try:
+    ...     read_skymap_bytes(tmp_dir.name, "S230518h", "update_0")
+    ... except FileNotFoundError:
+    ...     print("not stored")
+    not stored
+    """
+    path = os.path.join(skymap_path(store_path, superevent_id, gcn_status), SKYMAP_FITS)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            "skymap fits file not found in the skymap store at the location {}".format(
+                path
+            )
+        )
+    with open(path, "rb") as f:
+        return f.read()
@@ -0,0 +1,49 @@
+import glob
+import time
+import argparse
+
+from fink_mm.init import init_logging
+from fink_mm.gcn_stream.gcn_reader import fast_parse_xml_alert, full_parse_xml_alert
+
+
+def bench(parse, voevents, repeat):
+    """
+    Return the mean time in millisecond to parse one voevent
+    """
+    # warm up, the observatory classes are loaded at the first call
+    for gcn in voevents:
+        parse(gcn)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for gcn in voevents:
+            parse(gcn)
+    return (time.perf_counter() - start) / (repeat * len(voevents)) * 1e3
+
+
+if __name__ == "__main__":
+    # Compare the fast path of the gcn reader with the voeventparse path
+    # on the voevents of the test database.
+    # usage: python fink_mm/test/bench_voevent_reader.py --repeat 20
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--vodb", default="fink_mm/test/test_data/VODB", help="voevent directory"
+    )
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    logger = init_logging()
+    voevents = []
+    for path in sorted(glob.glob(args.vodb + "/*/*.xml")):
+        with open(path, "rb") as f:
+            voevents.append(f.read())
+
+    full_time = bench(
+        lambda gcn: full_parse_xml_alert(gcn, logger, False), voevents, args.repeat
+    )
+    fast_time = bench(fast_parse_xml_alert, voevents, args.repeat)
+
+    print("{} voevents, {} repeats".format(len(voevents), args.repeat))
+    print("voeventparse path: {:.3f} ms / voevent".format(full_time))
+    print("fast path: {:.3f} ms / voevent".format(fast_time))
+    print("speed-up: {:.1f}x".format(full_time / fast_time))
@@ -5,7 +5,7 @@ from enum import Flag, auto
 import fink_mm
 import fink_mm.ztf_join_gcn as online
 import fink_mm.distribution.distribution as distrib
-from fink_mm.utils.fun_utils import DataMode
+from fink_mm.utils.fun_utils import DataMode, JoinMode, OutputFormat
 from fink_mm.init import LoggerNewLine
 
 
@@ -30,10 +30,11 @@ class Application(Flag):
                     time_window, ast_dist, pansstar_dist, pansstar_star_score, gaia_dist
             * ONLINE:
                 ztf_datapath_prefix, gcn_datapath_prefix, grb_datapath_prefix, night,
-                    exit_after, tinterval, ast_dist, pansstar_dist, pansstar_star_score, gaia_dist
+                    exit_after, tinterval, ast_dist, pansstar_dist, pansstar_star_score, gaia_dist,
+                    join_mode, compact_join, output_format
             * DISTRIBUTION:
                 grbdata_path, night, tinterval, exit_after,
-                    kafka_broker, username_writer, password_writer
+                    kafka_broker, username_writer, password_writer, output_format
 
         Returns
         -------
@@ -74,6 +75,10 @@ class Application(Flag):
                 else:
                     application += " " + str(False)
 
+                application += " " + kwargs["join_mode"]
+                application += " " + kwargs["compact_join"]
+                application += " " + kwargs["output_format"]
+
             except Exception as e:
                 logger.error("Parameter not found \n\t {}\n\t{}".format(e, kwargs))
                 exit(1)
@@ -95,6 +100,7 @@ class Application(Flag):
                 application += " " + kwargs["kafka_broker"]
                 application += " " + kwargs["username_writer"]
                 application += " " + kwargs["password_writer"]
+                application += " " + kwargs["output_format"]
             except Exception as e:
                 logger.error("Parameter not found \n\t {}\n\t{}".format(e, kwargs))
                 exit(1)
@@ -121,6 +127,9 @@ class Application(Flag):
             logs = True if sys.argv[14] == "True" else False
             hdfs_adress = sys.argv[15]
             is_test = True if sys.argv[16] == "True" else False
+            join_mode = JoinMode(sys.argv[17])
+            compact_join = True if sys.argv[18] == "True" else False
+            output_format = OutputFormat(sys.argv[19])
 
             online.ztf_join_gcn(
                 data_mode,
@@ -139,6 +148,9 @@ class Application(Flag):
                 gaia_dist,
                 logs,
                 is_test,
+                join_mode,
+                compact_join,
+                output_format,
             )
 
         elif self == Application.DISTRIBUTION:
@@ -149,6 +161,7 @@ class Application(Flag):
             kafka_broker = sys.argv[6]
             username_writer = sys.argv[7]
             password_writer = sys.argv[8]
+            output_format = OutputFormat(sys.argv[9])
 
             distrib.grb_distribution(
                 grbdata_path,
@@ -158,4 +171,5 @@ class Application(Flag):
                 kafka_broker,
                 username_writer,
                 password_writer,
+                output_format,
             )
@@ -1,21 +1,36 @@
 import numpy as np
 import pandas as pd
+import healpy as hp
 import os
 import io
 from pyarrow import fs
 
 import pyspark.sql.functions as F
-from pyspark.sql import DataFrame
+from pyspark.sql import DataFrame, Column
+from pyspark.broadcast import Broadcast
 
 from pyspark.sql.functions import pandas_udf
-from pyspark.sql.types import DoubleType, ArrayType, IntegerType
+from pyspark.sql.types import DoubleType, ArrayType, IntegerType, LongType, StringType
 
 from fink_filters.classification import extract_fink_classification
-from fink_utils.spark.utils import concat_col
 
-from fink_mm.observatory import obsname_to_class, INSTR_FORMAT
+from fink_mm.observatory import (
+    obsname_to_class,
+    INSTR_FORMAT,
+    INSTR_FOOTPRINT,
+    INSTR_MAX_DELAY,
+)
+from fink_mm.observatory.skymap_cache import DEFAULT_CACHE_SIZE, SKYMAP_CACHE_SIZE_ENV
 from fink_mm.gcn_stream.gcn_reader import load_voevent_from_file, load_json_from_file
 from fink_mm.init import init_logging
+from fink_mm.utils.moc import (
+    MOC_MAX_ORDER,
+    discs_to_pixels,
+    discs_to_ranges,
+    degrade_ranges,
+    intersect_ranges,
+    area_to_order,
+)
 from enum import Enum
 
 # FIXME
@@ -32,6 +47,56 @@ class DataMode(Enum):
     OFFLINE = "offline"
 
 
+class JoinMode(Enum):
+    # explode the gcn footprint into the healpix pixels at NSIDE
+    HPIX = "hpix"
+    # keep the gcn footprint as nested pixel ranges and match the alerts with a range join
+    MOC = "moc"
+    # same as MOC but the footprint is degraded to an order chosen for each gcn
+    ADAPTIVE = "adaptive"
+
+
+# the join modes matching the alerts with the pixel ranges of the gcn footprints
+RANGE_JOIN_MODES = [JoinMode.MOC, JoinMode.ADAPTIVE]
+
+# logger of the observatory decoding, created once by spark python worker
+# and not at each row of the udf
+OBSERVATORY_LOGGER = init_logging()
+
+# footprint columns precomputed by the gcn stream and stored with the gcn,
+# see fink_mm.gcn_stream.gcn_footprint
+#   footprint_moc: the flattened ranges of get_moc_ranges
+#   footprint_adaptive: the flattened ranges of get_moc_ranges with adaptive=True
+#   footprint_area: the area of the error box or of the 90% skymap region (square degree)
+#   footprint_hpix_<NSIDE>: the pixels of get_pixels at the given NSIDE
+FOOTPRINT_MOC = "footprint_moc"
+FOOTPRINT_ADAPTIVE = "footprint_adaptive"
+FOOTPRINT_AREA = "footprint_area"
+
+# smallest error radius (arcminute) sent by an observatory, see has_plausible_error
+#   integral: the IBAS error boxes are a few arcminutes, the older gcn stored the error in degree
+MIN_ERR_ARCMIN = {"integral": 0.5}
+
+
+def footprint_hpix_column(NSIDE: int) -> str:
+    """
+    Return the name of the precomputed footprint column containing the pixels at NSIDE
+
+    Example
+    -------
+    >>> footprint_hpix_column(4)
+    'footprint_hpix_4'
+    """
+    return "footprint_hpix_{}".format(NSIDE)
+
+
+class OutputFormat(Enum):
+    # one table, each matched alert contains all the gcn columns
+    WIDE = "wide"
+    # a matches table and a gcn events table with each gcn event once
+    NORMALISED = "normalised"
+
+
 def get_hdfs_connector(host: str, port: int, user: str):
     """
     Initialise a connector to HDFS.
@@ -292,25 +357,219 @@ def get_observatory(obsname: str, rawEvent: str):  # -> Observatory
     >>> type(get_observatory(pdf["observatory"].iloc[0], pdf["raw_event"].iloc[0]))
     <class 'LVK.LVK'>
     """
-    logger = init_logging()
     format_instr = INSTR_FORMAT[obsname.lower()]
     if format_instr == "json":
-        json = load_json_from_file(rawEvent, logger)
+        json = load_json_from_file(rawEvent, OBSERVATORY_LOGGER)
         return obsname_to_class(obsname, json)
     elif format_instr == "xml":
-        voevent = load_voevent_from_file(io.StringIO(rawEvent), logger)
+        # the raw event can be the original voevent with its encoding declaration
+        voevent = load_voevent_from_file(
+            io.BytesIO(rawEvent.encode("UTF-8")), OBSERVATORY_LOGGER
+        )
         return obsname_to_class(obsname, voevent)
 
 
+def is_circular_footprint(obsname: pd.Series) -> np.ndarray:
+    """
+    Return True for the gcn whose footprint is a circle given by the ra, dec and err_arcmin columns,
+    False for the gcn whose footprint is in the raw event (skymap).
+
+    Parameters
+    ----------
+    obsname: pd.Series containing string
+        the observatory name contains in the dataframe
+
+    Return
+    ------
+    numpy array
+        boolean array, True if the footprint of the gcn is circular
+
+    Example
+    -------
+    >>> is_circular_footprint(pd.Series(["Fermi", "LVK", "IceCube"]))
+    array([ True, False,  True], dtype=bool)
+    """
+    return (obsname.str.lower().map(INSTR_FOOTPRINT) == "circle").values
+
+
+def has_plausible_error(obsname: pd.Series, err_arcmin: pd.Series) -> np.ndarray:
+    """
+    Return True for the gcn whose stored err_arcmin can be used as the error radius of a circular footprint.
+    The gcn written by older versions can store an error in degree (the INTEGRAL gcn),
+    an error radius smaller than the smallest error of its observatory (see MIN_ERR_ARCMIN)
+    is implausible and the footprint of the gcn is computed from its raw event.
+
+    Parameters
+    ----------
+    obsname: pd.Series containing string
+        the observatory name contains in the dataframe
+    err_arcmin: pd.Series containing float
+        the stored error radius of the gcn (in arcminute)
+
+    Return
+    ------
+    numpy array
+        boolean array, True if the stored error radius is plausible
+
+    Example
+    -------
+    >>> has_plausible_error(
+    ...     pd.Series(["Fermi", "INTEGRAL", "INTEGRAL", "Swift", "Fermi"]),
+    ...     pd.Series([266.4, 0.0531, 3.186, 0.05, np.nan]),
+    ... ).tolist()
+    [True, False, True, True, False]
+    """
+    min_err = obsname.str.lower().map(MIN_ERR_ARCMIN).fillna(0).values
+    err = err_arcmin.values.astype(np.float64)
+    return np.isfinite(err) & (err > 0) & (err >= min_err)
+
+
+def max_jdstarthist(obsname: Column, trigger_time_jd: Column) -> Column:
+    """
+    Return the latest first detection date (jdstarthist) of the ztf alerts joined with a gcn,
+    the trigger time plus the maximum delay of the observatory, see INSTR_MAX_DELAY.
+    Infinite for the observatories without maximum delay.
+
+    Parameters
+    ----------
+    obsname: Column
+        the observatory name of the gcn
+    trigger_time_jd: Column
+        the trigger time of the gcn in julian date
+
+    Return
+    ------
+    Column
+        the latest jdstarthist in julian date
+
+    Example
+    -------
+    >>> df = spark.createDataFrame(
+    ...     [("Fermi", 2460324.5), ("LVK", 2460324.5), ("unknown", 2460324.5)], ["observatory", "triggerTimejd"]
+    ... )
+    >>> [r[0] for r in df.select(max_jdstarthist(df.observatory, df.triggerTimejd)).collect()]
+    [2460326.5, 2460329.5, inf]
+    """
+    max_delay_days = F.create_map(
+        *[
+            F.lit(v)
+            for obs_name, max_delay in INSTR_MAX_DELAY.items()
+            if max_delay is not None
+            for v in (obs_name, max_delay / 24)
+        ]
+    )[F.lower(obsname)]
+    return F.coalesce(trigger_time_jd + max_delay_days, F.lit(float("inf")))
+
+
+def circle_association_condition(
+    obsname: Column,
+    ztf_ra: Column,
+    ztf_dec: Column,
+    gcn_ra: Column,
+    gcn_dec: Column,
+    err_arcmin: Column,
+) -> Column:
+    """
+    Return False for the pairs of ztf alerts and gcn with a circular footprint that cannot be associated,
+    the alerts further than 1.5 times the error radius from the gcn position (the spatial test
+    of the association probability). The angular distance is computed with the haversine formula
+    as a spark expression, so the pairs are dropped before the association probability udf.
+    The condition is True for the gcn with a skymap and for the gcn without a plausible error radius
+    (see has_plausible_error), the association probability then decodes the raw event.
+
+    Parameters
+    ----------
+    obsname: Column
+        the observatory name of the gcn
+    ztf_ra: Column
+        right ascension of the ztf alert (in degree)
+    ztf_dec: Column
+        declination of the ztf alert (in degree)
+    gcn_ra: Column
+        right ascension of the gcn (in degree)
+    gcn_dec: Column
+        declination of the gcn (in degree)
+    err_arcmin: Column
+        error radius of the gcn (in arcminute)
+
+    Return
+    ------
+    Column
+        boolean column, False if the alert is not associated with the gcn
+
+    Example
+    -------
+    >>> df = spark.createDataFrame(
+    ...     [
+    ...         ("Fermi", 10.0, 20.0, 10.0, 21.0, 60.0),
+    ...         ("Fermi", 10.0, 20.0, 10.0, 22.0, 60.0),
+    ...         ("Swift", 359.99, 0.0, 0.01, 0.0, 1.0),
+    ...         ("LVK", 10.0, 20.0, 100.0, -20.0, None),
+    ...         ("Fermi", 10.0, 20.0, 100.0, -20.0, None),
+    ...         ("INTEGRAL", 10.0, 20.0, 10.0, 20.1, 0.05),
+    ...     ],
+    ...     ["observatory", "ztf_ra", "ztf_dec", "gcn_ra", "gcn_dec", "err_arcmin"],
+    ... )
+    >>> [r[0] for r in df.select(circle_association_condition(*[df[c] for c in df.columns])).collect()]
+    [True, False, True, True, True, True]
+    """
+    is_circle = F.lower(obsname).isin(
+        [
+            obs_name
+            for obs_name, footprint in INSTR_FOOTPRINT.items()
+            if footprint == "circle"
+        ]
+    )
+
+    # haversine formula, the argument of asin is bounded for the rounding errors
+    ztf_dec_rad, gcn_dec_rad = F.radians(ztf_dec), F.radians(gcn_dec)
+    hav = F.pow(F.sin((gcn_dec_rad - ztf_dec_rad) / 2), 2) + F.cos(ztf_dec_rad) * F.cos(
+        gcn_dec_rad
+    ) * F.pow(F.sin(F.radians(gcn_ra - ztf_ra) / 2), 2)
+    separation_arcmin = F.degrees(2 * F.asin(F.least(F.sqrt(hav), F.lit(1.0)))) * 60
+
+    min_err_arcmin = F.coalesce(
+        F.create_map(*[F.lit(v) for item in MIN_ERR_ARCMIN.items() for v in item])[
+            F.lower(obsname)
+        ],
+        F.lit(0.0),
+    )
+
+    # the skymaps and the implausible error radius are tested by the association probability
+    no_circle = ~is_circle | err_arcmin.isNull()
+    implausible_error = (err_arcmin <= 0) | (err_arcmin < min_err_arcmin)
+
+    # small margin to let the association probability do the exact test at the limit
+    in_circle = separation_arcmin <= 1.5 * err_arcmin * (1 + 1e-6)
+    return no_circle | implausible_error | in_circle
+
+
 @pandas_udf(ArrayType(IntegerType()))
-def get_pixels(obsname: pd.Series, rawEvent: pd.Series, NSIDE: pd.Series) -> pd.Series:
+def get_pixels(
+    obsname: pd.Series,
+    ra: pd.Series,
+    dec: pd.Series,
+    err_arcmin: pd.Series,
+    rawEvent: pd.Series,
+    NSIDE: pd.Series,
+) -> pd.Series:
     """
-    Compute the pixels within the error box for each observatory
+    Compute the pixels within the error box for each observatory.
+    The circular footprints are computed from the ra, dec and err_arcmin columns for the whole batch,
+    the raw event is only decoded for the observatories with a skymap
+    and for the gcn without a plausible err_arcmin (see has_plausible_error).
+    The rows with a null observatory name are skipped and get a null footprint.
 
     Parameters
     ----------
     obsname: pd.Series containing string
         the observatory name contains in the dataframe
+    ra: pd.Series containing float
+        right ascension of the gcn (in degree)
+    dec: pd.Series containing float
+        declination of the gcn (in degree)
+    err_arcmin: pd.Series containing float
+        error box of the gcn (in arcminute)
     rawEvent: pd.Series containing string
         the raw voevents
     NSIDE: pd.Series containing integer
@@ -326,18 +585,216 @@ def get_pixels(obsname: pd.Series, rawEvent: pd.Series, NSIDE: pd.Series) -> pd.
     >>> spark_grb = spark.read.format('parquet').load(grb_data)
     >>> NSIDE = 4
 
-    >>> grb_pixs = spark_grb.withColumn("hpix_circle", get_pixels(spark_grb.observatory, spark_grb.raw_event, F.lit(8)))
+    >>> grb_pixs = spark_grb.withColumn("hpix_circle", get_pixels(
+    ...     spark_grb.observatory, spark_grb.ra, spark_grb.dec, spark_grb.err_arcmin, spark_grb.raw_event, F.lit(8)
+    ... ))
 
     >>> grb_pixs.withColumn("hpix", explode("hpix_circle"))\
           .orderBy(["triggerId", "hpix"])\
                .select(["triggerId", "hpix"]).head(5)
     [Row(triggerId='10472', hpix=609), Row(triggerId='727009399', hpix=177), Row(triggerId='727009399', hpix=177), Row(triggerId='727009399', hpix=177), Row(triggerId='727009399', hpix=178)]
+
+    >>> spark_gw = spark.read.format('parquet').load(gw_data)
+    >>> gw_pixs = spark_gw.withColumn("hpix_circle", get_pixels(
+    ...     spark_gw.observatory, spark_gw.ra, spark_gw.dec, spark_gw.err_arcmin, spark_gw.raw_event, F.lit(8)
+    ... ))
+    >>> gw_pixs.select(F.size("hpix_circle")).collect()
+    [Row(size(hpix_circle)=37)]
+    """
+    is_circle = is_circular_footprint(obsname) & has_plausible_error(
+        obsname, err_arcmin
+    )
+    pixels = [None] * len(obsname)
+
+    circle_rows = np.flatnonzero(is_circle)
+    circle_pixels = discs_to_pixels(
+        ra.values[circle_rows],
+        dec.values[circle_rows],
+        err_arcmin.values[circle_rows] / 60,
+        NSIDE.values[circle_rows],
+    )
+    for i, ipix in zip(circle_rows, circle_pixels):
+        pixels[i] = ipix
+
+    for i in np.flatnonzero(~is_circle & obsname.notna().values):
+        pixels[i] = get_observatory(obsname.iloc[i], rawEvent.iloc[i]).get_pixels(
+            NSIDE.iloc[i]
+        )
+
+    return pd.Series(pixels)
+
+
+@pandas_udf(ArrayType(LongType()))
+def get_moc_ranges(
+    obsname: pd.Series,
+    ra: pd.Series,
+    dec: pd.Series,
+    err_arcmin: pd.Series,
+    rawEvent: pd.Series,
+    adaptive: pd.Series,
+    min_order: pd.Series,
+) -> pd.Series:
+    """
+    Compute the footprint of each gcn as nested pixel ranges at the order MOC_MAX_ORDER.
+    The circular footprints are computed from the ra, dec and err_arcmin columns for the whole batch,
+    the raw event is only decoded for the observatories with a skymap
+    and for the gcn without a plausible err_arcmin (see has_plausible_error).
+    The rows with a null observatory name are skipped and get a null footprint.
+
+    Parameters
+    ----------
+    obsname: pd.Series containing string
+        the observatory name contains in the dataframe
+    ra: pd.Series containing float
+        right ascension of the gcn (in degree)
+    dec: pd.Series containing float
+        declination of the gcn (in degree)
+    err_arcmin: pd.Series containing float
+        error box of the gcn (in arcminute)
+    rawEvent: pd.Series containing string
+        the raw voevents
+    adaptive: pd.Series containing boolean
+        if True, the footprint is degraded to the join order of each gcn (see Observatory.get_join_order)
+    min_order: pd.Series containing integer
+        the coarsest order of the adaptive footprints, the join order of a gcn is raised to min_order if lower
+
+    Return
+    ------
+    moc : pd.Series containing long list
+        each sublist contains the flattened ranges of the footprint: [start_0, end_0, start_1, end_1, ...]
+
+    Examples
+    --------
+    >>> spark_grb = spark.read.format('parquet').load(grb_data)
+    >>> grb_moc = spark_grb.withColumn("hpix_moc", get_moc_ranges(
+    ...     spark_grb.observatory, spark_grb.ra, spark_grb.dec, spark_grb.err_arcmin, spark_grb.raw_event, F.lit(False), F.lit(0)
+    ... ))
+
+    >>> grb_moc.select("triggerId", F.size("hpix_moc").alias("moc_size")).orderBy(["triggerId", "moc_size"]).head(3)
+    [Row(triggerId='10472', moc_size=38), Row(triggerId='727009399', moc_size=28), Row(triggerId='727009399', moc_size=34)]
+
+    >>> grb_moc = spark_grb.withColumn("hpix_moc", get_moc_ranges(
+    ...     spark_grb.observatory, spark_grb.ra, spark_grb.dec, spark_grb.err_arcmin, spark_grb.raw_event, F.lit(True), F.lit(0)
+    ... ))
+
+    >>> grb_moc.select("triggerId", F.size("hpix_moc").alias("moc_size")).orderBy(["triggerId", "moc_size"]).head(3)
+    [Row(triggerId='10472', moc_size=12), Row(triggerId='727009399', moc_size=10), Row(triggerId='727009399', moc_size=12)]
+    """
+    is_circle = is_circular_footprint(obsname) & has_plausible_error(
+        obsname, err_arcmin
+    )
+    moc = [None] * len(obsname)
+
+    # the circular footprints cover the association radius (1.5 times the error box)
+    circle_rows = np.flatnonzero(is_circle)
+    circle_radius = 1.5 * err_arcmin.values[circle_rows] / 60
+    circle_ranges = discs_to_ranges(
+        ra.values[circle_rows], dec.values[circle_rows], circle_radius
+    )
+    for i, ranges, radius in zip(circle_rows, circle_ranges, circle_radius):
+        if adaptive.iloc[i]:
+            ranges = degrade_ranges(
+                ranges, max(area_to_order(np.pi * radius**2), min_order.iloc[i])
+            )
+        moc[i] = ranges.ravel().tolist()
+
+    for i in np.flatnonzero(~is_circle & obsname.notna().values):
+        observatory = get_observatory(obsname.iloc[i], rawEvent.iloc[i])
+        ranges = (
+            observatory.get_adaptive_ranges(min_order.iloc[i])
+            if adaptive.iloc[i]
+            else observatory.get_moc_ranges()
+        )
+        moc[i] = ranges.ravel().tolist()
+
+    return pd.Series(moc)
+
+
+@pandas_udf(ArrayType(LongType()))
+def bound_adaptive_ranges(
+    adaptive: pd.Series, moc: pd.Series, min_order: pd.Series
+) -> pd.Series:
+    """
+    Raise the order of the adaptive footprints precomputed by the gcn stream to min_order,
+    the same as get_moc_ranges with the min_order argument.
+    The ranges of an adaptive footprint coarser than min_order are restricted
+    to the pixels at min_order overlapping the footprint.
+    The rows with a null footprint get a null footprint.
+
+    Parameters
+    ----------
+    adaptive: pd.Series containing long list
+        the flattened adaptive ranges, see FOOTPRINT_ADAPTIVE
+    moc: pd.Series containing long list
+        the flattened ranges at the order MOC_MAX_ORDER, see FOOTPRINT_MOC
+    min_order: pd.Series containing integer
+        the coarsest order of the returned ranges
+
+    Return
+    ------
+    ranges : pd.Series containing long list
+        the flattened adaptive ranges with an order at least min_order
+
+    Examples
+    --------
+    >>> from fink_mm.gcn_stream.gcn_footprint import add_footprint_columns
+    >>> pdf = add_footprint_columns(pd.read_parquet(grb_data), [4])
+    >>> pdf = pdf.drop(columns="footprint_hpix_4").assign(
+    ...     footprint_adaptive=pdf[FOOTPRINT_ADAPTIVE].map(np.ndarray.tolist),
+    ...     footprint_moc=pdf[FOOTPRINT_MOC].map(np.ndarray.tolist),
+    ... )
+    >>> spark_grb = spark.createDataFrame(pdf)
+    >>> spark_grb = spark_grb.withColumn(
+    ...     "bounded", bound_adaptive_ranges(FOOTPRINT_ADAPTIVE, FOOTPRINT_MOC, F.lit(4))
+    ... ).withColumn("computed", get_moc_ranges(
+    ...     spark_grb.observatory, spark_grb.ra, spark_grb.dec, spark_grb.err_arcmin, spark_grb.raw_event, F.lit(True), F.lit(4)
+    ... ))
+
+    >>> spark_grb.filter(F.col("bounded") != F.col("computed")).count()
+    0
+    >>> spark_grb.filter(F.size("bounded") < F.size(FOOTPRINT_ADAPTIVE)).count()
+    0
+    """
+    ranges = [None] * len(adaptive)
+    for i in np.flatnonzero(adaptive.notna().values & moc.notna().values):
+        adaptive_ranges = np.asarray(adaptive.iloc[i], dtype=np.int64).reshape(-1, 2)
+        moc_ranges = np.asarray(moc.iloc[i], dtype=np.int64).reshape(-1, 2)
+        # the ranges at an order finer than min_order are within the degraded moc
+        ranges[i] = (
+            intersect_ranges(
+                adaptive_ranges, degrade_ranges(moc_ranges, min_order.iloc[i])
+            )
+            .ravel()
+            .tolist()
+        )
+    return pd.Series(ranges)
+
+
+@pandas_udf(LongType())
+def ang2nest(ra: pd.Series, dec: pd.Series) -> pd.Series:
+    """
+    Compute the nested healpix pixel at the order MOC_MAX_ORDER of sky positions
+
+    Parameters
+    ----------
+    ra: pd.Series containing float
+        right ascension (in degree)
+    dec: pd.Series containing float
+        declination (in degree)
+
+    Return
+    ------
+    ipix : pd.Series containing long
+        the nested pixel number at the order MOC_MAX_ORDER
+
+    Examples
+    --------
+    >>> df = spark.createDataFrame([(132.3328, -42.7168), (0.0, 0.0)], ["ra", "dec"])
+    >>> df.select(ang2nest("ra", "dec").alias("ipix")).collect()
+    [Row(ipix=2762070391150395800), Row(ipix=1369094286720630784)]
     """
     return pd.Series(
-        [
-            get_observatory(obs, event).get_pixels(nside)
-            for obs, event, nside in zip(obsname, rawEvent, NSIDE)
-        ]
+        hp.ang2pix(2**MOC_MAX_ORDER, ra.values, dec.values, nest=True, lonlat=True)
     )
 
 
@@ -445,6 +902,393 @@ def get_association_proba(
     )
 
 
+def sub_association_proba_per_event(
+    obsname: pd.Series,
+    triggerId: pd.Series,
+    gcn_status: pd.Series,
+    rawEvent: pd.Series,
+    ztf_ra: pd.Series,
+    ztf_dec: pd.Series,
+    jdstarthist: pd.Series,
+    hdfs_adress: str,
+    root_path: str,
+) -> np.ndarray:
+    """
+    Compute the association probability between the ztf alerts and the gcn events
+    by grouping the rows by gcn event (observatory, triggerId, gcn_status).
+
+    The observatory class is built only once for each gcn event contained in the batch,
+    the raw event is thus parsed once per event instead of once per matched alert
+    and the association probability is computed on the whole group with numpy arrays.
+
+    Parameters
+    ----------
+    obsname: pd.Series containing string
+        the observatory name contains in the dataframe
+    triggerId: pd.Series containing string
+        the gcn trigger identifier
+    gcn_status: pd.Series containing string
+        used to distinguish gcn with the same triggerId (account the gcn update)
+    rawEvent: pd.Series containing string
+        the raw voevents
+    ztf_ra : pd.Series containing double
+        right ascension coordinates of the ztf alerts
+    ztf_dec : pd.Series containing double
+        declination coordinates of the ztf alerts
+    jdstarthist : pd.Series containing double
+        Earliest Julian date of epoch corresponding to ndethist [days]
+    hdfs_adress : string
+        HDFS adress used to instanciate the hdfs client, used to search the gw skymap from the gcn stored in hdfs
+    root_path : string
+        the path where are located the gcn in hdfs.
+
+    Return
+    ------
+    association_proba: numpy array
+        association probability for each rows,
+        0 <= proba <= 1 where closer to 0 implies higher likelihood of being associated with the events
+
+    Examples
+    --------
+    >>> pdf = pd.read_parquet(gw_data)
+    >>> sub_association_proba_per_event(
+    ...     pd.Series(["LVK", "LVK"]),
+    ...     pd.Series(["S230518h", "S230518h"]),
+    ...     pd.Series(["initial", "initial"]),
+    ...     pd.Series([pdf["raw_event"].iloc[0], pdf["raw_event"].iloc[0]]),
+    ...     pd.Series([0.0, 95.712890625]),
+    ...     pd.Series([0.0, -10.958863307027668]),
+    ...     pd.Series([0.0, 0.0]),
+    ...     "",
+    ...     ""
+    ... )
+    array([  4.35454875e-13,   5.40086203e-03])
+
+    >>> pdf = pd.read_parquet(grb_data)
+    >>> pdf = pdf[pdf["triggerId"] == "727009399"]
+    >>> sub_association_proba_per_event(
+    ...     pdf["observatory"], pdf["triggerId"], pdf["gcn_status"], pdf["raw_event"],
+    ...     pdf["ra"], pdf["dec"], pdf["triggerTimejd"], "", ""
+    ... )
+    array([-1., -1., -1.])
+    """
+    event_key = pd.DataFrame(
+        {
+            "observatory": obsname.values,
+            "triggerId": triggerId.values,
+            "gcn_status": gcn_status.values,
+        }
+    )
+    p_assoc = np.full(len(event_key), -1.0)
+
+    # the triggerId are only unique within an observatory
+    event_groups = event_key.groupby(
+        ["observatory", "triggerId", "gcn_status"], sort=False
+    ).indices
+    for idx in event_groups.values():
+        first_row = idx[0]
+        observatory = get_observatory(obsname.iloc[first_row], rawEvent.iloc[first_row])
+        p_assoc[idx] = observatory.association_proba_batch(
+            ztf_ra.values[idx],
+            ztf_dec.values[idx],
+            jdstarthist.values[idx],
+            hdfs_adress=hdfs_adress,
+            gcn_status=gcn_status.iloc[first_row],
+            root_path=root_path,
+        )
+
+    return p_assoc
+
+
+@pandas_udf(DoubleType())
+def get_association_proba_per_event(
+    obsname: pd.Series,
+    triggerId: pd.Series,
+    gcn_status: pd.Series,
+    rawEvent: pd.Series,
+    ztf_ra: pd.Series,
+    ztf_dec: pd.Series,
+    jdstarthist: pd.Series,
+    hdfs_adress: pd.Series,
+    root_path: pd.Series,
+) -> pd.Series:
+    """
+    Compute the association probability between the ztf alerts and the gcn events,
+    grouped execution mode of get_association_proba.
+
+    The rows of each Arrow batch are grouped by (observatory, triggerId, gcn_status),
+    see sub_association_proba_per_event function documentation.
+
+    Examples
+    --------
+    >>> sparkDF = spark.read.format('parquet').load(join_data)
+
+    >>> df_proba = sparkDF.withColumn(
+    ...     "p_assoc",
+    ...     get_association_proba_per_event(
+    ...         sparkDF["observatory"],
+    ...         sparkDF["triggerId"],
+    ...         sql_func.lit(""),
+    ...         sparkDF["raw_event"],
+    ...         sparkDF["ra"],
+    ...         sparkDF["dec"],
+    ...         sparkDF["candidate.jdstarthist"],
+    ...         sql_func.lit(""),
+    ...         sql_func.lit("")
+    ...     ),
+    ... )
+
+    >>> df_proba.select(["objectId", "triggerId", "p_assoc"]).show()
+    +------------+---------+-------+
+    |    objectId|triggerId|p_assoc|
+    +------------+---------+-------+
+    |ZTF19abvxqrw|683482851|   -1.0|
+    |ZTF19aarcrtb|683482851|   -1.0|
+    |ZTF18abrhuke|683482851|   -1.0|
+    |ZTF19aarcsqv|683482851|   -1.0|
+    |ZTF18abrfzni|683482851|   -1.0|
+    |ZTF18abthehu|683482851|   -1.0|
+    |ZTF18abrhqed|683482851|   -1.0|
+    |ZTF18abcjaer|683482851|   -1.0|
+    |ZTF19aarcsra|683482851|   -1.0|
+    |ZTF18abdlhrp|683482851|   -1.0|
+    |ZTF18abrgwwe|683482851|   -1.0|
+    |ZTF19abvxscp|683482851|   -1.0|
+    |ZTF18abthswi|683482851|   -1.0|
+    |ZTF19abvxvpj|683482851|   -1.0|
+    |ZTF19abvxscg|683482851|   -1.0|
+    |ZTF19abrvetd|683482851|   -1.0|
+    |ZTF19abvxwnh|683482851|   -1.0|
+    |ZTF19abvxwnw|683482851|   -1.0|
+    |ZTF19abvxwyv|683482851|   -1.0|
+    |ZTF19abagehm|683482851|   -1.0|
+    +------------+---------+-------+
+    only showing top 20 rows
+    <BLANKLINE>
+    """
+    return pd.Series(
+        sub_association_proba_per_event(
+            obsname,
+            triggerId,
+            gcn_status,
+            rawEvent,
+            ztf_ra,
+            ztf_dec,
+            jdstarthist,
+            hdfs_adress.values[0],
+            root_path.values[0],
+        )
+    )
+
+
+def sub_association_proba_by_key(
+    obsname: pd.Series,
+    triggerId: pd.Series,
+    gcn_status: pd.Series,
+    ztf_ra: pd.Series,
+    ztf_dec: pd.Series,
+    jdstarthist: pd.Series,
+    gcn_events,  # GcnEventBatch
+    hdfs_adress: str,
+    root_path: str,
+) -> np.ndarray:
+    """
+    Compute the association probability between the ztf alerts and the gcn events
+    from the gcn key only, the raw events are taken from the gcn events of the join batch.
+    The rows are grouped by gcn event as in sub_association_proba_per_event.
+
+    Parameters
+    ----------
+    obsname: pd.Series containing string
+        the observatory name of the gcn
+    triggerId: pd.Series containing string
+        the gcn trigger identifier
+    gcn_status: pd.Series containing string
+        used to distinguish gcn with the same triggerId (account the gcn update)
+    ztf_ra : pd.Series containing double
+        right ascension coordinates of the ztf alerts
+    ztf_dec : pd.Series containing double
+        declination coordinates of the ztf alerts
+    jdstarthist : pd.Series containing double
+        Earliest Julian date of epoch corresponding to ndethist [days]
+    gcn_events : GcnEventBatch
+        the raw gcn events of the join batch, see fink_mm.utils.gcn_events
+    hdfs_adress : string
+        HDFS adress used to instanciate the hdfs client, used to search the gw skymap from the gcn stored in hdfs
+    root_path : string
+        the path where are located the gcn in hdfs.
+
+    Return
+    ------
+    association_proba: numpy array
+        association probability for each rows, -1 if the gcn is not in the batch
+
+    Examples
+    --------
+    >>> from fink_mm.utils.gcn_events import GcnEventBatch
+    >>> pdf = pd.read_parquet(gw_data)
+    >>> gcn_events = GcnEventBatch(
+    ...     {("LVK", "S230518h", "initial"): (pdf["observatory"].iloc[0], pdf["raw_event"].iloc[0])}
+    ... )
+    >>> sub_association_proba_by_key(
+    ...     pd.Series(["LVK", "LVK", "LVK"]),
+    ...     pd.Series(["S230518h", "S230518h", "S230518h"]),
+    ...     pd.Series(["initial", "initial", "update_0"]),
+    ...     pd.Series([0.0, 95.712890625, 95.712890625]),
+    ...     pd.Series([0.0, -10.958863307027668, -10.958863307027668]),
+    ...     pd.Series([0.0, 0.0, 0.0]),
+    ...     gcn_events,
+    ...     "",
+    ...     ""
+    ... )
+    array([  4.35454875e-13,   5.40086203e-03,  -1.00000000e+00])
+    """
+    event_key = pd.DataFrame(
+        {
+            "observatory": obsname.values,
+            "triggerId": triggerId.values,
+            "gcn_status": gcn_status.values,
+        }
+    )
+    p_assoc = np.full(len(event_key), -1.0)
+
+    event_groups = event_key.groupby(
+        ["observatory", "triggerId", "gcn_status"], sort=False
+    ).indices
+    for key, idx in event_groups.items():
+        observatory = gcn_events.get_observatory(key)
+        if observatory is None:
+            continue
+        p_assoc[idx] = observatory.association_proba_batch(
+            ztf_ra.values[idx],
+            ztf_dec.values[idx],
+            jdstarthist.values[idx],
+            hdfs_adress=hdfs_adress,
+            gcn_status=key[2],
+            root_path=root_path,
+        )
+
+    return p_assoc
+
+
+def get_association_proba_by_key(gcn_events: Broadcast):
+    """
+    Return the udf computing the association probability from the gcn key,
+    see sub_association_proba_by_key function documentation.
+
+    Parameters
+    ----------
+    gcn_events: Broadcast
+        the broadcasted GcnEventBatch of the join batch
+
+    Returns
+    -------
+    pandas_udf
+        the udf, the arguments are observatory, triggerId, gcn_status, ztf_ra, ztf_dec, jdstarthist, hdfs_adress, root_path
+
+    Examples
+    --------
+    >>> from fink_mm.utils.gcn_events import collect_gcn_events
+    >>> gcn_df = spark.read.format('parquet').load(gcn_datatest)
+    >>> gcn_events = spark.sparkContext.broadcast(collect_gcn_events(gcn_df))
+    >>> df_proba = gcn_df.withColumn(
+    ...     "p_assoc",
+    ...     get_association_proba_by_key(gcn_events)(
+    ...         gcn_df["observatory"],
+    ...         gcn_df["triggerId"],
+    ...         gcn_df["gcn_status"],
+    ...         gcn_df["ra"],
+    ...         gcn_df["dec"],
+    ...         gcn_df["triggerTimejd"] + 1,
+    ...         sql_func.lit(""),
+    ...         sql_func.lit("")
+    ...     ),
+    ... )
+    >>> df_proba.filter(df_proba.triggerId == "727029942").select(
+    ...     ["triggerId", "gcn_status", "p_assoc"]
+    ... ).orderBy("gcn_status").show()
+    +---------+----------+------------------+
+    |triggerId|gcn_status|           p_assoc|
+    +---------+----------+------------------+
+    |727029942|   initial|0.9999716345297799|
+    |727029942|  update_0|0.9991140579827796|
+    |727029942|  update_1|0.9998176497832274|
+    |727029942|  update_2|0.9999474038180075|
+    +---------+----------+------------------+
+    <BLANKLINE>
+    >>> gcn_events.unpersist()
+    """
+
+    @pandas_udf(DoubleType())
+    def association_proba_by_key(
+        obsname: pd.Series,
+        triggerId: pd.Series,
+        gcn_status: pd.Series,
+        ztf_ra: pd.Series,
+        ztf_dec: pd.Series,
+        jdstarthist: pd.Series,
+        hdfs_adress: pd.Series,
+        root_path: pd.Series,
+    ) -> pd.Series:
+        return pd.Series(
+            sub_association_proba_by_key(
+                obsname,
+                triggerId,
+                gcn_status,
+                ztf_ra,
+                ztf_dec,
+                jdstarthist,
+                gcn_events.value,
+                hdfs_adress.values[0],
+                root_path.values[0],
+            )
+        )
+
+    return association_proba_by_key
+
+
+def get_raw_event_by_key(gcn_events: Broadcast):
+    """
+    Return the udf taking the raw event of the gcn from the gcn key.
+
+    Parameters
+    ----------
+    gcn_events: Broadcast
+        the broadcasted GcnEventBatch of the join batch
+
+    Returns
+    -------
+    pandas_udf
+        the udf, the arguments are observatory, triggerId, gcn_status
+
+    Examples
+    --------
+    >>> from fink_mm.utils.gcn_events import collect_gcn_events
+    >>> gcn_df = spark.read.format('parquet').load(gcn_datatest)
+    >>> gcn_events = spark.sparkContext.broadcast(collect_gcn_events(gcn_df))
+    >>> df_raw = gcn_df.withColumn(
+    ...     "raw_event_by_key",
+    ...     get_raw_event_by_key(gcn_events)(
+    ...         gcn_df["observatory"], gcn_df["triggerId"], gcn_df["gcn_status"]
+    ...     ),
+    ... )
+    >>> df_raw.filter(df_raw.raw_event == df_raw.raw_event_by_key).count()
+    62
+    >>> gcn_events.unpersist()
+    """
+
+    @pandas_udf(StringType())
+    def raw_event_by_key(
+        obsname: pd.Series, triggerId: pd.Series, gcn_status: pd.Series
+    ) -> pd.Series:
+        events = gcn_events.value
+        return pd.Series(
+            [events.get_raw_event(key) for key in zip(obsname, triggerId, gcn_status)]
+        )
+
+    return raw_event_by_key
+
+
 @pandas_udf(ArrayType(DoubleType()))
 def compute_rate(
     magpsf, jdstarthist, jd, fid, hist_magpf, hist_difmaglim, hist_jd, hist_fid
@@ -458,6 +1302,7 @@ def compute_rate(
     ... data_fid_1
     ... )
 
+    >>> from fink_utils.spark.utils import concat_col
     >>> df_spark = concat_col(df_spark, "magpsf")
     >>> df_spark = concat_col(df_spark, "diffmaglim")
     >>> df_spark = concat_col(df_spark, "jd")
@@ -607,6 +1452,7 @@ def format_rate_results(spark_df, rate_column):
     ... data_fid_1
     ... )
 
+    >>> from fink_utils.spark.utils import concat_col
     >>> df_spark = concat_col(df_spark, "magpsf")
     >>> df_spark = concat_col(df_spark, "diffmaglim")
     >>> df_spark = concat_col(df_spark, "jd")
@@ -731,7 +1577,12 @@ def format_rate_results(spark_df, rate_column):
     )
 
 
-def join_post_process(df_grb: DataFrame, hdfs_adress: str, root_path: str) -> DataFrame:
+def join_post_process(
+    df_grb: DataFrame,
+    hdfs_adress: str,
+    root_path: str,
+    gcn_events: Broadcast = None,
+) -> DataFrame:
     """
     Post processing after the join, used by offline and online
 
@@ -743,6 +1594,9 @@ def join_post_process(df_grb: DataFrame, hdfs_adress: str, root_path: str) -> Da
         used to instantiate the hdfs client
     root_path: str
         the path where are located the gcn in hdfs.
+    gcn_events: Broadcast
+        the broadcasted GcnEventBatch of the join batch, if given df_grb does not contains the raw_event
+        and the association probability is computed from the gcn key.
 
     Returns
     -------
@@ -752,28 +1606,6 @@ def join_post_process(df_grb: DataFrame, hdfs_adress: str, root_path: str) -> Da
     Examples
     --------
     """
-    df_grb = concat_col(df_grb, "magpsf")
-    df_grb = concat_col(df_grb, "diffmaglim")
-    df_grb = concat_col(df_grb, "jd")
-    df_grb = concat_col(df_grb, "fid")
-
-    # DEPRECATED
-    # computed by the fast transient fink science module
-    # df_grb = df_grb.withColumn(
-    #     "c_rate",
-    #     compute_rate(
-    #         df_grb["candidate.magpsf"],
-    #         df_grb["candidate.jdstarthist"],
-    #         df_grb["candidate.jd"],
-    #         df_grb["candidate.fid"],
-    #         df_grb["cmagpsf"],
-    #         df_grb["cdiffmaglim"],
-    #         df_grb["cjd"],
-    #         df_grb["cfid"],
-    #     ),
-    # )
-    # df_grb = format_rate_results(df_grb, "c_rate")
-
     # TODO : do something better with satellites
     # df_grb = add_tracklet_information(df_grb)
 
@@ -799,19 +1631,36 @@ def join_post_process(df_grb: DataFrame, hdfs_adress: str, root_path: str) -> Da
     )
 
     # refine the association and compute the serendipitous probability
-    df_grb = df_grb.withColumn(
-        "p_assoc",
-        get_association_proba(
-            df_grb["observatory"],
-            df_grb["raw_event"],
-            df_grb["ztf_ra"],
-            df_grb["ztf_dec"],
-            df_grb["jd_first_real_det"],
-            F.lit(hdfs_adress),
-            df_grb["gcn_status"],
-            F.lit(root_path),
-        ),
-    )
+    # the rows are grouped by gcn event inside the udf to parse each gcn once per batch
+    if gcn_events is None:
+        df_grb = df_grb.withColumn(
+            "p_assoc",
+            get_association_proba_per_event(
+                df_grb["observatory"],
+                df_grb["triggerId"],
+                df_grb["gcn_status"],
+                df_grb["raw_event"],
+                df_grb["ztf_ra"],
+                df_grb["ztf_dec"],
+                df_grb["jd_first_real_det"],
+                F.lit(hdfs_adress),
+                F.lit(root_path),
+            ),
+        )
+    else:
+        df_grb = df_grb.withColumn(
+            "p_assoc",
+            get_association_proba_by_key(gcn_events)(
+                df_grb["observatory"],
+                df_grb["triggerId"],
+                df_grb["gcn_status"],
+                df_grb["ztf_ra"],
+                df_grb["ztf_dec"],
+                df_grb["jd_first_real_det"],
+                F.lit(hdfs_adress),
+                F.lit(root_path),
+            ),
+        )
 
     # select only relevant columns
     cols_to_remove = [
@@ -831,6 +1680,10 @@ def join_post_process(df_grb: DataFrame, hdfs_adress: str, root_path: str) -> Da
         "ivorn",
         "hpix_circle",
         "triggerTimejd",
+        "max_jdstarthist",
+        "hpix_moc",
+        "moc_start",
+        "moc_end",
     ]
     cols_fink = [i for i in df_grb.columns if i not in cols_to_remove]
     cols_extra = [
@@ -873,7 +1726,7 @@ def read_and_build_spark_submit(config, logger):
     >>> home_path = os.environ["HOME"]
     >>> driver_host = os.environ["HOSTNAME"]
     >>> path_bash_profile = os.path.join(home_path, ".bash_profile")
-    >>> test_str = f"if test -f '{path_bash_profile}'; then         source {path_bash_profile}; fi;         `which spark-submit`         --master local[8]         --conf spark.driver.host={driver_host}         --conf spark.mesos.principal=         --conf spark.mesos.secret=         --conf spark.mesos.role=         --conf spark.executorEnv.HOME=/path/to/user/         --driver-memory 4G         --executor-memory 8G         --conf spark.cores.max=16         --conf spark.executor.cores=8"
+    >>> test_str = f"if test -f '{path_bash_profile}'; then         source {path_bash_profile}; fi;         `which spark-submit`         --master local[8]         --conf spark.driver.host={driver_host}         --conf spark.mesos.principal=         --conf spark.mesos.secret=         --conf spark.mesos.role=         --conf spark.executorEnv.HOME=/path/to/user/         --conf spark.executorEnv.FINK_MM_SKYMAP_CACHE_SIZE=256         --driver-memory 4G         --executor-memory 8G         --conf spark.cores.max=16         --conf spark.executor.cores=8"
     >>> test_str == spark_str
     True
     """
@@ -888,6 +1741,11 @@ def read_and_build_spark_submit(config, logger):
         exec_mem = config["STREAM"]["executor_memory"]
         max_core = config["STREAM"]["max_core"]
         exec_core = config["STREAM"]["executor_core"]
+        skymap_cache_size = config.getfloat(
+            "ADMIN",
+            "skymap_cache_size",
+            fallback=DEFAULT_CACHE_SIZE / 1024**2,
+        )
     except Exception as e:  # pragma: no cover
         logger.error("Spark Admin config entry not found \n\t {}".format(e))
         exit(1)
@@ -904,6 +1762,7 @@ def read_and_build_spark_submit(config, logger):
         --conf spark.mesos.secret={} \
         --conf spark.mesos.role={} \
         --conf spark.executorEnv.HOME={} \
+        --conf spark.executorEnv.{}={:g} \
         --driver-memory {}G \
         --executor-memory {}G \
         --conf spark.cores.max={} \
@@ -916,6 +1775,8 @@ def read_and_build_spark_submit(config, logger):
         secret,
         role,
         executor_env,
+        SKYMAP_CACHE_SIZE_ENV,
+        skymap_cache_size,
         driver_mem,
         exec_mem,
         max_core,
@@ -967,6 +1828,121 @@ def read_prior_params(config, logger):
     return ast_dist, pansstar_dist, pansstar_star_score, gaia_dist
 
 
+def read_join_mode(config, logger):
+    """
+    Read the join mode from the config file, default to the hpix join mode
+
+    Parameters
+    ----------
+    config : ConfigParser
+        the ConfigParser object containing the entry from the config file
+    logger : logging object
+        the logger used to print logs
+
+    Returns
+    -------
+    join_mode: String
+        the join algorithm between the ztf alerts and the gcn footprints, see JoinMode
+
+    Examples
+    --------
+    >>> config = get_config({"--config" : "fink_mm/conf/fink_mm.conf"})
+    >>> logger = init_logging()
+    >>> read_join_mode(config, logger)
+    'hpix'
+
+    >>> config["ADMIN"]["join_mode"] = "moc"
+    >>> read_join_mode(config, logger)
+    'moc'
+    """
+    join_mode = config["ADMIN"].get("join_mode", JoinMode.HPIX.value)
+
+    try:
+        JoinMode(join_mode)
+    except ValueError as e:  # pragma: no cover
+        logger.error("Unknown join mode in the config file \n\t {}".format(e))
+        exit(1)
+
+    return join_mode
+
+
+def read_compact_join(config, logger):
+    """
+    Read the compact join option from the config file, default to False
+
+    Parameters
+    ----------
+    config : ConfigParser
+        the ConfigParser object containing the entry from the config file
+    logger : logging object
+        the logger used to print logs
+
+    Returns
+    -------
+    compact_join: String
+        "True" if only the gcn key goes through the join and the raw_event is taken
+        from the gcn events of the batch, "False" otherwise
+
+    Examples
+    --------
+    >>> config = get_config({"--config" : "fink_mm/conf/fink_mm.conf"})
+    >>> logger = init_logging()
+    >>> read_compact_join(config, logger)
+    'False'
+
+    >>> config["ADMIN"]["compact_join"] = "true"
+    >>> read_compact_join(config, logger)
+    'True'
+    """
+    try:
+        compact_join = config["ADMIN"].getboolean("compact_join", False)
+    except ValueError as e:  # pragma: no cover
+        logger.error(
+            "compact_join must be a boolean in the config file \n\t {}".format(e)
+        )
+        exit(1)
+
+    return str(compact_join)
+
+
+def read_output_format(config, logger):
+    """
+    Read the output format of the join from the config file, default to the wide format
+
+    Parameters
+    ----------
+    config : ConfigParser
+        the ConfigParser object containing the entry from the config file
+    logger : logging object
+        the logger used to print logs
+
+    Returns
+    -------
+    output_format: String
+        the layout of the join output, see OutputFormat
+
+    Examples
+    --------
+    >>> config = get_config({"--config" : "fink_mm/conf/fink_mm.conf"})
+    >>> logger = init_logging()
+    >>> read_output_format(config, logger)
+    'wide'
+
+    >>> config["ADMIN"]["output_format"] = "normalised"
+    >>> read_output_format(config, logger)
+    'normalised'
+    """
+    output_format = config["ADMIN"].get("output_format", OutputFormat.WIDE.value)
+
+    try:
+        OutputFormat(output_format)
+    except ValueError as e:  # pragma: no cover
+        logger.error("Unknown output format in the config file \n\t {}".format(e))
+        exit(1)
+
+    return output_format
+
+
 def read_additional_spark_options(arguments, config, logger, verbose, is_test):
     """
     Read the field from config file related to additional spark options.
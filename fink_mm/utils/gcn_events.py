@@ -0,0 +1,153 @@
+from pyspark.sql import DataFrame
+
+from fink_mm.utils.fun_utils import get_observatory
+
+
+class GcnEventBatch:
+    """
+    The raw gcn events of a join batch keyed by (observatory, triggerId, gcn_status),
+    the triggerId are only unique within an observatory.
+    The batch is broadcasted to the executors so only the event key goes through the join,
+    the raw events are decoded at most once per executor process and per batch.
+    """
+
+    def __init__(self, events: dict):
+        """
+        Initialise the batch from the raw events
+
+        Parameters
+        ----------
+        events: dict
+            the gcn events, the keys are (observatory, triggerId, gcn_status)
+            and the values are (observatory, raw_event)
+
+        Example
+        -------
+        >>> pdf = pd.read_parquet(gw_data)
+        >>> gcn_events = GcnEventBatch(
+        ...     {("LVK", "S230518h", "initial"): (pdf["observatory"].iloc[0], pdf["raw_event"].iloc[0])}
+        ... )
+        >>> len(gcn_events), ("LVK", "S230518h", "initial") in gcn_events
+        (1, True)
+        >>> ("Fermi", "S230518h", "initial") in gcn_events
+        False
+        """
+        self.events = events
+        self._decoded = {}
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self.events
+
+    def __getstate__(self) -> dict:
+        # the decoded events are not sent to the executors
+        return {"events": self.events}
+
+    def __setstate__(self, state: dict):
+        self.events = state["events"]
+        self._decoded = {}
+
+    def get_raw_event(self, key: tuple) -> str:
+        """
+        Return the raw event of a gcn or None if the gcn is not in the batch
+
+        Parameters
+        ----------
+        key: tuple
+            the gcn key (observatory, triggerId, gcn_status)
+
+        Return
+        ------
+        string or None
+            the raw event
+
+        Example
+        -------
+        >>> pdf = pd.read_parquet(grb_data)
+        >>> gcn_events = GcnEventBatch(
+        ...     {("INTEGRAL", "10472", "initial"): (pdf["observatory"].iloc[0], pdf["raw_event"].iloc[0])}
+        ... )
+        >>> gcn_events.get_raw_event(("INTEGRAL", "10472", "initial")) == pdf["raw_event"].iloc[0]
+        True
+        >>> gcn_events.get_raw_event(("INTEGRAL", "10472", "update_0")) is None
+        True
+        """
+        event = self.events.get(key)
+        return None if event is None else event[1]
+
+    def get_observatory(self, key: tuple):  # -> Observatory
+        """
+        Return the observatory class of a gcn or None if the gcn is not in the batch.
+        The raw event is decoded on the first call, the next calls return the same object.
+
+        Parameters
+        ----------
+        key: tuple
+            the gcn key (observatory, triggerId, gcn_status)
+
+        Return
+        ------
+        Observatory or None
+            the observatory class
+
+        Example
+        -------
+        >>> pdf = pd.read_parquet(gw_data)
+        >>> gcn_events = GcnEventBatch(
+        ...     {("LVK", "S230518h", "initial"): (pdf["observatory"].iloc[0], pdf["raw_event"].iloc[0])}
+        ... )
+        >>> key = ("LVK", "S230518h", "initial")
+        >>> type(gcn_events.get_observatory(key))
+        <class 'LVK.LVK'>
+        >>> gcn_events.get_observatory(key) is gcn_events.get_observatory(key)
+        True
+        >>> gcn_events.get_observatory(("LVK", "S230518h", "update")) is None
+        True
+        """
+        if key not in self._decoded:
+            event = self.events.get(key)
+            if event is None:
+                return None
+            self._decoded[key] = get_observatory(*event)
+        return self._decoded[key]
+
+
+def collect_gcn_events(gcn_dataframe: DataFrame) -> GcnEventBatch:
+    """
+    Collect the raw events of a static gcn dataframe.
+    If several notices have the same (observatory, triggerId, gcn_status), only one is kept.
+
+    Parameters
+    ----------
+    gcn_dataframe: DataFrame
+        the gcn alerts with the triggerId, gcn_status, observatory and raw_event columns
+
+    Return
+    ------
+    GcnEventBatch
+        the raw events keyed by (observatory, triggerId, gcn_status)
+
+    Example
+    -------
+    >>> gcn_events = collect_gcn_events(spark.read.format("parquet").load(gcn_datatest))
+    >>> len(gcn_events)
+    62
+    >>> type(gcn_events.get_observatory(("LVK", "S240112e", "update_0")))
+    <class 'LVK.LVK'>
+    """
+    pdf = gcn_dataframe.select(
+        ["triggerId", "gcn_status", "observatory", "raw_event"]
+    ).toPandas()
+    return GcnEventBatch(
+        {
+            (obs, trigger_id, status): (obs, raw_event)
+            for trigger_id, status, obs, raw_event in zip(
+                pdf["triggerId"],
+                pdf["gcn_status"],
+                pdf["observatory"],
+                pdf["raw_event"],
+            )
+        }
+    )
@@ -202,21 +202,25 @@ def serendipitous_association_proba(
     Probability of having a GRB in the given time delay between the ZTF
     optical transient and having a ZTF optical transient in the GRB error circle.
 
+    All the computation are done with numpy and scipy functions,
+    the parameters can thus be given as numpy arrays to compute the probability
+    of many alerts at once.
+
     Parameters
     ----------
-    grb_rate : float
+    grb_rate : float or numpy array
         the GRB detection rate of an instrument (mu_fermi_ztf, mu_swift_ztf or mu_integral_ztf)
         unit: detection per year
-    delay : float
+    delay : float or numpy array
         time interval in days between a ZTF optical transient and a GRB
         unit: day
-    grb_loc_area : float
+    grb_loc_area : float or numpy array
         radius of the GRB circle error region in degree
         unit: degree
 
     Returns
     -------
-    float
+    float or numpy array
         serendipitous probability of having a GRB in the delay and
         an optical transient in the circle error region.
 
@@ -233,6 +237,12 @@ def serendipitous_association_proba(
     ZTF23abaanxz / GRB230827B
     >>> '%.6f' % serendipitous_association_proba(mu_fermi_ztf, 0.083279, 2.17)
     '0.999934'
+
+    >>> p = serendipitous_association_proba(
+    ...     mu_fermi_ztf, np.array([1.03, 0.29, 0.083279]), np.array([3.1, 36.327284855876584, 2.17])
+    ... )
+    >>> ['%.6f' % el for el in p]
+    ['0.998510', '0.936975', '0.999934']
     """
     # proba of having a grb in a such delay between the optical alert and the trigger time
     # and having a ztf optical transient in the grb location area
@@ -0,0 +1,204 @@
+import os
+from typing import Tuple
+
+from pyspark.sql import DataFrame, SparkSession
+
+from fink_mm.utils.fun_utils import OutputFormat
+
+# partitioning columns of the join output
+PARTITION_COLUMNS = ["year", "month", "day"]
+
+# key of a gcn event in the join output, two observatories can share a triggerId
+GCN_EVENT_KEY = ["observatory", "triggerId", "gcn_status"]
+
+# key of a match in the normalised output
+MATCH_KEY = ["objectId", "candid"] + GCN_EVENT_KEY
+
+# columns of the join output coming from the gcn, the other columns come from the ztf alerts
+GCN_EVENT_COLUMNS = GCN_EVENT_KEY + [
+    "instrument",
+    "event",
+    "ackTime",
+    "triggerTimeUTC",
+    "gcn_ra",
+    "gcn_dec",
+    "gcn_loc_error",
+    "raw_event",
+]
+
+# suffix of the two tables of the normalised output
+MATCHES_SUFFIX = "_matches"
+GCN_EVENTS_SUFFIX = "_gcn_events"
+
+
+def split_join_output(df_join: DataFrame) -> Tuple[DataFrame, DataFrame]:
+    """
+    Split the wide join output into a matches table and a gcn events table.
+    The matches table contains the alert columns and the gcn event key,
+    the gcn events table contains each gcn event once by partition.
+    The gcn columns must depend only on the gcn event key (observatory, triggerId, gcn_status),
+    the gcn columns missing from df_join (older output versions) are ignored.
+
+    Parameters
+    ----------
+    df_join: DataFrame
+        the join output with the wide schema
+
+    Returns
+    -------
+    matches: DataFrame
+        the matches table
+    gcn_events: DataFrame
+        the gcn events table
+
+    Examples
+    --------
+    >>> df_join = spark.read.format("parquet").load(offline_data_test)
+    >>> matches, gcn_events = split_join_output(df_join)
+    >>> set(matches.columns) & set(GCN_EVENT_COLUMNS) == set(GCN_EVENT_KEY)
+    True
+    >>> sorted(gcn_events.columns)
+    ['day', 'event', 'gcn_dec', 'gcn_loc_error', 'gcn_ra', 'gcn_status', 'instrument', 'month', 'observatory', 'raw_event', 'triggerId', 'triggerTimeUTC', 'year']
+    >>> matches.count() == df_join.count()
+    True
+    >>> gcn_events.count() == df_join.select(GCN_EVENT_KEY + PARTITION_COLUMNS).distinct().count()
+    True
+    """
+    gcn_columns = [c for c in GCN_EVENT_COLUMNS if c in df_join.columns]
+    matches = df_join.drop(*[c for c in gcn_columns if c not in GCN_EVENT_KEY])
+    gcn_events = df_join.select(gcn_columns + PARTITION_COLUMNS).dropDuplicates(
+        GCN_EVENT_KEY + PARTITION_COLUMNS
+    )
+    return matches, gcn_events
+
+
+def write_join_output(
+    df_join: DataFrame, path: str, output_format: OutputFormat, mode: str = "append"
+):
+    """
+    Write a join output batch according to the output format.
+    The wide output is written in path, the normalised output
+    in path + MATCHES_SUFFIX and path + GCN_EVENTS_SUFFIX.
+    The gcn events are written before the matches so a reader never find a match without its gcn event.
+
+    Parameters
+    ----------
+    df_join: DataFrame
+        the join output with the wide schema
+    path: string
+        the path of the wide output
+    output_format: OutputFormat
+        the layout of the join output
+    mode: string
+        the spark save mode
+
+    Examples
+    --------
+    >>> df_join = spark.read.format("parquet").load(offline_data_test)
+    >>> output_dir = tempfile.TemporaryDirectory()
+    >>> write_join_output(df_join, output_dir.name + "/offline", OutputFormat.NORMALISED)
+    >>> sorted(os.listdir(output_dir.name))
+    ['offline_gcn_events', 'offline_matches']
+    >>> spark.read.parquet(output_dir.name + "/offline_matches").count() == df_join.count()
+    True
+    """
+    if output_format == OutputFormat.WIDE:
+        df_join.write.mode(mode).partitionBy(*PARTITION_COLUMNS).parquet(path)
+        return
+
+    matches, gcn_events = split_join_output(df_join)
+    gcn_events.write.mode(mode).partitionBy(*PARTITION_COLUMNS).parquet(
+        path + GCN_EVENTS_SUFFIX
+    )
+    matches.write.mode(mode).partitionBy(*PARTITION_COLUMNS).parquet(
+        path + MATCHES_SUFFIX
+    )
+
+
+def load_join_output(
+    spark: SparkSession,
+    path: str,
+    night: str = None,
+    output_format: OutputFormat = OutputFormat.NORMALISED,
+    streaming: bool = False,
+) -> DataFrame:
+    """
+    Load the join output with the wide schema.
+    For the normalised output, the matches are joined with the gcn events to rebuild the wide schema.
+
+    Parameters
+    ----------
+    spark: SparkSession
+        the current spark session
+    path: string
+        the path of the wide output, see write_join_output
+    night: string
+        if given, load only the partition of this night (format: YYYYMMDD),
+        the partitioning columns are then not loaded.
+    output_format: OutputFormat
+        the layout of the join output
+    streaming: boolean
+        if True, return a streaming dataframe reading the new files of the output.
+        The output must already contains data to infer the schema.
+
+    Returns
+    -------
+    DataFrame
+        the join output with the wide schema
+
+    Examples
+    --------
+    >>> df_join = spark.read.format("parquet").load(offline_data_test)
+    >>> output_dir = tempfile.TemporaryDirectory()
+    >>> write_join_output(df_join, output_dir.name + "/offline", OutputFormat.NORMALISED)
+    >>> wide = load_join_output(spark, output_dir.name + "/offline")
+    >>> sorted(wide.columns) == sorted(df_join.columns)
+    True
+    >>> wide.count() == df_join.count()
+    True
+    >>> cols = ["objectId", "candid", "p_assoc", "triggerId", "gcn_status", "observatory", "raw_event"]
+    >>> wide_pdf = wide.select(cols).toPandas().sort_values(cols).reset_index(drop=True)
+    >>> join_pdf = df_join.select(cols).toPandas().sort_values(cols).reset_index(drop=True)
+    >>> wide_pdf.equals(join_pdf)
+    True
+
+    the gcn events of two observatories sharing a triggerId are not mixed
+    >>> import pyspark.sql.functions as F
+    >>> first = df_join.filter(F.col("observatory") != "Swift").limit(1)
+    >>> shared = first.union(
+    ...     first.withColumn("observatory", F.lit("Swift")).withColumn("raw_event", F.lit("swift voevent"))
+    ... )
+    >>> write_join_output(shared, output_dir.name + "/shared", OutputFormat.NORMALISED)
+    >>> wide = load_join_output(spark, output_dir.name + "/shared")
+    >>> is_swift = F.col("observatory") == "Swift"
+    >>> wide.count(), wide.filter(is_swift == (F.col("raw_event") == "swift voevent")).count()
+    (2, 2)
+    """
+
+    def read_table(table_path):
+        if night is not None:
+            table_path = os.path.join(
+                table_path,
+                "year={}/month={}/day={}".format(night[0:4], night[4:6], night[6:8]),
+            )
+        static_df = spark.read.parquet(table_path)
+        if not streaming:
+            return static_df
+        return (
+            spark.readStream.format("parquet")
+            .schema(static_df.schema)
+            .option("basePath", table_path)
+            .option("path", table_path)
+            .option("latestFirst", True)
+            .load()
+        )
+
+    if output_format == OutputFormat.WIDE:
+        return read_table(path)
+
+    matches = read_table(path + MATCHES_SUFFIX)
+    gcn_events = read_table(path + GCN_EVENTS_SUFFIX)
+
+    # a gcn event is written in each partition and each batch containing one of its match
+    gcn_events = gcn_events.drop(*PARTITION_COLUMNS).dropDuplicates(GCN_EVENT_KEY)
+    return matches.join(gcn_events, GCN_EVENT_KEY, "inner")
@@ -0,0 +1,393 @@
+import numpy as np
+import pandas as pd
+import healpy as hp
+from enum import Enum
+
+import pyspark.sql.functions as F
+from pyspark.sql import DataFrame, SparkSession
+
+from fink_mm.init import init_logging
+from fink_mm.utils.fun_utils import JoinMode, MIN_ERR_ARCMIN
+from fink_mm.utils.moc import ADAPTIVE_NPIX
+
+
+class JoinStrategy(Enum):
+    BROADCAST_GCN = "broadcast_gcn"
+    BROADCAST_ZTF = "broadcast_ztf"
+    SHUFFLE = "shuffle"
+
+
+# observatories sending a skymap, their err_arcmin column is the 90% area in square arcminute
+# instead of an error radius in arcminute
+SKYMAP_OBSERVATORIES = ["lvk"]
+
+# approximate size of a gcn footprint row in the join without the raw_event (in bytes)
+GCN_ROW_BYTES = 512
+
+# approximate number of pixel ranges of a footprint in moc join mode
+MOC_CIRCLE_RANGES = 32
+MOC_SKYMAP_RANGES = 512
+
+# used if the spark broadcast threshold cannot be read from the spark configuration
+DEFAULT_BROADCAST_THRESHOLD = 10 * 1024**2
+
+
+def estimate_footprint_rows(
+    observatory: pd.Series, err_arcmin: pd.Series, NSIDE: int, join_mode: JoinMode
+) -> int:
+    """
+    Estimate the number of rows of the gcn dataframe once the footprints are exploded for the join,
+    the estimation only use the stored error of the gcn and not the raw_event.
+
+    Parameters
+    ----------
+    observatory: pd.Series containing string
+        the observatory name of the gcn
+    err_arcmin: pd.Series containing float
+        the gcn error (error radius in arcminute or 90% area in square arcminute for the skymaps)
+    NSIDE: integer
+        Healpix map resolution
+    join_mode: JoinMode
+        the join algorithm between the ztf alerts and the gcn footprints
+
+    Returns
+    -------
+    integer
+        the estimated number of footprint rows
+
+    Examples
+    --------
+    >>> pdf = pd.read_parquet(gcn_datatest)
+    >>> estimate_footprint_rows(pdf["observatory"], pdf["err_arcmin"], 4, JoinMode.HPIX)
+    1282
+    >>> estimate_footprint_rows(pdf["observatory"], pdf["err_arcmin"], 4, JoinMode.MOC)
+    16384
+    >>> estimate_footprint_rows(pdf["observatory"], pdf["err_arcmin"], 4, JoinMode.ADAPTIVE)
+    1984
+    """
+    is_skymap = observatory.str.lower().isin(SKYMAP_OBSERVATORIES).values
+    err_arcmin = err_arcmin.values.astype(np.float64)
+    # the implausible error radius (see has_plausible_error) are raised to the smallest error
+    # of their observatory, the raw event is not decoded to estimate the size
+    min_err = observatory.str.lower().map(MIN_ERR_ARCMIN).fillna(0).values
+    err_arcmin = np.where(is_skymap, err_arcmin, np.maximum(err_arcmin, min_err))
+
+    if join_mode == JoinMode.MOC:
+        return int(np.where(is_skymap, MOC_SKYMAP_RANGES, MOC_CIRCLE_RANGES).sum())
+    elif join_mode == JoinMode.ADAPTIVE:
+        return int(2 * ADAPTIVE_NPIX * len(err_arcmin))
+
+    # area of the footprints in square degree
+    area = np.where(is_skymap, err_arcmin / 3600, np.pi * (err_arcmin / 60) ** 2)
+    # the pixels within the footprint and the ones on the border (inclusive query)
+    npix = np.ceil(area / hp.nside2pixarea(NSIDE, degrees=True)) + 4
+    return int(np.minimum(npix, hp.nside2npix(NSIDE)).sum())
+
+
+def choose_join_strategy(
+    gcn_bytes: float,
+    ztf_bytes: float,
+    broadcast_threshold: float,
+    is_streaming: bool = False,
+) -> JoinStrategy:
+    """
+    Choose the side of the join to broadcast, the smaller side is broadcasted
+    if it is smaller than the broadcast threshold, otherwise the two sides are shuffled.
+
+    Parameters
+    ----------
+    gcn_bytes: float
+        the estimated size of the gcn side (in bytes)
+    ztf_bytes: float
+        the estimated size of the ztf side (in bytes)
+    broadcast_threshold: float
+        the maximum size of a broadcasted side (in bytes), a negative value disable the broadcast
+    is_streaming: boolean
+        if True, both sides are streams and spark ignore the broadcast in a stream-stream join.
+
+    Returns
+    -------
+    JoinStrategy
+        the join strategy
+
+    Examples
+    --------
+    >>> choose_join_strategy(1e5, 1e9, 1e7)
+    <JoinStrategy.BROADCAST_GCN: 'broadcast_gcn'>
+    >>> choose_join_strategy(1e8, 1e6, 1e7)
+    <JoinStrategy.BROADCAST_ZTF: 'broadcast_ztf'>
+    >>> choose_join_strategy(1e8, 1e9, 1e7)
+    <JoinStrategy.SHUFFLE: 'shuffle'>
+    >>> choose_join_strategy(1e5, 1e9, -1)
+    <JoinStrategy.SHUFFLE: 'shuffle'>
+    >>> choose_join_strategy(1e5, 1e9, 1e7, True)
+    <JoinStrategy.SHUFFLE: 'shuffle'>
+    """
+    if is_streaming or broadcast_threshold < 0:
+        return JoinStrategy.SHUFFLE
+
+    if gcn_bytes <= ztf_bytes and gcn_bytes <= broadcast_threshold:
+        return JoinStrategy.BROADCAST_GCN
+    elif ztf_bytes < gcn_bytes and ztf_bytes <= broadcast_threshold:
+        return JoinStrategy.BROADCAST_ZTF
+    else:
+        return JoinStrategy.SHUFFLE
+
+
+def get_broadcast_threshold(spark: SparkSession) -> float:
+    """
+    Return the broadcast threshold from the spark configuration (spark.sql.autoBroadcastJoinThreshold)
+
+    Parameters
+    ----------
+    spark: SparkSession
+        the current spark session
+
+    Returns
+    -------
+    float
+        the broadcast threshold in bytes
+
+    Examples
+    --------
+    >>> get_broadcast_threshold(spark)
+    10485760.0
+    """
+    units = {"b": 1, "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+    threshold = spark.conf.get("spark.sql.autoBroadcastJoinThreshold", None)
+    try:
+        threshold = threshold.strip().lower().rstrip("b")
+        if threshold == "":
+            return float(units["b"])
+        if threshold[-1] in units:
+            return float(threshold[:-1]) * units[threshold[-1]]
+        return float(threshold)
+    except (AttributeError, ValueError):
+        return float(DEFAULT_BROADCAST_THRESHOLD)
+
+
+def plan_size_in_bytes(dataframe: DataFrame) -> float:
+    """
+    Return the size of a dataframe estimated by the spark optimizer from the plan statistics,
+    nothing is read except the file metadata.
+
+    Parameters
+    ----------
+    dataframe: DataFrame
+        a batch dataframe
+
+    Returns
+    -------
+    float
+        the estimated size in bytes
+
+    Examples
+    --------
+    >>> ztf_df = spark.read.format('parquet').load(alert_data)
+    >>> plan_size_in_bytes(ztf_df) > plan_size_in_bytes(ztf_df.select("candidate.jd"))
+    True
+    """
+    stats = dataframe._jdf.queryExecution().optimizedPlan().stats()
+    return float(stats.sizeInBytes())
+
+
+def source_size_in_bytes(dataframe: DataFrame) -> float:
+    """
+    Return the size of the relations read by a dataframe from the plan statistics (the size of the files),
+    unlike plan_size_in_bytes, the size is not scaled by the projections and the filters.
+    Use as an upper bound of the size of a large column like the raw_event,
+    the optimizer assume a constant size for each string column.
+
+    Parameters
+    ----------
+    dataframe: DataFrame
+        a batch dataframe
+
+    Returns
+    -------
+    float
+        the size of the relations in bytes
+
+    Examples
+    --------
+    >>> gcn_df = spark.read.format('parquet').load(gcn_datatest)
+    >>> source_size_in_bytes(gcn_df.select("raw_event")) == plan_size_in_bytes(gcn_df)
+    True
+    >>> plan_size_in_bytes(gcn_df.select("raw_event")) < plan_size_in_bytes(gcn_df)
+    True
+    """
+    leaves = dataframe._jdf.queryExecution().optimizedPlan().collectLeaves()
+    return float(
+        sum(leaves.apply(i).stats().sizeInBytes() for i in range(leaves.size()))
+    )
+
+
+def plan_join(
+    spark: SparkSession,
+    ztf_dataframe: DataFrame,
+    gcn_dataframe: DataFrame,
+    NSIDE: int,
+    join_mode: JoinMode,
+) -> JoinStrategy:
+    """
+    Estimate the size of both sides of the join and choose the join strategy.
+    The gcn side is estimated from the number of gcn and their footprint size,
+    the ztf side from the spark plan statistics to avoid counting the alerts.
+    Must be called on the dataframe returned by load_dataframe, before the pre-join.
+
+    Parameters
+    ----------
+    spark: SparkSession
+        the current spark session
+    ztf_dataframe: DataFrame
+        the ztf alerts
+    gcn_dataframe: DataFrame
+        the gcn alerts
+    NSIDE: integer
+        Healpix map resolution
+    join_mode: JoinMode
+        the join algorithm between the ztf alerts and the gcn footprints
+
+    Returns
+    -------
+    JoinStrategy
+        the join strategy
+
+    Examples
+    --------
+    >>> ztf_df = spark.read.format('parquet').load(alert_data)
+    >>> gcn_df = spark.read.format('parquet').load(gcn_datatest)
+    >>> plan_join(spark, ztf_df, gcn_df, 4, JoinMode.HPIX)
+    <JoinStrategy.BROADCAST_GCN: 'broadcast_gcn'>
+    >>> spark.conf.set("spark.sql.autoBroadcastJoinThreshold", "1MB")
+    >>> plan_join(spark, ztf_df, gcn_df, 4, JoinMode.MOC)
+    <JoinStrategy.SHUFFLE: 'shuffle'>
+    >>> spark.conf.unset("spark.sql.autoBroadcastJoinThreshold")
+    """
+    logger = init_logging()
+
+    if ztf_dataframe.isStreaming and gcn_dataframe.isStreaming:
+        logger.info(
+            "join planner: stream-stream join, spark ignore the broadcast, join strategy: {}".format(
+                JoinStrategy.SHUFFLE.value
+            )
+        )
+        return JoinStrategy.SHUFFLE
+
+    broadcast_threshold = get_broadcast_threshold(spark)
+
+    if gcn_dataframe.isStreaming:
+        gcn_rows, gcn_bytes = np.nan, np.inf
+    else:
+        gcn_err = gcn_dataframe.select(["observatory", "err_arcmin"]).toPandas()
+        gcn_rows = estimate_footprint_rows(
+            gcn_err["observatory"], gcn_err["err_arcmin"], NSIDE, join_mode
+        )
+        gcn_bytes = gcn_rows * GCN_ROW_BYTES
+
+    if ztf_dataframe.isStreaming:
+        ztf_bytes = np.inf
+    else:
+        ztf_bytes = plan_size_in_bytes(ztf_dataframe)
+
+    strategy = choose_join_strategy(gcn_bytes, ztf_bytes, broadcast_threshold)
+    logger.info(
+        "join planner: gcn footprint rows = {} ({:.1f} MB), ztf alerts = {:.1f} MB, broadcast threshold = {:.1f} MB, join strategy: {}".format(
+            gcn_rows,
+            gcn_bytes / 1024**2,
+            ztf_bytes / 1024**2,
+            broadcast_threshold / 1024**2,
+            strategy.value,
+        )
+    )
+    return strategy
+
+
+def plan_rawevent_join(spark: SparkSession, gcn_dataframe: DataFrame) -> JoinStrategy:
+    """
+    Choose the join strategy used to combine the raw_event of the gcn with the join result.
+    The raw_event side is broadcasted only if the raw events are smaller than the broadcast threshold
+    (the LVK raw events contains the skymaps), the join result is never broadcasted as its size is unknown.
+    The raw events size is bounded by the size of the gcn files given by the spark plan statistics,
+    the raw_event column is not read.
+    Must be called on the dataframe returned by load_dataframe, before the pre-join.
+
+    Parameters
+    ----------
+    spark: SparkSession
+        the current spark session
+    gcn_dataframe: DataFrame
+        the gcn alerts
+
+    Returns
+    -------
+    JoinStrategy
+        the join strategy, BROADCAST_GCN or SHUFFLE
+
+    Examples
+    --------
+    >>> gcn_df = spark.read.format('parquet').load(gcn_datatest)
+    >>> plan_rawevent_join(spark, gcn_df)
+    <JoinStrategy.SHUFFLE: 'shuffle'>
+    >>> spark.conf.set("spark.sql.autoBroadcastJoinThreshold", "64MB")
+    >>> plan_rawevent_join(spark, gcn_df)
+    <JoinStrategy.BROADCAST_GCN: 'broadcast_gcn'>
+    >>> spark.conf.unset("spark.sql.autoBroadcastJoinThreshold")
+    """
+    logger = init_logging()
+
+    if gcn_dataframe.isStreaming:
+        strategy = JoinStrategy.SHUFFLE
+        raw_bytes = np.inf
+    else:
+        raw_bytes = source_size_in_bytes(gcn_dataframe)
+        strategy = choose_join_strategy(
+            raw_bytes, np.inf, get_broadcast_threshold(spark)
+        )
+
+    logger.info(
+        "join planner: gcn raw events = {:.1f} MB, raw_event join strategy: {}".format(
+            raw_bytes / 1024**2, strategy.value
+        )
+    )
+    return strategy
+
+
+def join_with_strategy(
+    gcn_dataframe: DataFrame,
+    ztf_dataframe: DataFrame,
+    join_condition: list,
+    strategy: JoinStrategy,
+) -> DataFrame:
+    """
+    Inner join of the gcn and the ztf dataframe according to the join strategy
+
+    Parameters
+    ----------
+    gcn_dataframe: DataFrame
+        the left side of the join
+    ztf_dataframe: DataFrame
+        the right side of the join
+    join_condition: list
+        the join condition
+    strategy: JoinStrategy
+        the join strategy
+
+    Returns
+    -------
+    DataFrame
+        the joined dataframe
+
+    Examples
+    --------
+    >>> left = spark.createDataFrame([(1, "a"), (2, "b")], ["k", "x"])
+    >>> right = spark.createDataFrame([(1, "c"), (3, "d")], ["k2", "y"])
+    >>> join_with_strategy(left, right, [left.k == right.k2], JoinStrategy.BROADCAST_GCN).collect()
+    [Row(k=1, x='a', k2=1, y='c')]
+    """
+    if strategy == JoinStrategy.BROADCAST_GCN:
+        gcn_dataframe = F.broadcast(gcn_dataframe)
+    elif strategy == JoinStrategy.BROADCAST_ZTF:
+        ztf_dataframe = F.broadcast(ztf_dataframe)
+
+    return gcn_dataframe.join(ztf_dataframe, join_condition, "inner")
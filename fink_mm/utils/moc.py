@@ -0,0 +1,399 @@
+import numpy as np
+import healpy as hp
+
+from fink_utils.science.utils import ra2phi, dec2theta
+
+# healpix order of the nested index used to describe the footprints as pixel ranges
+MOC_MAX_ORDER = 29
+
+# number of pixels targeted for a footprint by the adaptive join order
+ADAPTIVE_NPIX = 16
+
+
+def pixels_to_ranges(
+    order: np.ndarray, ipix: np.ndarray, max_order: int = MOC_MAX_ORDER
+) -> np.ndarray:
+    """
+    Convert a set of nested healpix pixels (possibly of different orders)
+    into sorted and merged ranges of nested pixels at the max order.
+
+    Parameters
+    ----------
+    order: integer or numpy array
+        the healpix order of each pixels
+    ipix: numpy array
+        the nested pixels number
+    max_order: integer
+        the healpix order of the returned ranges
+
+    Returns
+    -------
+    ranges: numpy array
+        a (n, 2) array, each row is a [start, end) range of nested pixels at the max order
+
+    Examples
+    --------
+    >>> pixels_to_ranges(1, np.array([2, 0, 1, 5]), 2)
+    array([[ 0, 12],
+           [20, 24]])
+
+    >>> pixels_to_ranges(np.array([1, 2, 2]), np.array([0, 4, 9]), 2)
+    array([[ 0,  5],
+           [ 9, 10]])
+
+    >>> pixels_to_ranges(2, np.array([], dtype=np.int64), 2)
+    array([], shape=(0, 2), dtype=int64)
+    """
+    shift = 2 * (max_order - np.asarray(order, dtype=np.int64))
+    start = np.asarray(ipix, dtype=np.int64) << shift
+    end = (np.asarray(ipix, dtype=np.int64) + 1) << shift
+    return merge_ranges(np.stack([start, end], axis=-1).reshape(-1, 2))
+
+
+def merge_ranges(ranges: np.ndarray) -> np.ndarray:
+    """
+    Sort and merge the overlapping or contiguous ranges
+
+    Parameters
+    ----------
+    ranges: numpy array
+        a (n, 2) array of [start, end) ranges
+
+    Returns
+    -------
+    ranges: numpy array
+        the sorted and merged ranges
+
+    Examples
+    --------
+    >>> merge_ranges(np.array([[10, 12], [0, 4], [4, 6], [3, 5], [11, 15]]))
+    array([[ 0,  6],
+           [10, 15]])
+    """
+    if len(ranges) == 0:
+        return ranges.astype(np.int64)
+
+    ranges = ranges[np.argsort(ranges[:, 0], kind="stable")]
+    end = np.maximum.accumulate(ranges[:, 1])
+
+    # a new range starts when its start is after the end of all the previous ranges
+    is_new = np.concatenate([[True], ranges[1:, 0] > end[:-1]])
+    is_last = np.concatenate([is_new[1:], [True]])
+    return np.stack([ranges[is_new, 0], end[is_last]], axis=-1).astype(np.int64)
+
+
+def disc_to_ranges(
+    ra: float, dec: float, radius: float, max_order: int = MOC_MAX_ORDER
+) -> np.ndarray:
+    """
+    Return the nested pixel ranges covering a disc on the sky.
+    The disc is covered with pixels at an order where at least four pixels fit in the radius
+    so the footprint stays close to the disc without producing large pixel lists.
+
+    Parameters
+    ----------
+    ra: float
+        right ascension of the disc center (in degree)
+    dec: float
+        declination of the disc center (in degree)
+    radius: float
+        radius of the disc (in degree)
+    max_order: integer
+        the healpix order of the returned ranges
+
+    Returns
+    -------
+    ranges: numpy array
+        a (n, 2) array, each row is a [start, end) range of nested pixels at the max order
+
+    Examples
+    --------
+    >>> ranges = disc_to_ranges(132.3328, -42.7168, 1.5)
+    >>> len(ranges)
+    23
+    >>> ranges_contain(ranges, hp.ang2pix(2**29, [132.3328, 132.3328, 0], [-42.7168, -41.3, 0], nest=True, lonlat=True))
+    array([ True,  True, False], dtype=bool)
+    """
+    if radius > 0:
+        order = np.ceil(np.log2(4 * hp.nside2resol(1) / np.radians(radius)))
+        order = int(np.clip(order, 0, max_order))
+    else:
+        order = max_order
+
+    ipix = hp.query_disc(
+        hp.order2nside(order),
+        hp.ang2vec(ra, dec, lonlat=True),
+        radius=np.radians(radius),
+        inclusive=True,
+        nest=True,
+    )
+    return pixels_to_ranges(order, ipix, max_order)
+
+
+def discs_to_ranges(
+    ra: np.ndarray,
+    dec: np.ndarray,
+    radius: np.ndarray,
+    max_order: int = MOC_MAX_ORDER,
+) -> list:
+    """
+    Return the nested pixel ranges covering each disc of a batch of discs,
+    same as disc_to_ranges but the orders and the disc centers are computed for the whole batch.
+
+    Parameters
+    ----------
+    ra: numpy array
+        right ascension of the disc centers (in degree)
+    dec: numpy array
+        declination of the disc centers (in degree)
+    radius: numpy array
+        radius of the discs (in degree)
+    max_order: integer
+        the healpix order of the returned ranges
+
+    Returns
+    -------
+    list
+        the ranges of each disc, see disc_to_ranges
+
+    Examples
+    --------
+    >>> all_ranges = discs_to_ranges(np.array([132.3328, 10.0]), np.array([-42.7168, 5.0]), np.array([1.5, 0.5]))
+    >>> [len(ranges) for ranges in all_ranges]
+    [23, 18]
+    >>> np.array_equal(all_ranges[0], disc_to_ranges(132.3328, -42.7168, 1.5))
+    True
+    >>> discs_to_ranges(np.array([]), np.array([]), np.array([]))
+    []
+    """
+    radius = np.asarray(radius, dtype=np.float64)
+    if len(radius) == 0:
+        return []
+
+    order = np.full(len(radius), max_order, dtype=np.int64)
+    has_radius = radius > 0
+    order[has_radius] = np.clip(
+        np.ceil(np.log2(4 * hp.nside2resol(1) / np.radians(radius[has_radius]))),
+        0,
+        max_order,
+    )
+    vec = hp.ang2vec(np.asarray(ra), np.asarray(dec), lonlat=True).reshape(-1, 3)
+
+    return [
+        pixels_to_ranges(
+            disc_order,
+            hp.query_disc(
+                hp.order2nside(disc_order),
+                disc_vec,
+                radius=np.radians(disc_radius),
+                inclusive=True,
+                nest=True,
+            ),
+            max_order,
+        )
+        for disc_order, disc_vec, disc_radius in zip(order, vec, radius)
+    ]
+
+
+def discs_to_pixels(
+    ra: np.ndarray, dec: np.ndarray, radius: np.ndarray, NSIDE: np.ndarray
+) -> list:
+    """
+    Return the ring healpix pixels within each disc of a batch of discs,
+    the pixels overlapping the border of a disc are included.
+
+    Parameters
+    ----------
+    ra: numpy array
+        right ascension of the disc centers (in degree)
+    dec: numpy array
+        declination of the disc centers (in degree)
+    radius: numpy array
+        radius of the discs (in degree)
+    NSIDE: integer or numpy array
+        Healpix map resolution of each disc
+
+    Returns
+    -------
+    list
+        the pixels within each disc
+
+    Examples
+    --------
+    >>> discs_to_pixels(np.array([132.3328, 10.0]), np.array([-42.7168, 5.0]), np.array([1.5, 0.5]), 16)
+    [array([2551, 2613, 2614]), array([1314, 1377])]
+    """
+    radius = np.asarray(radius, dtype=np.float64)
+    if len(radius) == 0:
+        return []
+
+    vec = hp.ang2vec(dec2theta(np.asarray(dec)), ra2phi(np.asarray(ra))).reshape(-1, 3)
+    return [
+        hp.query_disc(
+            int(disc_nside),
+            disc_vec,
+            radius=np.radians(disc_radius),
+            inclusive=True,
+            nest=False,
+        )
+        for disc_vec, disc_radius, disc_nside in zip(
+            vec, radius, np.broadcast_to(NSIDE, radius.shape)
+        )
+    ]
+
+
+def degrade_ranges(
+    ranges: np.ndarray, order: int, max_order: int = MOC_MAX_ORDER
+) -> np.ndarray:
+    """
+    Degrade ranges of nested pixels to a coarser order,
+    the returned ranges are the pixels at the coarser order overlapping the ranges
+    expressed as ranges at the max order.
+
+    Parameters
+    ----------
+    ranges: numpy array
+        a (n, 2) array of [start, end) ranges at the max order
+    order: integer
+        the coarser healpix order
+    max_order: integer
+        the healpix order of the ranges
+
+    Returns
+    -------
+    ranges: numpy array
+        the sorted and merged ranges aligned on the pixels of the coarser order
+
+    Examples
+    --------
+    >>> degrade_ranges(np.array([[1, 3], [17, 18], [20, 24]]), 1, 2)
+    array([[ 0,  4],
+           [16, 24]])
+    """
+    shift = 2 * (max_order - order)
+    start = (ranges[:, 0] >> shift) << shift
+    end = (((ranges[:, 1] - 1) >> shift) + 1) << shift
+    return merge_ranges(np.stack([start, end], axis=-1))
+
+
+def intersect_ranges(ranges: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """
+    Return the intersection of two sets of sorted and merged ranges
+
+    Parameters
+    ----------
+    ranges: numpy array
+        a (n, 2) array of sorted and merged [start, end) ranges
+    other: numpy array
+        a (m, 2) array of sorted and merged [start, end) ranges
+
+    Returns
+    -------
+    ranges: numpy array
+        the sorted and merged ranges contained in both sets
+
+    Examples
+    --------
+    >>> intersect_ranges(np.array([[0, 8], [12, 16]]), np.array([[4, 14]]))
+    array([[ 4,  8],
+           [12, 14]])
+    >>> intersect_ranges(np.array([[0, 8]]), np.array([], dtype=np.int64).reshape(0, 2))
+    array([], shape=(0, 2), dtype=int64)
+    """
+    if len(ranges) == 0 or len(other) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+
+    # the elementary intervals between two consecutive bounds are either in or out of each set
+    bounds = np.unique(np.concatenate([ranges.ravel(), other.ravel()]))
+    start, end = bounds[:-1], bounds[1:]
+    keep = ranges_contain(ranges, start) & ranges_contain(other, start)
+    return merge_ranges(np.stack([start[keep], end[keep]], axis=-1))
+
+
+def area_to_order(
+    area: float, npix: int = ADAPTIVE_NPIX, max_order: int = MOC_MAX_ORDER
+) -> int:
+    """
+    Return the finest healpix order where a footprint of the given area
+    is covered by about npix pixels.
+
+    Parameters
+    ----------
+    area: float
+        the area of the footprint (in square degree)
+    npix: integer
+        the targeted number of pixels
+    max_order: integer
+        the finest order allowed
+
+    Returns
+    -------
+    integer
+        the healpix order
+
+    Examples
+    --------
+    >>> area_to_order(np.pi * 0.05**2)
+    11
+    >>> area_to_order(666)
+    3
+    >>> area_to_order(41253)
+    0
+    """
+    if area <= 0:
+        return max_order
+    order = np.floor(0.5 * np.log2(npix * hp.nside2pixarea(1, degrees=True) / area))
+    return int(np.clip(order, 0, max_order))
+
+
+def ranges_contain(ranges: np.ndarray, ipix: np.ndarray) -> np.ndarray:
+    """
+    Test if nested pixels at the max order fall within sorted and merged ranges
+
+    Parameters
+    ----------
+    ranges: numpy array
+        a (n, 2) array of sorted and merged [start, end) ranges
+    ipix: numpy array
+        nested pixels at the same order as the ranges
+
+    Returns
+    -------
+    numpy array
+        boolean array, True if the pixel is within one of the ranges
+
+    Examples
+    --------
+    >>> ranges_contain(np.array([[0, 6], [10, 15]]), np.array([0, 5, 6, 9, 10, 15]))
+    array([ True,  True, False, False,  True, False], dtype=bool)
+    """
+    i = np.searchsorted(ranges[:, 0], ipix, side="right") - 1
+    return (i >= 0) & (ipix < ranges[np.maximum(i, 0), 1])
+
+
+def moc_bucket_shift(NSIDE: int) -> int:
+    """
+    Return the bit shift converting a nested pixel at the order MOC_MAX_ORDER
+    into the nested pixel at the order of NSIDE containing it.
+    The pixels at the NSIDE order are used as buckets to make the range join an equi-join.
+
+    Parameters
+    ----------
+    NSIDE: integer
+        Healpix map resolution, must be a power of 2
+
+    Returns
+    -------
+    integer
+        the number of bits to shift
+
+    Examples
+    --------
+    >>> moc_bucket_shift(4)
+    54
+    >>> hp.ang2pix(2**29, 132.3328, -42.7168, nest=True, lonlat=True) >> moc_bucket_shift(4)
+    153
+    >>> hp.ang2pix(4, 132.3328, -42.7168, nest=True, lonlat=True)
+    153
+    """
+    return 2 * (MOC_MAX_ORDER - hp.nside2order(NSIDE))
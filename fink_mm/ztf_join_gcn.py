@@ -5,16 +5,27 @@ warnings.filterwarnings("ignore")
 import time
 import os
 import subprocess
-from typing import Tuple
+from typing import Tuple, Callable
 import sys
 import json
 import pandas as pd
+import healpy as hp
 from threading import Timer
 
 from pyspark.sql import functions as F
 from pyspark.sql.functions import explode, col, pandas_udf
-from pyspark.sql.types import StringType
-from pyspark.sql import SparkSession, DataFrame
+from pyspark.sql.types import (
+    StringType,
+    DataType,
+    ArrayType,
+    IntegerType,
+    LongType,
+    StructType,
+    StructField,
+)
+from pyspark.sql import SparkSession, DataFrame, Column
+from pyspark.broadcast import Broadcast
+from pyspark.sql.utils import AnalysisException
 
 
 from astropy.time import Time
@@ -22,7 +33,7 @@ from datetime import timedelta
 
 from fink_utils.science.utils import ang2pix
 from fink_utils.spark.partitioning import convert_to_datetime
-from fink_utils.broker.sparkUtils import init_sparksession, connect_to_raw_database
+from fink_utils.broker.sparkUtils import init_sparksession
 
 from fink_mm.utils.fun_utils import (
     build_spark_submit,
@@ -34,9 +45,32 @@ from fink_mm.utils.fun_utils import (
 )
 from fink_mm.init import LoggerNewLine
 import fink_mm.utils.application as apps
-from fink_mm.utils.fun_utils import DataMode
+from fink_mm.utils.fun_utils import DataMode, JoinMode, OutputFormat, RANGE_JOIN_MODES
 from fink_mm.init import get_config, init_logging, return_verbose_level
-from fink_mm.utils.fun_utils import get_pixels
+from fink_mm.utils.fun_utils import get_pixels, get_moc_ranges, ang2nest, read_join_mode
+from fink_mm.utils.fun_utils import read_compact_join, get_raw_event_by_key
+from fink_mm.utils.fun_utils import (
+    read_output_format,
+    max_jdstarthist,
+    circle_association_condition,
+)
+from fink_mm.utils.fun_utils import (
+    footprint_hpix_column,
+    bound_adaptive_ranges,
+    FOOTPRINT_MOC,
+    FOOTPRINT_ADAPTIVE,
+)
+from fink_mm.utils.gcn_events import collect_gcn_events
+from fink_mm.utils.join_output import write_join_output
+from fink_mm.gcn_stream.gcn_skymap import rehydrate_raw_event
+from fink_mm.observatory.skymap_store import skymap_store_path
+from fink_mm.utils.moc import moc_bucket_shift
+from fink_mm.utils.join_planner import (
+    plan_join,
+    plan_rawevent_join,
+    join_with_strategy,
+    JoinStrategy,
+)
 
 from fink_filters.filter_mm_module.filter import (
     f_grb_bronze_events,
@@ -45,6 +79,42 @@ from fink_filters.filter_mm_module.filter import (
     f_gw_bronze_events,
 )
 
+# the fields of the ztf candidate used by ztf_grb_filter, the join and join_post_process
+ZTF_CANDIDATE_FIELDS = [
+    "candid",
+    "ra",
+    "dec",
+    "jd",
+    "jdstarthist",
+    "fid",
+    "rb",
+    "drb",
+    "magpsf",
+    "sigmapsf",
+    "ndethist",
+    "classtar",
+    "ssdistnr",
+    "distpsnr1",
+    "sgscore1",
+    "neargaia",
+]
+
+# the ztf columns never used by the join, not read from the science database.
+# hpix and tracklet are recomputed by the join.
+ZTF_UNUSED_COLUMNS = [
+    "candid",
+    "schemavsn",
+    "publisher",
+    "cutoutScience",
+    "cutoutTemplate",
+    "cutoutDifference",
+    "prv_candidates",
+    "fink_broker_version",
+    "fink_science_version",
+    "tracklet",
+    "hpix",
+]
+
 
 def ztf_grb_filter(spark_ztf, ast_dist, pansstar_dist, pansstar_star_score, gaia_dist):
     """
@@ -174,57 +244,363 @@ def remove_skymap(obsname: pd.Series, rawEvent: pd.Series) -> pd.Series:
     )
 
 
-def load_dataframe(
+def ztf_read_schema(
+    schema: StructType,
+    candidate_fields: list = ZTF_CANDIDATE_FIELDS,
+    unused_columns: list = ZTF_UNUSED_COLUMNS,
+) -> StructType:
+    """
+    Restrict the schema of the ztf science database to the columns used by the join.
+    The candidate is restricted to the given fields, the other science columns are kept
+    as they are part of the join output.
+
+    Parameters
+    ----------
+    schema : StructType
+        the schema of the ztf science database
+    candidate_fields : list
+        the fields of the candidate to read
+    unused_columns : list
+        the top level columns to not read
+
+    Returns
+    -------
+    StructType
+        the read schema
+
+    Examples
+    --------
+    >>> schema = spark.read.format('parquet').load(alert_data).schema
+    >>> read_schema = ztf_read_schema(schema)
+    >>> len(schema.fieldNames()), len(read_schema.fieldNames())
+    (39, 31)
+    >>> "prv_candidates" in read_schema.fieldNames()
+    False
+    >>> sorted(read_schema["candidate"].dataType.fieldNames()) == sorted(ZTF_CANDIDATE_FIELDS)
+    True
+    """
+    fields = []
+    for field in schema.fields:
+        if field.name in unused_columns:
+            continue
+        if field.name == "candidate":
+            field = StructField(
+                field.name,
+                StructType(
+                    [f for f in field.dataType.fields if f.name in candidate_fields]
+                ),
+                field.nullable,
+            )
+        fields.append(field)
+    return StructType(fields)
+
+
+def load_ztf_alerts(
     spark: SparkSession,
-    ztf_path: str,
-    gcn_path: str,
-    night: str,
-    time_window: int,
+    path: str,
     load_mode: DataMode,
-) -> Tuple[DataFrame, DataFrame]:
+    candidate_fields: list = ZTF_CANDIDATE_FIELDS,
+) -> DataFrame:
+    """
+    Load the ztf alerts with a fixed read schema, see ztf_read_schema.
+    The schema is taken from one file of the science database (no schema merge)
+    and only the columns used by the join are read from the parquet files.
+
+    Parameters
+    ----------
+    spark : SparkSession
+        the current spark session
+    path : string
+        the path of the science database of the night
+    load_mode : DataMode
+        STREAMING to connect to the science stream, OFFLINE to read the night
+    candidate_fields : list
+        the fields of the candidate to read
+
+    Returns
+    -------
+    DataFrame
+        the ztf alerts
+
+    Examples
+    --------
+    >>> ztf_alert = load_ztf_alerts(spark, alert_data, DataMode.OFFLINE)
+    >>> ztf_alert.count(), "cutoutScience" in ztf_alert.columns
+    (849, False)
+    >>> plan = ztf_grb_filter(ztf_alert, 5, 2, 0, 5)._jdf.queryExecution().executedPlan().toString()
+    >>> "prv_candidates" in plan, "PushedFilters: [Or(GreaterThan(candidate.ssdistnr" in plan
+    (False, True)
+    """
+    schema = ztf_read_schema(
+        spark.read.format("parquet").load(path).schema, candidate_fields
+    )
     if load_mode == DataMode.STREAMING:
-        # connection to the ztf science stream
-        ztf_alert = connect_to_raw_database(
-            os.path.join(ztf_path, f"online/science/{night}"),
-            os.path.join(ztf_path, f"online/science/{night}"),
-            latestfirst=False,
+        return (
+            spark.readStream.format("parquet")
+            .schema(schema)
+            .option("basePath", path)
+            .option("path", path)
+            .option("latestFirst", False)
+            .load()
         )
+    return spark.read.format("parquet").schema(schema).load(path)
 
-        # load all GCN since the beginning
-        gcn_alert = connect_to_raw_database(
-            gcn_path,
-            gcn_path,
-            latestfirst=False,
-        )
+
+def gcn_time_window(
+    night: str, time_window: int, load_mode: DataMode
+) -> Tuple[Time, Time]:
+    """
+    Return the trigger time window of the gcn joined with the alerts of the night
+
+    Parameters
+    ----------
+    night : string
+        the processed night, format: YYYYMMDD
+    time_window : integer
+        the number of days before the night to look for gcn (offline only)
+    load_mode : DataMode
+        STREAMING or OFFLINE
+
+    Returns
+    -------
+    Tuple[Time, Time]
+        the start and the end (excluded) of the time window
+
+    Examples
+    --------
+    >>> [t.iso for t in gcn_time_window("20240115", 7, DataMode.STREAMING)]
+    ['2024-01-14 17:00:00.000', '2024-01-15 17:00:00.000']
+    >>> [t.iso for t in gcn_time_window("20240115", 7, DataMode.OFFLINE)]
+    ['2024-01-07 17:00:00.000', '2024-01-15 18:00:00.000']
+    """
+    cur_time = Time(f"{night[0:4]}-{night[4:6]}-{night[6:8]}")
+    if load_mode == DataMode.STREAMING:
         # keep gcn emitted between the last day time and the end of the current stream (17:00 Paris Time)
-        cur_time = Time(f"{night[0:4]}-{night[4:6]}-{night[6:8]}")
         last_time = cur_time - timedelta(hours=7)  # 17:00 Paris time yesterday
         end_time = cur_time + timedelta(hours=17)  # 17:00 Paris time today
-
     elif load_mode == DataMode.OFFLINE:
-        ztf_alert = (
+        last_time = cur_time - timedelta(
+            days=time_window, hours=7
+        )  # 17:00 Paris time yesterday
+        end_time = cur_time + timedelta(hours=18)  # 18:00 Paris time today
+    return last_time, end_time
+
+
+def gcn_partitions(last_time: Time, end_time: Time) -> list:
+    """
+    Return the day partitions of the gcn storage containing the gcn
+    with a trigger time in [last_time, end_time).
+    The gcn storage is partitioned by the date of the trigger time.
+
+    Parameters
+    ----------
+    last_time : Time
+        the start of the time window
+    end_time : Time
+        the end of the time window, excluded
+
+    Returns
+    -------
+    list
+        the partitions, relative to the root of the gcn storage
+
+    Examples
+    --------
+    >>> gcn_partitions(Time("2024-01-14 17:00:00"), Time("2024-01-16 00:00:00"))
+    ['year=2024/month=01/day=14', 'year=2024/month=01/day=15']
+    >>> gcn_partitions(Time("2023-12-31 17:00:00"), Time("2024-01-01 18:00:00"))
+    ['year=2023/month=12/day=31', 'year=2024/month=01/day=01']
+    """
+    first_day = last_time.datetime.date()
+    last_day = (end_time.datetime - timedelta(microseconds=1)).date()
+    return [
+        (first_day + timedelta(days=i)).strftime("year=%Y/month=%m/day=%d")
+        for i in range((last_day - first_day).days + 1)
+    ]
+
+
+def gcn_partition_glob(gcn_path: str, last_time: Time, end_time: Time) -> str:
+    """
+    Return the hadoop glob matching the day partitions of the time window, see gcn_partitions.
+    The glob matches only the existing partitions.
+
+    Parameters
+    ----------
+    gcn_path : string
+        the root path of the gcn storage
+    last_time : Time
+        the start of the time window
+    end_time : Time
+        the end of the time window, excluded
+
+    Returns
+    -------
+    string
+        the glob of the partitions
+
+    Examples
+    --------
+    >>> gcn_partition_glob("gcn_storage/raw", Time("2024-01-14 17:00:00"), Time("2024-01-15 17:00:00"))
+    'gcn_storage/raw/{year=2024/month=01/day=14,year=2024/month=01/day=15}'
+    """
+    return os.path.join(
+        gcn_path, "{" + ",".join(gcn_partitions(last_time, end_time)) + "}"
+    )
+
+
+def load_gcn_alerts(
+    spark: SparkSession,
+    gcn_path: str,
+    last_time: Time,
+    end_time: Time,
+    load_mode: DataMode,
+) -> DataFrame:
+    """
+    Load the gcn from the day partitions of the gcn storage covering the time window,
+    see gcn_partitions. The cost of the load depends on the time window,
+    not on the size of the gcn storage.
+
+    Parameters
+    ----------
+    spark : SparkSession
+        the current spark session
+    gcn_path : string
+        the root path of the gcn storage
+    last_time : Time
+        the start of the time window
+    end_time : Time
+        the end of the time window, excluded
+    load_mode : DataMode
+        STREAMING to connect to the gcn storage as a stream, OFFLINE to read the gcn
+
+    Returns
+    -------
+    DataFrame
+        the gcn with a trigger time in [last_time, end_time)
+
+    Examples
+    --------
+    >>> gcn_alert = load_gcn_alerts(
+    ...     spark, gcn_datatest, Time("2024-01-14 17:00:00"), Time("2024-01-15 17:00:00"), DataMode.OFFLINE
+    ... )
+    >>> gcn_alert.count(), sorted(r.day for r in gcn_alert.select("day").distinct().collect())
+    (23, [14, 15])
+
+    no gcn in the time window
+    >>> gcn_alert = load_gcn_alerts(
+    ...     spark, gcn_datatest, Time("2023-01-14 17:00:00"), Time("2023-01-15 17:00:00"), DataMode.OFFLINE
+    ... )
+    >>> gcn_alert.count(), "triggerTimejd" in gcn_alert.columns
+    (0, True)
+    """
+    partition_glob = gcn_partition_glob(gcn_path, last_time, end_time)
+    try:
+        schema = (
             spark.read.format("parquet")
+            .option("basePath", gcn_path)
             .option("mergeSchema", True)
-            .load(
-                os.path.join(
-                    ztf_path,
-                    f"archive/science/year={night[0:4]}/month={night[4:6]}/day={night[6:8]}",
-                )
-            )
+            .load(partition_glob)
+            .schema
         )
+        window_is_empty = False
+    except AnalysisException:
+        # no gcn in the time window yet, the schema is taken from the gcn storage
+        schema = spark.read.format("parquet").load(gcn_path).schema
+        window_is_empty = True
 
+    if load_mode == DataMode.STREAMING:
         gcn_alert = (
-            spark.read.format("parquet").option("mergeSchema", True).load(gcn_path)
+            spark.readStream.format("parquet")
+            .schema(schema)
+            .option("basePath", gcn_path)
+            .option("path", partition_glob)
+            .option("latestFirst", False)
+            .load()
+        )
+    elif window_is_empty:
+        gcn_alert = spark.createDataFrame([], schema)
+    else:
+        gcn_alert = (
+            spark.read.format("parquet")
+            .schema(schema)
+            .option("basePath", gcn_path)
+            .load(partition_glob)
         )
-        cur_time = Time(f"{night[0:4]}-{night[4:6]}-{night[6:8]}")
-        last_time = cur_time - timedelta(
-            days=time_window, hours=7
-        )  # 17:00 Paris time yesterday
-        end_time = cur_time + timedelta(hours=18)  # 18:00 Paris time today
 
-    gcn_alert = gcn_alert.filter(
+    # the partitions contain the whole first and last days of the window
+    return gcn_alert.filter(
         f"triggerTimejd >= {last_time.jd} and triggerTimejd < {end_time.jd}"
     )
+
+
+def load_dataframe(
+    spark: SparkSession,
+    ztf_path: str,
+    gcn_path: str,
+    night: str,
+    time_window: int,
+    load_mode: DataMode,
+    candidate_fields: list = ZTF_CANDIDATE_FIELDS,
+) -> Tuple[DataFrame, DataFrame]:
+    """
+    Load the ztf alerts of the night and the gcn emitted during the time window.
+    The ztf alerts are read with a fixed read schema restricted to the columns used by the join,
+    the filters applied to both dataframe are pushed to the parquet scan by spark.
+
+    Parameters
+    ----------
+    spark : SparkSession
+        the current spark session
+    ztf_path : string
+        the root path of the ztf science database
+    gcn_path : string
+        the root path of the gcn storage
+    night : string
+        the processed night, format: YYYYMMDD
+    time_window : integer
+        the number of days before the night to look for gcn (offline only)
+    load_mode : DataMode
+        STREAMING or OFFLINE
+    candidate_fields : list
+        the fields of the ztf candidate to read, see ZTF_CANDIDATE_FIELDS
+
+    Returns
+    -------
+    Tuple[DataFrame, DataFrame]
+        the ztf alerts and the gcn
+
+    Examples
+    --------
+    >>> ztf_alert, gcn_alert = load_dataframe(
+    ...     spark, ztf_datatest, gcn_datatest, "20240115", 7, DataMode.OFFLINE
+    ... )
+    >>> ztf_alert.count(), gcn_alert.count()
+    (849, 54)
+    >>> "prv_candidates" in ztf_alert.columns
+    False
+    """
+    if load_mode == DataMode.STREAMING:
+        # connection to the ztf science stream
+        ztf_alert = load_ztf_alerts(
+            spark,
+            os.path.join(ztf_path, f"online/science/{night}"),
+            load_mode,
+            candidate_fields,
+        )
+
+    elif load_mode == DataMode.OFFLINE:
+        ztf_alert = load_ztf_alerts(
+            spark,
+            os.path.join(
+                ztf_path,
+                f"archive/science/year={night[0:4]}/month={night[4:6]}/day={night[6:8]}",
+            ),
+            load_mode,
+            candidate_fields,
+        )
+
+    last_time, end_time = gcn_time_window(night, time_window, load_mode)
+    gcn_alert = load_gcn_alerts(spark, gcn_path, last_time, end_time, load_mode)
     return ztf_alert, gcn_alert
 
 
@@ -238,20 +614,55 @@ def write_dataframe(
     logs: bool,
     test: bool,
     write_mode: DataMode,
+    output_format: OutputFormat = OutputFormat.WIDE,
+    process_batch: Callable[[DataFrame], DataFrame] = None,
+    skymap_store: str = None,
 ):
+    if skymap_store is not None:
+        # the skymaps moved to the skymap store by the gcn stream are put back in the
+        # raw_event of the persisted rows, the join outputs are readable without the store
+        rehydrate = rehydrate_raw_event(skymap_store)
+        rehydrate_cols = ["observatory", "triggerId", "gcn_status", "raw_event"]
+        if process_batch is None:
+            df_join = df_join.withColumn("raw_event", rehydrate(*rehydrate_cols))
+        else:
+            join_batch = process_batch
+
+            def process_batch(batch_df: DataFrame) -> DataFrame:
+                return join_batch(batch_df).withColumn(
+                    "raw_event", rehydrate(*rehydrate_cols)
+                )
+
     if write_mode == DataMode.STREAMING:
         grbdatapath = write_path + "/online"
         checkpointpath_grb_tmp = write_path + "/online_checkpoint"
 
-        query_grb = (
-            df_join.writeStream.outputMode("append")
-            .format("parquet")
-            .option("checkpointLocation", checkpointpath_grb_tmp)
-            .option("path", grbdatapath)
-            .partitionBy("year", "month", "day")
-            .trigger(processingTime="{} seconds".format(tinterval))
-            .start()
-        )
+        if output_format == OutputFormat.WIDE and process_batch is None:
+            query_grb = (
+                df_join.writeStream.outputMode("append")
+                .format("parquet")
+                .option("checkpointLocation", checkpointpath_grb_tmp)
+                .option("path", grbdatapath)
+                .partitionBy("year", "month", "day")
+                .trigger(processingTime="{} seconds".format(tinterval))
+                .start()
+            )
+        else:
+            # the two tables of the normalised output are written by each micro-batch,
+            # process_batch computes the join of the micro-batch before the write
+            if process_batch is None:
+                process_batch = lambda batch_df: batch_df  # noqa: E731
+            query_grb = (
+                df_join.writeStream.outputMode("append")
+                .option("checkpointLocation", checkpointpath_grb_tmp)
+                .foreachBatch(
+                    lambda batch_df, _: write_join_output(
+                        process_batch(batch_df), grbdatapath, output_format
+                    )
+                )
+                .trigger(processingTime="{} seconds".format(tinterval))
+                .start()
+            )
         logger.info("Stream launching successfull")
 
         class RepeatTimer(Timer):
@@ -322,9 +733,7 @@ def write_dataframe(
 
         grbxztf_write_path = write_path + "/offline"
 
-        df_join.write.mode("append").partitionBy("year", "month", "day").parquet(
-            grbxztf_write_path
-        )
+        write_join_output(df_join, grbxztf_write_path, output_format)
         return
 
 
@@ -335,28 +744,33 @@ def ztf_pre_join(
     pansstar_star_score: float,
     gaia_dist: float,
     NSIDE: int,
+    join_mode: JoinMode = JoinMode.HPIX,
 ) -> DataFrame:
-    ztf_dataframe = ztf_dataframe.drop(
-        "candid",
-        "schemavsn",
-        "publisher",
-        "cutoutScience",
-        "cutoutTemplate",
-        "cutoutDifference",
-        "year",
-        "month",
-        "day",
-    )
+    # no-op for the alerts loaded by load_dataframe, these columns are not read
+    ztf_dataframe = ztf_dataframe.drop(*ZTF_UNUSED_COLUMNS, "year", "month", "day")
 
     ztf_dataframe = ztf_grb_filter(
         ztf_dataframe, ast_dist, pansstar_dist, pansstar_star_score, gaia_dist
     )
 
-    # compute pixels for ztf alerts
-    ztf_dataframe = ztf_dataframe.withColumn(
-        "hpix",
-        ang2pix(ztf_dataframe.candidate.ra, ztf_dataframe.candidate.dec, F.lit(NSIDE)),
-    )
+    if join_mode in RANGE_JOIN_MODES:
+        # compute the nested pixels at the MOC order for ztf alerts
+        # and the bucket (pixel at the NSIDE order) containing them
+        ztf_dataframe = ztf_dataframe.withColumn(
+            "hpix_moc",
+            ang2nest(ztf_dataframe.candidate.ra, ztf_dataframe.candidate.dec),
+        )
+        ztf_dataframe = ztf_dataframe.withColumn(
+            "hpix", F.shiftright("hpix_moc", moc_bucket_shift(NSIDE))
+        )
+    else:
+        # compute pixels for ztf alerts
+        ztf_dataframe = ztf_dataframe.withColumn(
+            "hpix",
+            ang2pix(
+                ztf_dataframe.candidate.ra, ztf_dataframe.candidate.dec, F.lit(NSIDE)
+            ),
+        )
 
     ztf_dataframe = ztf_dataframe.withColumn("ztf_ra", col("candidate.ra")).withColumn(
         "ztf_dec", col("candidate.dec")
@@ -364,17 +778,146 @@ def ztf_pre_join(
     return ztf_dataframe
 
 
+def with_footprint(
+    gcn_dataframe: DataFrame,
+    footprint_column: str,
+    precomputed_column: str,
+    footprint_type: DataType,
+    compute_footprint: Callable[[Column], Column],
+) -> DataFrame:
+    """
+    Add the footprint column to the gcn dataframe.
+    The footprint is read from the precomputed column if the gcn stream has stored it,
+    otherwise it is computed. The observatory name is set to null for the gcn with a precomputed footprint
+    so the footprint udf skips them.
+
+    Parameters
+    ----------
+    gcn_dataframe: DataFrame
+        the gcn dataframe
+    footprint_column: string
+        the name of the footprint column used by the join
+    precomputed_column: string
+        the name of the column precomputed by the gcn stream
+    footprint_type: DataType
+        the type of the footprint column
+    compute_footprint: function
+        return the footprint udf for the given observatory column
+
+    Returns
+    -------
+    DataFrame
+        the gcn dataframe with the footprint column
+
+    Examples
+    --------
+    >>> from fink_mm.gcn_stream.gcn_footprint import add_footprint_columns
+    >>> from fink_mm.gcn_stream.gcn_writer import write_gcn_dataframe
+    >>> pdf = pd.read_parquet(grb_data).assign(year="2024", month="01", day="15")
+    >>> compute = lambda gcn: lambda obsname: get_pixels(
+    ...     obsname, gcn.ra, gcn.dec, gcn.err_arcmin, gcn.raw_event, F.lit(4)
+    ... )
+    >>> gcn = spark.read.format("parquet").load(grb_data)
+    >>> footprint = with_footprint(gcn, "hpix_circle", "footprint_hpix_4", ArrayType(IntegerType()), compute(gcn))
+
+    the gcn written with the precomputed footprint and the older gcn are read together
+    >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+    >>> write_gcn_dataframe(add_footprint_columns(pdf.iloc[::2], [4]), tmp_dir_gcn.name, "footprint")
+    >>> write_gcn_dataframe(pdf.iloc[1::2], tmp_dir_gcn.name, "no_footprint")
+    >>> precomputed_gcn = spark.read.format("parquet").option("mergeSchema", True).load(tmp_dir_gcn.name)
+    >>> precomputed_gcn.filter(col("footprint_hpix_4").isNull()).count()
+    11
+    >>> precomputed_footprint = with_footprint(
+    ...     precomputed_gcn, "hpix_circle", "footprint_hpix_4", ArrayType(IntegerType()), compute(precomputed_gcn)
+    ... )
+    >>> key = ["triggerId", "gcn_status", "hpix_circle"]
+    >>> footprint.select(key).orderBy(key).collect() == precomputed_footprint.select(key).orderBy(key).collect()
+    True
+    """
+    if precomputed_column not in gcn_dataframe.columns:
+        return gcn_dataframe.withColumn(
+            footprint_column, compute_footprint(col("observatory"))
+        )
+
+    is_missing = col(precomputed_column).isNull()
+    return gcn_dataframe.withColumn(
+        footprint_column,
+        F.coalesce(
+            col(precomputed_column).cast(footprint_type),
+            compute_footprint(F.when(is_missing, col("observatory"))),
+        ),
+    )
+
+
 def gcn_pre_join(
     gcn_dataframe: DataFrame,
     NSIDE: int,
     test: bool,
+    join_mode: JoinMode = JoinMode.HPIX,
 ) -> Tuple[DataFrame, DataFrame]:
     gcn_dataframe = gcn_dataframe.drop("year").drop("month").drop("day")
 
-    # compute pixels for gcn alerts
+    # the footprints precomputed by the gcn stream are read from the gcn columns,
+    # the footprints of the older gcn are computed: the circular footprints from the
+    # ra, dec and err_arcmin columns, the skymaps from the raw event
+    if join_mode in RANGE_JOIN_MODES:
+        # the ranges are bucketed by the pixels at the NSIDE order (see below),
+        # an adaptive footprint coarser than the buckets would be exploded into all the buckets
+        # of its pixels so the adaptive order is at least the NSIDE order
+        bucket_order = hp.nside2order(NSIDE)
+        if (
+            join_mode == JoinMode.ADAPTIVE
+            and FOOTPRINT_ADAPTIVE in gcn_dataframe.columns
+        ):
+            gcn_dataframe = gcn_dataframe.withColumn(
+                FOOTPRINT_ADAPTIVE,
+                bound_adaptive_ranges(
+                    FOOTPRINT_ADAPTIVE, FOOTPRINT_MOC, F.lit(bucket_order)
+                ),
+            )
+
+        # compute the footprint of the gcn alerts as nested pixel ranges
+        gcn_dataframe = with_footprint(
+            gcn_dataframe,
+            "hpix_moc",
+            FOOTPRINT_ADAPTIVE if join_mode == JoinMode.ADAPTIVE else FOOTPRINT_MOC,
+            ArrayType(LongType()),
+            lambda obsname: get_moc_ranges(
+                obsname,
+                gcn_dataframe.ra,
+                gcn_dataframe.dec,
+                gcn_dataframe.err_arcmin,
+                gcn_dataframe.raw_event,
+                F.lit(join_mode == JoinMode.ADAPTIVE),
+                F.lit(bucket_order),
+            ),
+        )
+    else:
+        # compute pixels for gcn alerts
+        gcn_dataframe = with_footprint(
+            gcn_dataframe,
+            "hpix_circle",
+            footprint_hpix_column(NSIDE),
+            ArrayType(IntegerType()),
+            lambda obsname: get_pixels(
+                obsname,
+                gcn_dataframe.ra,
+                gcn_dataframe.dec,
+                gcn_dataframe.err_arcmin,
+                gcn_dataframe.raw_event,
+                F.lit(NSIDE),
+            ),
+        )
+
+    # the ztf alerts detected after the maximum delay of the observatory are not joined
     gcn_dataframe = gcn_dataframe.withColumn(
-        "hpix_circle",
-        get_pixels(gcn_dataframe.observatory, gcn_dataframe.raw_event, F.lit(NSIDE)),
+        "max_jdstarthist",
+        max_jdstarthist(gcn_dataframe.observatory, gcn_dataframe.triggerTimejd),
+    )
+
+    # the precomputed footprints are not part of the join output
+    gcn_dataframe = gcn_dataframe.drop(
+        *[c for c in gcn_dataframe.columns if c.startswith("footprint_")]
     )
 
     # if not test:
@@ -384,12 +927,43 @@ def gcn_pre_join(
     #         remove_skymap(gcn_dataframe.observatory, gcn_dataframe.raw_event),
     #     )
 
-    gcn_rawevent = gcn_dataframe.select(["triggerId", "raw_event"]).withColumnRenamed(
-        "triggerId", "gcn_trigId"
+    gcn_rawevent = (
+        gcn_dataframe.select(["observatory", "triggerId", "gcn_status", "raw_event"])
+        .withColumnRenamed("observatory", "gcn_raw_obs")
+        .withColumnRenamed("triggerId", "gcn_trigId")
+        .withColumnRenamed("gcn_status", "gcn_raw_status")
     )
     gcn_dataframe = gcn_dataframe.drop("raw_event")
 
-    gcn_dataframe = gcn_dataframe.withColumn("hpix", explode("hpix_circle"))
+    if join_mode in RANGE_JOIN_MODES:
+        # one row for each range of the footprint ...
+        gcn_dataframe = gcn_dataframe.filter(F.size("hpix_moc") > 0).withColumn(
+            "moc_range",
+            explode(
+                F.expr(
+                    "transform(sequence(0, size(hpix_moc) div 2 - 1), i -> slice(hpix_moc, 2 * i + 1, 2))"
+                )
+            ),
+        )
+        gcn_dataframe = (
+            gcn_dataframe.withColumn("moc_start", col("moc_range")[0])
+            .withColumn("moc_end", col("moc_range")[1])
+            .drop("hpix_moc", "moc_range")
+        )
+
+        # ... and for each bucket overlapped by the range
+        shift = moc_bucket_shift(NSIDE)
+        gcn_dataframe = gcn_dataframe.withColumn(
+            "hpix",
+            explode(
+                F.sequence(
+                    F.shiftright("moc_start", shift),
+                    F.shiftright(col("moc_end") - 1, shift),
+                )
+            ),
+        )
+    else:
+        gcn_dataframe = gcn_dataframe.withColumn("hpix", explode("hpix_circle"))
 
     gcn_dataframe = gcn_dataframe.withColumnRenamed("ra", "gcn_ra").withColumnRenamed(
         "dec", "gcn_dec"
@@ -398,6 +972,132 @@ def gcn_pre_join(
     return gcn_dataframe, gcn_rawevent
 
 
+def join_gcn(
+    ztf_dataframe: DataFrame,
+    gcn_dataframe: DataFrame,
+    gcn_rawevent: DataFrame,
+    gcn_events: Broadcast,
+    join_strategy: JoinStrategy,
+    rawevent_strategy: JoinStrategy,
+    hdfs_adress: str,
+    gcn_datapath_prefix: str,
+    join_mode: JoinMode = JoinMode.HPIX,
+) -> DataFrame:
+    """
+    Join the ztf alerts and the gcn returned by ztf_pre_join and gcn_pre_join,
+    then apply the post processing and add the partitioning columns.
+
+    Parameters
+    ----------
+    ztf_dataframe : DataFrame
+        the ztf alerts, see ztf_pre_join
+    gcn_dataframe : DataFrame
+        the gcn footprints, see gcn_pre_join
+    gcn_rawevent : DataFrame
+        the raw events of the gcn, see gcn_pre_join. Not used if gcn_events is given.
+    gcn_events : Broadcast
+        the broadcasted GcnEventBatch of the gcn for the compact join, None otherwise
+    join_strategy : JoinStrategy
+        the strategy of the join between the ztf alerts and the gcn footprints, see plan_join
+    rawevent_strategy : JoinStrategy
+        the strategy of the join with the raw events, see plan_rawevent_join.
+        Not used if gcn_events is given.
+    hdfs_adress : string
+        HDFS adress used to instanciate the hdfs client from the hdfs package
+    gcn_datapath_prefix : string
+        the prefix path where are stored the gcn alerts.
+    join_mode : JoinMode
+        the join algorithm between the ztf alerts and the gcn footprints
+
+    Returns
+    -------
+    DataFrame
+        the join dataframe
+    """
+    # join the two streams according to the healpix columns.
+    # A pixel id will be assign to each alerts / gcn according to their position in the sky.
+    # Each alerts / gcn with the same pixel id are in the same area of the sky.
+    join_condition = [
+        ztf_dataframe.hpix == gcn_dataframe.hpix,
+        ztf_dataframe.candidate.jdstarthist > gcn_dataframe.triggerTimejd,
+        ztf_dataframe.candidate.jdstarthist <= gcn_dataframe.max_jdstarthist,
+        # the pairs too far apart for the association probability are never materialised
+        circle_association_condition(
+            gcn_dataframe.observatory,
+            ztf_dataframe.ztf_ra,
+            ztf_dataframe.ztf_dec,
+            gcn_dataframe.gcn_ra,
+            gcn_dataframe.gcn_dec,
+            gcn_dataframe.err_arcmin,
+        ),
+    ]
+    if join_mode in RANGE_JOIN_MODES:
+        # within a bucket, keep the alerts falling in the pixel range of the gcn footprint.
+        # In adaptive mode, the ranges are aligned on the pixels at the join order of the gcn
+        # so this is the same as degrading the alert pixel to the gcn order.
+        join_condition += [
+            ztf_dataframe.hpix_moc >= gcn_dataframe.moc_start,
+            ztf_dataframe.hpix_moc < gcn_dataframe.moc_end,
+        ]
+    # multi_messenger join to combine optical stream with other streams
+    df_join_mm = join_with_strategy(
+        gcn_dataframe, ztf_dataframe, join_condition, join_strategy
+    )
+
+    if gcn_events is not None:
+        df_join_mm = df_join_mm.dropDuplicates(["objectId", "triggerId", "gcn_status"])
+    else:
+        # combine the multi-messenger join with the raw_event removed previously to save memory
+        df_join_mm = (
+            join_with_strategy(
+                gcn_rawevent,
+                df_join_mm,
+                [
+                    df_join_mm.observatory == gcn_rawevent.gcn_raw_obs,
+                    df_join_mm.triggerId == gcn_rawevent.gcn_trigId,
+                    df_join_mm.gcn_status == gcn_rawevent.gcn_raw_status,
+                ],
+                rawevent_strategy,
+            )
+            .drop("gcn_raw_obs", "gcn_trigId", "gcn_raw_status")
+            .dropDuplicates(
+                ["objectId", "triggerId", "gcn_status"]
+            )  # makes the inner join a natural join
+        )
+
+    df_join_mm = join_post_process(
+        df_join_mm, hdfs_adress, gcn_datapath_prefix, gcn_events
+    )
+
+    if gcn_events is not None:
+        # add the raw_event to the rows kept by the association filter
+        df_join_mm = df_join_mm.withColumn(
+            "raw_event",
+            get_raw_event_by_key(gcn_events)(
+                df_join_mm["observatory"],
+                df_join_mm["triggerId"],
+                df_join_mm["gcn_status"],
+            ),
+        )
+
+    # re-create partitioning columns if needed.
+    timecol = "jd"
+    converter = lambda x: convert_to_datetime(x)  # noqa: E731
+    if "timestamp" not in df_join_mm.columns:
+        df_join_mm = df_join_mm.withColumn("timestamp", converter(df_join_mm[timecol]))
+
+    if "year" not in df_join_mm.columns:
+        df_join_mm = df_join_mm.withColumn("year", F.date_format("timestamp", "yyyy"))
+
+    if "month" not in df_join_mm.columns:
+        df_join_mm = df_join_mm.withColumn("month", F.date_format("timestamp", "MM"))
+
+    if "day" not in df_join_mm.columns:
+        df_join_mm = df_join_mm.withColumn("day", F.date_format("timestamp", "dd"))
+
+    return df_join_mm
+
+
 def ztf_join_gcn_stream(
     mm_mode: DataMode,
     ztf_dataframe: DataFrame,
@@ -411,6 +1111,8 @@ def ztf_join_gcn_stream(
     pansstar_star_score: float,
     gaia_dist: float,
     test: bool = False,
+    join_mode: JoinMode = JoinMode.HPIX,
+    compact_join: bool = False,
 ) -> Tuple[DataFrame, SparkSession]:
     """
     Perform the join stream and return the dataframe
@@ -441,6 +1143,12 @@ def ztf_join_gcn_stream(
     gaia_dist: float
         Distance to closest source from Gaia DR1 catalog irrespective of magnitude; if exists within 90 arcsec [arcsec]
         neargaia field
+    join_mode: JoinMode
+        the join algorithm between the ztf alerts and the gcn footprints
+    compact_join: boolean
+        if True, only the gcn key goes through the join and the raw events are broadcasted,
+        the raw_event column is added after the association filter.
+        Ignored if the gcn dataframe is a stream.
 
     Returns
     -------
@@ -458,50 +1166,291 @@ def ztf_join_gcn_stream(
         "science2mm_{}_{}{}{}".format(job_name, night[0:4], night[4:6], night[6:8])
     )
 
+    if compact_join and gcn_dataframe.isStreaming:
+        logger = init_logging()
+        logger.warning(
+            "compact join ignored, the raw events cannot be collected from a gcn stream"
+        )
+        compact_join = False
+
+    # choose the side to broadcast from the size of the gcn footprints and the ztf batch
+    join_strategy = plan_join(spark, ztf_dataframe, gcn_dataframe, NSIDE, join_mode)
+
+    if compact_join:
+        # the raw events are sent once to each executor instead of once per matched row
+        gcn_events = spark.sparkContext.broadcast(collect_gcn_events(gcn_dataframe))
+        rawevent_strategy = None
+    else:
+        gcn_events = None
+        rawevent_strategy = plan_rawevent_join(spark, gcn_dataframe)
+
     ztf_dataframe = ztf_pre_join(
-        ztf_dataframe, ast_dist, pansstar_dist, pansstar_star_score, gaia_dist, NSIDE
+        ztf_dataframe,
+        ast_dist,
+        pansstar_dist,
+        pansstar_star_score,
+        gaia_dist,
+        NSIDE,
+        join_mode,
     )
-    gcn_dataframe, gcn_rawevent = gcn_pre_join(gcn_dataframe, NSIDE, test)
-
-    # join the two streams according to the healpix columns.
-    # A pixel id will be assign to each alerts / gcn according to their position in the sky.
-    # Each alerts / gcn with the same pixel id are in the same area of the sky.
-    join_condition = [
-        ztf_dataframe.hpix == gcn_dataframe.hpix,
-        ztf_dataframe.candidate.jdstarthist > gcn_dataframe.triggerTimejd,
-    ]
-    # multi_messenger join to combine optical stream with other streams
-    df_join_mm = gcn_dataframe.join(F.broadcast(ztf_dataframe), join_condition, "inner")
+    gcn_dataframe, gcn_rawevent = gcn_pre_join(gcn_dataframe, NSIDE, test, join_mode)
 
-    # combine the multi-messenger join with the raw_event removed previously to save memory
-    df_join_mm = (
-        gcn_rawevent.join(
-            F.broadcast(df_join_mm),
-            [df_join_mm.triggerId == gcn_rawevent.gcn_trigId],
-            "inner",
-        )
-        .drop("gcn_trigId")
-        .dropDuplicates(["objectId", "triggerId", "gcn_status"])  # makes the inner join a natural join
+    df_join_mm = join_gcn(
+        ztf_dataframe,
+        gcn_dataframe,
+        gcn_rawevent,
+        gcn_events,
+        join_strategy,
+        rawevent_strategy,
+        hdfs_adress,
+        gcn_datapath_prefix,
+        join_mode,
     )
+    return df_join_mm, spark
 
-    df_join_mm = join_post_process(df_join_mm, hdfs_adress, gcn_datapath_prefix)
 
-    # re-create partitioning columns if needed.
-    timecol = "jd"
-    converter = lambda x: convert_to_datetime(x)  # noqa: E731
-    if "timestamp" not in df_join_mm.columns:
-        df_join_mm = df_join_mm.withColumn("timestamp", converter(df_join_mm[timecol]))
+class GcnWindow:
+    """
+    The gcn of the time window of the online join as a cached static table.
+    The footprints of the gcn are computed once when the window is loaded and
+    each micro-batch of ztf alerts is joined with the cached footprints.
+    The window is loaded again only when the gcn stream writes new notices,
+    detected from the listing of the files of the window partitions.
+    """
 
-    if "year" not in df_join_mm.columns:
-        df_join_mm = df_join_mm.withColumn("year", F.date_format("timestamp", "yyyy"))
+    def __init__(
+        self,
+        spark: SparkSession,
+        gcn_path: str,
+        last_time: Time,
+        end_time: Time,
+        NSIDE: int,
+        test: bool = False,
+        join_mode: JoinMode = JoinMode.HPIX,
+        compact_join: bool = False,
+    ):
+        """
+        Initialise the window, the gcn are loaded by the first call to refresh
+
+        Parameters
+        ----------
+        spark : SparkSession
+            the current spark session
+        gcn_path : string
+            the root path of the gcn storage
+        last_time : Time
+            the start of the time window
+        end_time : Time
+            the end of the time window, excluded
+        NSIDE : integer
+            Healpix map resolution, better if a power of 2
+        test : boolean
+            if True, the gcn_pre_join is run in test mode
+        join_mode : JoinMode
+            the join algorithm between the ztf alerts and the gcn footprints
+        compact_join : boolean
+            if True, the raw events of the window are broadcasted, see ztf_join_gcn_stream
+
+        Example
+        -------
+        >>> gcn_window = GcnWindow(
+        ...     spark, gcn_datatest, Time("2024-01-14 17:00:00"), Time("2024-01-15 17:00:00"), 4
+        ... )
+        >>> gcn_window.files is None, gcn_window.gcn_dataframe is None
+        (True, True)
+        """
+        self.spark = spark
+        self.gcn_path = gcn_path
+        self.last_time = last_time
+        self.end_time = end_time
+        self.NSIDE = NSIDE
+        self.test = test
+        self.join_mode = join_mode
+        self.compact_join = compact_join
+
+        self.files = None
+        self.gcn_dataframe = None
+        self.gcn_rawevent = None
+        self.gcn_events = None
+        self.join_strategy = None
+        self.rawevent_strategy = None
+
+    def list_files(self) -> list:
+        """
+        List the gcn files of the window partitions
+
+        Returns
+        -------
+        list
+            the sorted (path, size, modification time) of the files
+
+        Example
+        -------
+        >>> gcn_window = GcnWindow(
+        ...     spark, gcn_datatest, Time("2024-01-14 17:00:00"), Time("2024-01-15 17:00:00"), 4
+        ... )
+        >>> sorted({os.path.basename(os.path.dirname(f[0])) for f in gcn_window.list_files()})
+        ['day=14', 'day=15']
+        """
+        jvm = self.spark._jvm
+        files_glob = jvm.org.apache.hadoop.fs.Path(
+            gcn_partition_glob(self.gcn_path, self.last_time, self.end_time) + "/*"
+        )
+        fs = files_glob.getFileSystem(self.spark._jsc.hadoopConfiguration())
+        statuses = fs.globStatus(files_glob) or []
+        return sorted(
+            (str(status.getPath()), status.getLen(), status.getModificationTime())
+            for status in statuses
+            # the files starting with an underscore or a dot are ignored by spark
+            if status.isFile() and not status.getPath().getName().startswith(("_", "."))
+        )
 
-    if "month" not in df_join_mm.columns:
-        df_join_mm = df_join_mm.withColumn("month", F.date_format("timestamp", "MM"))
+    def refresh(self, ztf_dataframe: DataFrame) -> bool:
+        """
+        Load the gcn of the window if the gcn files have changed since the last load.
+        The footprints are computed and cached, the previous window is released.
+        If the load fails, the previous window is kept and the load is retried at the next call.
+
+        Parameters
+        ----------
+        ztf_dataframe : DataFrame
+            the ztf alerts stream, used to choose the join strategy
+
+        Returns
+        -------
+        boolean
+            True if the window has been loaded
+
+        Example
+        -------
+        >>> import shutil
+        >>> from fink_mm.gcn_stream.gcn_writer import write_gcn_dataframe
+        >>> tmp_dir_gcn = tempfile.TemporaryDirectory()
+        >>> gcn_root = os.path.join(tmp_dir_gcn.name, "raw")
+        >>> _ = shutil.copytree(gcn_datatest, gcn_root)
+        >>> ztf_stream = load_ztf_alerts(spark, alert_data, DataMode.STREAMING)
+        >>> gcn_window = GcnWindow(
+        ...     spark, gcn_root, Time("2024-01-14 17:00:00"), Time("2024-01-15 17:00:00"), 4
+        ... )
+        >>> gcn_window.refresh(ztf_stream), gcn_window.refresh(ztf_stream)
+        (True, False)
+        >>> nb_rows = gcn_window.gcn_dataframe.count()
+
+        a new notice written by the gcn stream reloads the window
+        >>> gcn = pd.read_parquet(grb_data).iloc[[0]].assign(
+        ...     triggerId="new_trigger", triggerTimejd=Time("2024-01-15 12:00:00").jd,
+        ...     year="2024", month="01", day="15"
+        ... )
+        >>> write_gcn_dataframe(gcn, gcn_root, "new_notice")
+        >>> gcn_window.refresh(ztf_stream), gcn_window.gcn_dataframe.count() > nb_rows
+        (True, True)
+        """
+        files = self.list_files()
+        if files == self.files:
+            return False
+
+        try:
+            gcn_dataframe = load_gcn_alerts(
+                self.spark,
+                self.gcn_path,
+                self.last_time,
+                self.end_time,
+                # the window is a static table
+                DataMode.OFFLINE,
+            )
+            join_strategy = plan_join(
+                self.spark, ztf_dataframe, gcn_dataframe, self.NSIDE, self.join_mode
+            )
+            if self.compact_join:
+                gcn_events = self.spark.sparkContext.broadcast(
+                    collect_gcn_events(gcn_dataframe)
+                )
+                rawevent_strategy = None
+            else:
+                gcn_events = None
+                rawevent_strategy = plan_rawevent_join(self.spark, gcn_dataframe)
 
-    if "day" not in df_join_mm.columns:
-        df_join_mm = df_join_mm.withColumn("day", F.date_format("timestamp", "dd"))
+            gcn_dataframe, gcn_rawevent = gcn_pre_join(
+                gcn_dataframe, self.NSIDE, self.test, self.join_mode
+            )
+            gcn_dataframe = gcn_dataframe.persist()
+            nb_rows = gcn_dataframe.count()
+            if gcn_events is None:
+                gcn_rawevent = gcn_rawevent.persist()
+                gcn_rawevent.count()
+        except Exception:
+            if self.files is None:
+                raise
+            init_logging().error(
+                "loading of the gcn window failed, the previous window is kept",
+                exc_info=1,
+            )
+            return False
+
+        self.unpersist()
+        self.files = files
+        self.gcn_dataframe = gcn_dataframe
+        self.gcn_rawevent = gcn_rawevent
+        self.gcn_events = gcn_events
+        self.join_strategy = join_strategy
+        self.rawevent_strategy = rawevent_strategy
+        init_logging().info(
+            "gcn window loaded: {} gcn files, {} footprint rows".format(
+                len(files), nb_rows
+            )
+        )
+        return True
 
-    return df_join_mm, spark
+    def unpersist(self):
+        """
+        Release the cached gcn of the window
+        """
+        if self.gcn_dataframe is not None:
+            self.gcn_dataframe.unpersist()
+        if self.gcn_rawevent is not None:
+            self.gcn_rawevent.unpersist()
+        if self.gcn_events is not None:
+            self.gcn_events.unpersist()
+
+    def join(self, ztf_dataframe: DataFrame, hdfs_adress: str) -> DataFrame:
+        """
+        Join a micro-batch of ztf alerts with the gcn of the window, see join_gcn
+
+        Parameters
+        ----------
+        ztf_dataframe : DataFrame
+            the ztf alerts returned by ztf_pre_join
+        hdfs_adress : string
+            HDFS adress used to instanciate the hdfs client from the hdfs package
+
+        Returns
+        -------
+        DataFrame
+            the join dataframe
+
+        Example
+        -------
+        >>> gcn_window = GcnWindow(
+        ...     spark, gcn_datatest, Time("2024-01-14 17:00:00"), Time("2024-01-15 17:00:00"), 4
+        ... )
+        >>> gcn_window.refresh(load_ztf_alerts(spark, alert_data, DataMode.STREAMING))
+        True
+        >>> ztf_batch = ztf_pre_join(load_ztf_alerts(spark, alert_data, DataMode.OFFLINE), 5, 2, 0, 5, 4)
+        >>> df_join = gcn_window.join(ztf_batch, "127.0.0.1")
+        >>> df_join.count()
+        204
+        """
+        return join_gcn(
+            ztf_dataframe,
+            self.gcn_dataframe,
+            self.gcn_rawevent,
+            self.gcn_events,
+            self.join_strategy,
+            self.rawevent_strategy,
+            hdfs_adress,
+            self.gcn_path,
+            self.join_mode,
+        )
 
 
 def ztf_join_gcn(
@@ -521,6 +1470,9 @@ def ztf_join_gcn(
     gaia_dist: float,
     logs: bool = False,
     test: bool = False,
+    join_mode: JoinMode = JoinMode.HPIX,
+    compact_join: bool = False,
+    output_format: OutputFormat = OutputFormat.WIDE,
 ):
     """
     Join the ztf alerts stream and the gcn stream to find the counterparts of the gcn alerts
@@ -558,6 +1510,12 @@ def ztf_join_gcn(
     gaia_dist: float
         Distance to closest source from Gaia DR1 catalog irrespective of magnitude; if exists within 90 arcsec [arcsec]
         neargaia field
+    join_mode: JoinMode
+        the join algorithm between the ztf alerts and the gcn footprints
+    compact_join: boolean
+        if True, only the gcn key goes through the join, see ztf_join_gcn_stream
+    output_format: OutputFormat
+        the layout of the join output, see fink_mm.utils.join_output
 
     Returns
     -------
@@ -583,7 +1541,7 @@ def ztf_join_gcn(
     ['DR3Name', 'Plx', 'ackTime', 'anomaly_score', 'candid', 'cdsxmatch', 'day', 'delta_time', 'e_Plx', 'event', 'fid', 'fink_class', 'from_upper', 'gcn_dec', 'gcn_loc_error', 'gcn_ra', 'gcn_status', 'gcvs', 'instrument', 'jd', 'jd_first_real_det', 'jdstarthist', 'jdstarthist_dt', 'lc_features_g', 'lc_features_r', 'lower_rate', 'mag_rate', 'magpsf', 'mangrove', 'month', 'mulens', 'nalerthist', 'objectId', 'observatory', 'p_assoc', 'raw_event', 'rb', 'rf_kn_vs_nonkn', 'rf_snia_vs_nonia', 'roid', 'sigma_rate', 'sigmapsf', 'snn_sn_vs_all', 'snn_snia_vs_nonia', 't2', 'timestamp', 'triggerId', 'triggerTimeUTC', 'upper_rate', 'vsx', 'x3hsp', 'x4lac', 'year', 'ztf_dec', 'ztf_ra']
 
     >>> len(datajoin)
-    212
+    204
 
     >>> ztf_join_gcn(
     ...     DataMode.OFFLINE,
@@ -601,10 +1559,75 @@ def ztf_join_gcn(
     ['DR3Name', 'Plx', 'ackTime', 'anomaly_score', 'candid', 'cdsxmatch', 'day', 'delta_time', 'e_Plx', 'event', 'fid', 'fink_class', 'from_upper', 'gcn_dec', 'gcn_loc_error', 'gcn_ra', 'gcn_status', 'gcvs', 'instrument', 'is_grb_bronze', 'is_grb_gold', 'is_grb_silver', 'is_gw_bronze', 'jd', 'jd_first_real_det', 'jdstarthist', 'jdstarthist_dt', 'lc_features_g', 'lc_features_r', 'lower_rate', 'mag_rate', 'magpsf', 'mangrove', 'month', 'mulens', 'nalerthist', 'objectId', 'observatory', 'p_assoc', 'raw_event', 'rb', 'rf_kn_vs_nonkn', 'rf_snia_vs_nonia', 'roid', 'sigma_rate', 'sigmapsf', 'snn_sn_vs_all', 'snn_snia_vs_nonia', 't2', 'timestamp', 'triggerId', 'triggerTimeUTC', 'upper_rate', 'vsx', 'x3hsp', 'x4lac', 'year', 'ztf_dec', 'ztf_ra']
 
     >>> len(datajoin)
-    390
+    350
+
+    >>> moc_dataoutput_dir = tempfile.TemporaryDirectory()
+    >>> ztf_join_gcn(
+    ...     DataMode.OFFLINE,
+    ...     ztf_datatest,
+    ...     gcn_datatest,
+    ...     moc_dataoutput_dir.name,
+    ...     "20240115",
+    ...     4, 100, 5, 7, "127.0.0.1", 5, 2, 0, 5, False, True, JoinMode.MOC
+    ... )
+
+    >>> len(pd.read_parquet(moc_dataoutput_dir.name + "/offline"))
+    308
+
+    >>> compact_dataoutput_dir = tempfile.TemporaryDirectory()
+    >>> ztf_join_gcn(
+    ...     DataMode.OFFLINE,
+    ...     ztf_datatest,
+    ...     gcn_datatest,
+    ...     compact_dataoutput_dir.name,
+    ...     "20240115",
+    ...     4, 100, 5, 7, "127.0.0.1", 5, 2, 0, 5, False, True, JoinMode.HPIX, True
+    ... )
+
+    >>> compact_datajoin = pd.read_parquet(compact_dataoutput_dir.name + "/offline")
+    >>> sorted(compact_datajoin.columns) == list(datajoin.columns)
+    True
+    >>> len(compact_datajoin)
+    350
+
+    >>> normalised_dataoutput_dir = tempfile.TemporaryDirectory()
+    >>> ztf_join_gcn(
+    ...     DataMode.OFFLINE,
+    ...     ztf_datatest,
+    ...     gcn_datatest,
+    ...     normalised_dataoutput_dir.name,
+    ...     "20240115",
+    ...     4, 100, 5, 7, "127.0.0.1", 5, 2, 0, 5, False, True,
+    ...     JoinMode.HPIX, False, OutputFormat.NORMALISED
+    ... )
+
+    >>> sorted(os.listdir(normalised_dataoutput_dir.name))
+    ['offline_gcn_events', 'offline_matches']
+    >>> len(pd.read_parquet(normalised_dataoutput_dir.name + "/offline_matches"))
+    350
+    >>> len(pd.read_parquet(normalised_dataoutput_dir.name + "/offline_gcn_events"))
+    20
+
+    >>> from fink_mm.utils.join_output import load_join_output
+    >>> normalised_datajoin = load_join_output(
+    ...     spark, normalised_dataoutput_dir.name + "/offline", "20240115"
+    ... ).toPandas()
+    >>> normalised_datajoin = normalised_datajoin.reindex(sorted(normalised_datajoin.columns), axis=1)
+    >>> list(normalised_datajoin.columns) == [c for c in datajoin.columns if c not in ["year", "month", "day"]]
+    True
+    >>> key = ["objectId", "candid", "triggerId", "gcn_status"]
+    >>> normalised_datajoin.sort_values(key)[["gcn_ra", "p_assoc", "raw_event"]].reset_index(drop=True).equals(
+    ...     datajoin.sort_values(key)[["gcn_ra", "p_assoc", "raw_event"]].reset_index(drop=True)
+    ... )
+    True
     """
     logger = init_logging()
 
+    # the skymap store is written by the gcn stream only on a local filesystem
+    skymap_store = skymap_store_path(gcn_datapath_prefix)
+    if not os.path.isdir(skymap_store):
+        skymap_store = None
+
     if mm_mode == DataMode.OFFLINE:
         job_name = "offline"
     elif mm_mode == DataMode.STREAMING:
@@ -613,6 +1636,55 @@ def ztf_join_gcn(
         "science2mm_{}_{}{}{}".format(job_name, night[0:4], night[4:6], night[6:8])
     )
 
+    if mm_mode == DataMode.STREAMING:
+        # the gcn of the night are a cached static table joined to each micro-batch
+        # of ztf alerts, the table is loaded again when the gcn stream writes new notices
+        ztf_stream = load_ztf_alerts(
+            spark,
+            os.path.join(ztf_datapath_prefix, f"online/science/{night}"),
+            mm_mode,
+        )
+        gcn_window = GcnWindow(
+            spark,
+            gcn_datapath_prefix,
+            *gcn_time_window(night, int(time_window), mm_mode),
+            NSIDE,
+            test,
+            join_mode,
+            compact_join,
+        )
+        gcn_window.refresh(ztf_stream)
+
+        def join_batch(ztf_batch: DataFrame) -> DataFrame:
+            gcn_window.refresh(ztf_stream)
+            return gcn_window.join(ztf_batch, hdfs_adress)
+
+        ztf_dataframe = ztf_pre_join(
+            ztf_stream,
+            ast_dist,
+            pansstar_dist,
+            pansstar_star_score,
+            gaia_dist,
+            NSIDE,
+            join_mode,
+        )
+        write_dataframe(
+            spark,
+            ztf_dataframe,
+            join_datapath_prefix,
+            logger,
+            tinterval,
+            exit_after,
+            logs,
+            test,
+            mm_mode,
+            output_format,
+            join_batch,
+            skymap_store,
+        )
+        gcn_window.unpersist()
+        return
+
     ztf_dataframe, gcn_dataframe = load_dataframe(
         spark,
         ztf_datapath_prefix,
@@ -635,6 +1707,8 @@ def ztf_join_gcn(
         pansstar_star_score,
         gaia_dist,
         test,
+        join_mode,
+        compact_join,
     )
 
     write_dataframe(
@@ -647,6 +1721,8 @@ def ztf_join_gcn(
         logs,
         test,
         mm_mode,
+        output_format,
+        skymap_store=skymap_store,
     )
 
 
@@ -679,7 +1755,7 @@ def launch_join(arguments: dict, data_mode, test: bool = False):
     ['DR3Name', 'Plx', 'ackTime', 'anomaly_score', 'candid', 'cdsxmatch', 'day', 'delta_time', 'e_Plx', 'event', 'fid', 'fink_class', 'from_upper', 'gcn_dec', 'gcn_loc_error', 'gcn_ra', 'gcn_status', 'gcvs', 'instrument', 'jd', 'jd_first_real_det', 'jdstarthist', 'jdstarthist_dt', 'lc_features_g', 'lc_features_r', 'lower_rate', 'mag_rate', 'magpsf', 'mangrove', 'month', 'mulens', 'nalerthist', 'objectId', 'observatory', 'p_assoc', 'raw_event', 'rb', 'rf_kn_vs_nonkn', 'rf_snia_vs_nonia', 'roid', 'sigma_rate', 'sigmapsf', 'snn_sn_vs_all', 'snn_snia_vs_nonia', 't2', 'timestamp', 'triggerId', 'triggerTimeUTC', 'upper_rate', 'vsx', 'x3hsp', 'x4lac', 'year', 'ztf_dec', 'ztf_ra']
 
     >>> len(datajoin)
-    212
+    204
 
     >>> launch_join({
     ...     "--config" : None,
@@ -695,7 +1771,7 @@ def launch_join(arguments: dict, data_mode, test: bool = False):
     ['DR3Name', 'Plx', 'ackTime', 'anomaly_score', 'candid', 'cdsxmatch', 'day', 'delta_time', 'e_Plx', 'event', 'fid', 'fink_class', 'from_upper', 'gcn_dec', 'gcn_loc_error', 'gcn_ra', 'gcn_status', 'gcvs', 'instrument', 'is_grb_bronze', 'is_grb_gold', 'is_grb_silver', 'is_gw_bronze', 'jd', 'jd_first_real_det', 'jdstarthist', 'jdstarthist_dt', 'lc_features_g', 'lc_features_r', 'lower_rate', 'mag_rate', 'magpsf', 'mangrove', 'month', 'mulens', 'nalerthist', 'objectId', 'observatory', 'p_assoc', 'raw_event', 'rb', 'rf_kn_vs_nonkn', 'rf_snia_vs_nonia', 'roid', 'sigma_rate', 'sigmapsf', 'snn_sn_vs_all', 'snn_snia_vs_nonia', 't2', 'timestamp', 'triggerId', 'triggerTimeUTC', 'upper_rate', 'vsx', 'x3hsp', 'x4lac', 'year', 'ztf_dec', 'ztf_ra']
 
     >>> len(datajoin)
-    390
+    350
     """
     config = get_config(arguments)
     logger = init_logging()
@@ -731,6 +1807,10 @@ def launch_join(arguments: dict, data_mode, test: bool = False):
         _,
     ) = read_grb_admin_options(arguments, config, logger)
 
+    join_mode = read_join_mode(config, logger)
+    compact_join = read_compact_join(config, logger)
+    output_format = read_output_format(config, logger)
+
     application = apps.Application.JOIN.build_application(
         logger,
         data_mode=data_mode,
@@ -749,6 +1829,9 @@ def launch_join(arguments: dict, data_mode, test: bool = False):
         logs=verbose,
         hdfs_adress=hdfs_adress,
         is_test=test,
+        join_mode=join_mode,
+        compact_join=compact_join,
+        output_format=output_format,
     )
 
     if debug:
@@ -28,6 +28,7 @@ setup(
             "observatory/observatory_schema_version_{}.json".format(
                 fink_mm.__observatory_schema_version__
             ),
+            "observatory/observatory_manifest.json",
         ]
         + [
             path.relpath(el, start="fink_mm")